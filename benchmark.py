@@ -0,0 +1,581 @@
+# This script will serve to benchmark the scoring engines on synthetic logs, so that throughput regressions can be
+# tracked from run to run. Usage: python benchmark.py [frames,frames,...] [output json], python benchmark.py --check-backends,
+# python benchmark.py --check-resampling, python benchmark.py --check-surrogates, python benchmark.py --check-sinks
+
+# -- Begin imports
+
+import numpy as np
+import pandas as pd
+
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime
+
+import config
+import jit_kernels
+import main
+import metrics_formulas as mf
+import resampling
+import result_sink
+
+# -- End imports
+
+
+# -- Begin global variables
+
+SCENARIO_KINDS = ['car_following', 'head_on', 'crossing_pedestrian', 'collision']
+
+# Column order of the input logs read by main.process_log
+LOG_COLUMNS = ['timestamp', 'VUT x', 'VUT y', 'VUT heading', 'VUT sp', 'VUT lat sp', 'VUT lon acc', 'VUT lat acc', 'VUT acc',
+               'challenger x', 'challenger y', 'challenger heading', 'challenger sp', 'challenger lat sp', 'challenger lon acc', 'challenger lat acc']
+
+# Functions timed individually for the per-metric breakdown, name in the module -> metric
+BATCH_STAGES = {
+    'd_lon_array':               'd_lon',
+    'd_lat_array':               'd_lat',
+    'classify_case_array':       'case',
+    'calculate_d_lon_min_array': 'd_lon_min',
+    'calculate_d_lat_min_array': 'd_lat_min',
+    'bumper_distances_array':    'SEVM',
+    '_msev_mag_array':           'SEVM',
+    '_sert_array':               'SERTV',
+    '_ort_array':                'ORTV',
+    '_ci_mag_array':             'CIM',
+    'summarize_da_score':        'summary',
+}
+
+LEGACY_STAGES = {
+    'd_lon':              'd_lon',
+    'd_lat':              'd_lat',
+    'calculate_sei':      'SEI',
+    'calculate_mdsev':    'SEV',
+    'calculate_msev_mag': 'SEVM',
+    'calculate_ci_mag':   'CIM',
+    'calculate_emi':      'EMI',
+}
+
+# End global variables
+
+
+# Begin synthetic scenarios
+
+def generate_log(kind, frames, dt = 0.05, seed = 0):
+    '''
+    Synthetic log with the column layout of a recorded log, headings in radians.
+
+    kind is one of SCENARIO_KINDS. 'collision' is a pedestrian walking into the VUT's path, terminated by the
+    collision row (timestamp == 0) that main.process_log expects.
+    '''
+    rng = np.random.default_rng(seed)
+    t = np.arange(frames) * dt
+    zeros = np.zeros(frames)
+
+    if kind == 'car_following':
+        vut_sp = 12 + 2 * np.sin(0.2 * t)
+        vut_x = np.cumsum(vut_sp * dt)
+        vut_y = zeros
+        vut_heading = rng.normal(0, 0.01, frames)
+        challenger_sp = vut_sp + np.sin(0.3 * t)
+        challenger_x = vut_x + 15 + 5 * np.sin(0.1 * t)
+        challenger_y = 0.2 * np.sin(0.5 * t)
+        challenger_heading = zeros
+    elif kind == 'head_on':
+        # The two pass each other in adjacent lanes, every lap
+        vut_sp = 10 + zeros
+        vut_x = (vut_sp * t) % 200
+        vut_y = zeros
+        vut_heading = zeros
+        challenger_sp = 1.2 + zeros
+        challenger_x = 200 - (challenger_sp * t) % 200
+        challenger_y = 1.5 + zeros
+        challenger_heading = np.pi + zeros
+    elif kind in ['crossing_pedestrian', 'collision']:
+        # The pedestrian crosses 20 m ahead of the VUT, every 10 s
+        vut_sp = 8 + zeros
+        vut_x = zeros + vut_sp * (t % 10)
+        vut_y = zeros
+        vut_heading = rng.normal(0, 0.01, frames)
+        challenger_sp = 1.5 + zeros
+        challenger_x = 20 + zeros
+        challenger_y = -7.5 + challenger_sp * (t % 10)
+        challenger_heading = np.pi / 2 + zeros
+    else:
+        raise ValueError('Unknown scenario kind {}, expected one of {}'.format(kind, SCENARIO_KINDS))
+
+    data_df = pd.DataFrame({
+        'timestamp':          t,
+        'VUT x':              vut_x,
+        'VUT y':              vut_y,
+        'VUT heading':        vut_heading,
+        'VUT sp':             vut_sp,
+        'VUT lat sp':         rng.normal(0, 0.3, frames),
+        'VUT lon acc':        rng.normal(0, 2, frames),
+        'VUT lat acc':        rng.normal(0, 0.8, frames),
+        'VUT acc':            rng.normal(0, 1, frames),
+        'challenger x':       challenger_x,
+        'challenger y':       challenger_y,
+        'challenger heading': challenger_heading,
+        'challenger sp':      challenger_sp,
+        'challenger lat sp':  rng.normal(0, 0.1, frames),
+        'challenger lon acc': rng.normal(0, 0.5, frames),
+        'challenger lat acc': rng.normal(0, 0.1, frames),
+    }, columns=LOG_COLUMNS)
+
+    if kind == 'collision':
+        # The pedestrian ends on the VUT's front bumper, then the collision row
+        data_df.loc[frames - 1, ['VUT x', 'challenger x', 'challenger y']] = [0, config.vut_dimensions[0] / 2 + 0.1, 0]
+        collision_row = data_df.iloc[[frames - 1]].copy()
+        collision_row['timestamp'] = 0
+        data_df = pd.concat([data_df, collision_row], ignore_index=True)
+
+    return data_df
+
+# End synthetic scenarios
+
+
+# Begin engines
+
+_legacy_module = None
+_umich_metrics_module = None
+
+def load_umich_metrics():
+    '''
+    Loads the scalar metric functions of old/umich_metrics.py. Raises ImportError when its dependencies
+    (e.g. scikit-spatial) are not installed.
+    '''
+    global _umich_metrics_module
+
+    if _umich_metrics_module is None:
+        spec = importlib.util.spec_from_file_location('umich_metrics', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'old', 'umich_metrics.py'))
+        umich_metrics = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(umich_metrics)
+
+        _umich_metrics_module = umich_metrics
+
+    return _umich_metrics_module
+
+def load_legacy_engine():
+    '''
+    Loads the legacy row loop from old/mm_da_score_calculation_ped.py.
+
+    old/umich_metrics.py is registered under the package name the legacy script imports it by. dsa_metrics_analysis
+    is only used by the legacy folder loop, which is not benchmarked, and draw_scenario is disabled because it renders
+    a figure per frame. Raises ImportError when the legacy dependencies (e.g. scikit-spatial) are not installed.
+    '''
+    global _legacy_module
+
+    if _legacy_module is not None:
+        return _legacy_module
+
+    old_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'old')
+    umich_metrics = load_umich_metrics()
+
+    safety_metrics = types.ModuleType('safety_metrics')
+    safety_metrics.umich_metrics = umich_metrics
+    sys.modules.setdefault('safety_metrics', safety_metrics)
+    sys.modules.setdefault('safety_metrics.umich_metrics', umich_metrics)
+    sys.modules.setdefault('dsa_metrics_analysis', types.ModuleType('dsa_metrics_analysis'))
+
+    spec = importlib.util.spec_from_file_location('mm_da_score_calculation_ped', os.path.join(old_path, 'mm_da_score_calculation_ped.py'))
+    legacy = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(legacy)
+    legacy.draw_scenario = lambda *args, **kwargs: None
+
+    _legacy_module = legacy
+
+    return legacy
+
+def run_legacy(data_df):
+    legacy = load_legacy_engine()
+    legacy.clear_metric_values()
+
+    return legacy.process_log(data_df.copy())
+
+def run_batch(data_df):
+    return main.process_log(data_df.copy())
+
+def run_batch_backend(data_df, backend):
+    # The batch engine with config.formula_backend set to backend for the duration of the run
+    formula_backend = config.formula_backend
+    config.formula_backend = backend
+
+    try:
+        return main.process_log(data_df.copy())
+    finally:
+        config.formula_backend = formula_backend
+
+def run_numba(data_df):
+    return run_batch_backend(data_df, 'numba')
+
+def count_skipped_frames(data_df):
+    # Frames of the log the batch engine's early exit skipped, see mf.calculate_metrics_batch
+    data_df = data_df.copy()
+    main.add_derived_columns(data_df)
+    if data_df['timestamp'].iloc[-1] == 0:
+        data_df = data_df.iloc[:-1]
+
+    state = mf.EpisodeState()
+    mf.calculate_metrics_batch(data_df, state=state)
+
+    return state.skipped_frames
+
+def run_streaming(data_df):
+    with tempfile.TemporaryDirectory() as folder:
+        file = os.path.join(folder, 'log.csv')
+        data_df.to_csv(file, index=False)
+
+        with result_sink.CsvSink(folder) as sink:
+            return main.process_log_streaming(file, sink, 'log', max(len(data_df) // 8, 2))
+
+def run_online(data_df):
+    scorer = mf.DAScorer()
+
+    for frame in data_df.to_dict('records'):
+        scorer.push(frame)
+
+    return scorer.overall_da_score
+
+ENGINES = {
+    'legacy':    run_legacy,
+    'batch':     run_batch,
+    'numba':     run_numba,
+    'streaming': run_streaming,
+    'online':    run_online,
+}
+
+# End engines
+
+
+# Begin measurements
+
+@contextlib.contextmanager
+def stage_timer(module, stages, totals):
+    '''
+    Wraps the functions of module named in stages so that their run time is added to totals[metric].
+
+    Times are inclusive, e.g. the legacy calculate_sei time includes the d_lon and d_lat calls made inside it.
+    '''
+    originals = {name: getattr(module, name) for name in stages}
+
+    def timed(name, function):
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                totals[stages[name]] = totals.get(stages[name], 0.0) + time.perf_counter() - start_time
+        return wrapper
+
+    for name, function in originals.items():
+        setattr(module, name, timed(name, function))
+
+    try:
+        yield totals
+    finally:
+        for name, function in originals.items():
+            setattr(module, name, function)
+
+def measure(engine, data_df, repeats = config.benchmark_repeats):
+    '''
+    Runs one engine on one log. Returns the best wall time, per-metric times and peak traced memory.
+    '''
+    run = ENGINES[engine]
+
+    wall_times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        run(data_df)
+        wall_times.append(time.perf_counter() - start_time)
+
+    # Per-metric times come from a separate run, the wrappers add their own overhead
+    stage_times = {}
+    if engine == 'legacy':
+        with stage_timer(load_legacy_engine().sm, LEGACY_STAGES, stage_times):
+            run(data_df)
+    elif engine == 'batch':
+        with stage_timer(mf, BATCH_STAGES, stage_times):
+            run(data_df)
+
+    tracemalloc.start()
+    run(data_df)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best_time = min(wall_times)
+
+    result = {'seconds': best_time,
+              'frames_per_second': len(data_df) / best_time if best_time > 0 else float('inf'),
+              'metric_seconds': stage_times,
+              'peak_memory_mb': peak_memory / 2 ** 20}
+
+    if engine == 'batch':
+        result['skipped_frames'] = count_skipped_frames(data_df)
+
+    return result
+
+def run_benchmarks(frame_counts = config.benchmark_frames, engines = None, kinds = SCENARIO_KINDS):
+    '''
+    Benchmarks every engine on every scenario kind and length. Returns the results as a JSON serialisable dict.
+
+    The legacy loop is only run up to config.benchmark_legacy_max_frames frames, it is skipped when its
+    dependencies are not installed.
+    '''
+    engines = engines or list(ENGINES.keys())
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'runs': [],
+    }
+
+    if 'numba' in engines and not jit_kernels.JIT_AVAILABLE:
+        print('Skipping the numba engine: numba is not installed')
+        engines = [engine for engine in engines if engine != 'numba']
+
+    if 'legacy' in engines:
+        try:
+            load_legacy_engine()
+        except ImportError as e:
+            print('Skipping the legacy engine: {}'.format(repr(e)))
+            engines = [engine for engine in engines if engine != 'legacy']
+
+    for frames in frame_counts:
+        for kind in kinds:
+            data_df = generate_log(kind, frames)
+
+            for engine in engines:
+                if engine == 'legacy' and frames > config.benchmark_legacy_max_frames:
+                    continue
+
+                run = measure(engine, data_df)
+                run.update({'engine': engine, 'scenario': kind, 'frames': len(data_df)})
+                results['runs'].append(run)
+
+                print('{:>9} {:>20} {:>8} frames: {:>12.0f} frames/s, peak {:.1f} MB'.format(engine, kind, len(data_df), run['frames_per_second'], run['peak_memory_mb']))
+
+    return results
+
+def save_results(results, output_name):
+    with open(output_name, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print('Benchmark results saved to {}'.format(output_name))
+
+# End measurements
+
+
+# Begin backend equivalence
+
+def check_backends(frame_counts = config.benchmark_frames, kinds = SCENARIO_KINDS, tolerance = config.batch_engine_tolerance):
+    '''
+    Scores every scenario kind and length with each config.formula_backend and compares the per-frame columns and
+    the DA score with a reference: the legacy row loop up to config.benchmark_legacy_max_frames frames when its
+    dependencies are installed, the numpy backend otherwise. Returns {backend: largest absolute difference}, the
+    numba backend is left out when numba is not installed.
+    '''
+    backends = ['numpy', 'numba'] if jit_kernels.JIT_AVAILABLE else ['numpy']
+    differences = {backend: 0.0 for backend in backends}
+
+    if not jit_kernels.JIT_AVAILABLE:
+        print('numba is not installed, only the numpy backend is checked')
+
+    try:
+        load_legacy_engine()
+        legacy_available = True
+    except ImportError as e:
+        print('Comparing with the numpy backend, the legacy engine is not available: {}'.format(repr(e)))
+        legacy_available = False
+
+    for frames in frame_counts:
+        for kind in kinds:
+            data_df = generate_log(kind, frames)
+
+            if legacy_available and frames <= config.benchmark_legacy_max_frames:
+                reference = 'legacy'
+                expected_df, _, expected_da_score = run_legacy(data_df)
+            else:
+                reference = 'numpy'
+                expected_df, _, expected_da_score = run_batch_backend(data_df, 'numpy')
+
+            for backend in backends:
+                scored_df, _, da_score = run_batch_backend(data_df, backend)
+
+                difference = abs(da_score - expected_da_score)
+                for column in mf.DA_SCORE_METRICS + ['DA Score']:
+                    expected = expected_df[column].to_numpy(dtype=np.float64)
+                    scored = scored_df[column].to_numpy(dtype=np.float64)
+
+                    # A nan in the same frame of both columns is not a difference
+                    same = (expected == scored) | (np.isnan(expected) & np.isnan(scored))
+                    if not np.all(same):
+                        difference = max(difference, float(np.max(np.abs(expected - scored)[~same])))
+
+                differences[backend] = max(differences[backend], difference)
+
+                print('{:>6} {:>20} {:>8} frames vs {:>6}: {}'.format(backend, kind, len(data_df), reference,
+                                                                      'OK' if difference <= tolerance else 'difference {}'.format(difference)))
+
+    return differences
+
+def check_surrogate_metrics(samples = 20000, seed = 0, tolerance = config.batch_engine_tolerance):
+    '''
+    Compares the TTC, MTTC and THW arrays with the scalar functions of old/umich_metrics.py on random gaps, speeds and
+    accelerations, zero speeds and accelerations included. Returns {metric: largest absolute difference}, they are
+    not bit-identical: the MTTC roots use np.sqrt where the scalar version uses ** 0.5.
+    '''
+    umich_metrics = load_umich_metrics()
+    rng = np.random.default_rng(seed)
+
+    delta_pos = rng.uniform(-5, 50, samples)
+    delta_vel = np.where(rng.random(samples) < 0.1, 0, rng.normal(0, 5, samples))
+    delta_acc = np.where(rng.random(samples) < 0.1, 0, rng.normal(0, 3, samples))
+
+    arrays = {
+        'TTC':  mf.calculate_ttc_array(delta_pos, delta_vel, config.ttc_max),
+        'MTTC': mf.calculate_mttc_array(delta_pos, delta_vel, delta_acc, config.mttc_max),
+        'THW':  mf.calculate_thw_array(delta_pos, delta_vel, config.thw_max),
+    }
+    scalars = {
+        'TTC':  [umich_metrics.calculate_ttc(d, v, config.ttc_max) for d, v in zip(delta_pos, delta_vel)],
+        'MTTC': [umich_metrics.calculate_mttc(d, v, a, config.mttc_max) for d, v, a in zip(delta_pos, delta_vel, delta_acc)],
+        'THW':  [umich_metrics.calculate_thw(d, v, config.thw_max) for d, v in zip(delta_pos, delta_vel)],
+    }
+
+    differences = {}
+    for metric, values in arrays.items():
+        expected = np.asarray(scalars[metric], dtype=np.float64)
+
+        same = (expected == values) | (np.isnan(expected) & np.isnan(values))
+        differences[metric] = float(np.max(np.abs(expected - values)[~same])) if not np.all(same) else 0.0
+
+        print('{:>5} {} samples vs umich_metrics: {}'.format(metric, samples, 'OK' if differences[metric] <= tolerance
+                                                               else 'difference {}'.format(differences[metric])))
+
+    return differences
+
+def check_sinks(result_formats = result_sink.RESULT_FORMATS):
+    '''
+    Appends a collision log's summary row with integer values, then a normal one with floats, to the 'DA Scores'
+    table of every result format as separate pieces, the way calculate_safety_metrics_parallel does. Each table
+    must read back whole with the same DA Scores. Returns the formats that fail, Parquet and dataset are left out
+    when pyarrow is not installed.
+    '''
+    rows = [dict(mf.summarize_da_score({name: [] for name in mf.DA_SCORE_METRICS + ['EMI']}), CI=1, CIM=1),
+            dict(mf.summarize_da_score({name: [] for name in mf.DA_SCORE_METRICS + ['EMI']}), SEI=1, SEVM=0.0956)]
+    rows[0].update({'Scenario Number': 'collision', 'DA Score': 0})
+    rows[1].update({'Scenario Number': 'car_following', 'DA Score': 90.44115})
+
+    failures = []
+
+    for result_format in result_formats:
+        if result_format in ['parquet', 'dataset'] and result_sink.pa is None:
+            print('pyarrow is not installed, {} is not checked'.format(result_format))
+            continue
+
+        with tempfile.TemporaryDirectory() as folder:
+            try:
+                with result_sink.open_sink(folder, result_format) as sink:
+                    for row in rows:
+                        sink.append('DA Scores', pd.DataFrame([row]))
+
+                with result_sink.open_sink(folder, result_format) as sink:
+                    da_scores = sink.read('DA Scores')['DA Score'].tolist()
+
+                if result_format == 'dataset':
+                    import pyarrow.dataset
+                    pyarrow.dataset.dataset(os.path.join(folder, 'DA Scores')).to_table()
+
+                passed = sorted(da_scores) == [0, 90.44115]
+            except Exception as e:
+                da_scores = repr(e)
+                passed = False
+
+        if not passed:
+            failures.append(result_format)
+
+        print('{:>8} int then float DA Scores: {}'.format(result_format, 'OK' if passed else 'read back {}'.format(da_scores)))
+
+    return failures
+
+def check_resampling(frame_counts = config.benchmark_frames, rates = [5, 20, 100], chunk_rows = 333,
+                     kinds = ['car_following', 'head_on', 'crossing_pedestrian']):
+    '''
+    Resamples every scenario kind and length whole and in chunks of chunk_rows frames, as streamed logs are, with
+    headings logged in [-pi, pi) and in [0, 2 pi). Returns the number of resampled logs that are not identical.
+    The collision kind is left out, logs are resampled after the collision row is removed.
+    '''
+    mismatches = 0
+
+    for frames in frame_counts:
+        for kind in kinds:
+            signed_df = generate_log(kind, frames)
+            heading_columns = [name for name in signed_df.columns if name.split(' ')[-1] == resampling.HEADING_COLUMN]
+
+            wrapped_df = signed_df.copy()
+            wrapped_df[heading_columns] = np.mod(wrapped_df[heading_columns], 2 * np.pi)
+
+            for convention, data_df in [('[-pi, pi)', signed_df), ('[0, 2 pi)', wrapped_df)]:
+                for rate in rates:
+                    expected_df = resampling.resample_log(data_df, rate)
+
+                    resampler = resampling.Resampler(rate)
+                    pieces = [resampler.push(data_df.iloc[start:start + chunk_rows].reset_index(drop=True))
+                              for start in range(0, len(data_df), chunk_rows)]
+                    streamed_df = pd.concat(pieces + [resampler.finish()], ignore_index=True)
+
+                    identical = streamed_df.equals(expected_df)
+                    mismatches += not identical
+
+                    print('{:>20} {:>8} frames {:>9} at {:>4} Hz: {}'.format(kind, frames, convention, rate,
+                                                                            'OK' if identical else 'streamed and whole log differ'))
+
+    return mismatches
+
+# End backend equivalence
+
+
+def main_benchmark():
+    # Usage: python benchmark.py [frames,frames,...] [output json], python benchmark.py --check-backends / --check-resampling
+    # [frames,frames,...], or python benchmark.py --check-surrogates / --check-sinks
+    if '--check-backends' in sys.argv:
+        arguments = [argument for argument in sys.argv[1:] if argument != '--check-backends']
+        frame_counts = [int(frames) for frames in arguments[0].split(',')] if len(arguments) > 0 else config.benchmark_frames
+
+        differences = check_backends(frame_counts)
+        sys.exit(0 if max(differences.values()) <= config.batch_engine_tolerance else 1)
+
+    if '--check-surrogates' in sys.argv:
+        differences = check_surrogate_metrics()
+        sys.exit(0 if max(differences.values()) <= config.batch_engine_tolerance else 1)
+
+    if '--check-sinks' in sys.argv:
+        sys.exit(0 if len(check_sinks()) == 0 else 1)
+
+    if '--check-resampling' in sys.argv:
+        arguments = [argument for argument in sys.argv[1:] if argument != '--check-resampling']
+        frame_counts = [int(frames) for frames in arguments[0].split(',')] if len(arguments) > 0 else config.benchmark_frames
+
+        sys.exit(0 if check_resampling(frame_counts) == 0 else 1)
+
+    frame_counts = [int(frames) for frames in sys.argv[1].split(',')] if len(sys.argv) > 1 else config.benchmark_frames
+    output_name = sys.argv[2] if len(sys.argv) > 2 else config.benchmark_output
+
+    save_results(run_benchmarks(frame_counts), output_name)
+
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -1 +1,250 @@
-# This script will serve to define all the configuration details so that they are all in one place and can be easily changed.
\ No newline at end of file
+# This script will serve to define all the configuration details so that they are all in one place and can be easily changed.
+
+# -- Begin class definitions
+
+class RssParameters():
+    def __init__(self, alphaLon_accelMax = 1.8, alphaLon_brakeMax = 6.1, alphaLon_brakeMin = 3.6, responseTime = 0.2, alphaLat_accelMin = 5.88, alphaLat_accelMax = 8.83):
+        self.alphaLon_accelMax = alphaLon_accelMax
+        self.alphaLon_brakeMax = alphaLon_brakeMax
+        self.alphaLon_brakeMin = alphaLon_brakeMin
+        self.responseTime = responseTime
+        # 0.6g = 5.88 m/s^2
+        self.alphaLat_accelMin = alphaLat_accelMin
+        # 0.9g = 8.83 m/s^2
+        self.alphaLat_accelMax = alphaLat_accelMax
+
+# -- End class definitions
+
+
+# -- Begin RSS parameters
+rss_average = RssParameters(alphaLon_accelMax = 2.69, alphaLon_brakeMax = 3.09, alphaLon_brakeMin = 1.78, responseTime = 0.75, alphaLat_accelMin = 5.88, alphaLat_accelMax = 8.83)
+
+# Assuming a person's max speed of 8mph, and an acceleration time of 5s
+rss_pedestrian = RssParameters(alphaLon_accelMax = 0.7153, alphaLon_brakeMax = 1.192, alphaLon_brakeMin = 0.2682, responseTime = 0.75, alphaLat_accelMin = 0.134, alphaLat_accelMax = 0.2682)
+
+# Lateral fluctuation margin used by d_lat_min
+mu = 0.2
+# -- End RSS parameters
+
+
+# -- Begin scenario parameters
+# dimensions = [length, width]
+vut_dimensions = [5.1816, 2.0066]
+challenger_dimensions = [0.4, 0.7]
+# -- End scenario parameters
+
+
+# -- Begin metric selection
+# Per-frame columns produced for every log, any of metrics_formulas.METRIC_DEPENDENCIES. The columns they are
+# computed from are added automatically, and the DA score metrics (SEI, SEV, SEVM, SERTV(M), EMI(M), CI(M),
+# ORTV(M)) are always produced since the score needs them. [] is a DA score only run.
+metrics = ['SEI', 'SEV', 'SEVM', 'SERTV', 'SERTVM', 'EMI', 'EMIM', 'CI', 'CIM', 'ORTV', 'ORTVM',
+           # Visualization columns
+           'DA Score', 'VUT Accel', 'VUT Speed', 'Distance to SO', 'Safety Envelope Distance']
+
+# Debug columns, not used by the DA score: 'SEI LON', 'SEI LAT', 'SER LON', 'SER LAT', 'SER', 'SERV LON', 'SERV LAT', 'SERV'
+# Surrogate safety metrics, they do not change the DA score: 'TTC', 'MTTC', 'THW', 'PET' (whole logs only)
+# -- End metric selection
+
+
+# -- Begin metric thresholds
+# Proportion of the assumed maximum deceleration of the lead vehicle used by SEVM
+sevm_n = 0.5
+
+# Emergency Maneuver Incident acceleration limits (m/s^2)
+emi_lon_acc_limit = 4.51
+emi_lat_acc_limit = 1.3
+
+# Restoration and response time limits (s)
+sert_limit = 5
+ort_limit = 1
+
+# Safety Envelope Ratios outside (ser_min, ser_max) are Safety Envelope Ratio Violations (SERV debug columns)
+ser_min = 1
+ser_max = 1.5
+# -- End metric thresholds
+
+
+# -- Begin surrogate safety metric parameters
+# Values reported when there is no conflict (s)
+ttc_max = 10
+mttc_max = 10
+thw_max = 10
+
+# Distance between the VUT front bumper and the challenger rear bumper that counts as a conflict point for PET (m)
+pet_radius = 1.0
+# -- End surrogate safety metric parameters
+
+
+# -- Begin multi-actor parameters
+# Actor id of the vehicle under test in multi-actor logs (logs with an 'actor' column)
+multi_actor_vut_id = 'VUT'
+
+# Only check pairs of actors that are close enough to interact
+multi_actor_broad_phase = True
+
+# Interaction distance used by the broad phase (m), None derives it from the RSS parameters and the log's speeds
+multi_actor_cull_distance = None
+# -- End multi-actor parameters
+
+
+# -- Begin episode parameters
+# Save a table of the SEI, SEV and OEDR response episodes of every log next to its per-frame results
+episode_tables = False
+# -- End episode parameters
+
+
+# -- Begin report parameters
+# Save an interactive HTML report (Interactive_DV-<scenario>.html) next to the per-frame results of every log
+visualize_logs = False
+
+# Points per trace in the report, longer logs are downsampled
+report_max_points = 5000
+
+# 'minmax' keeps the smallest and largest value of every bucket, 'lttb' keeps the largest triangles
+report_downsampling = 'minmax'
+
+# How plotly.js is included in the report: True embeds it (works offline), 'cdn' links it (smaller files)
+report_plotlyjs = True
+
+# Render the VUT and challenger of every log to <scenario>-scenario.<render_format>, off-screen
+render_scenarios = False
+
+# 'mp4' (needs ffmpeg), 'gif' or 'png' (a folder of images)
+render_format = 'mp4'
+
+# Only every render_every-th frame is drawn
+render_every = 10
+
+# 1: boxes and front bumpers, 2: + rear bumpers and sides, 3: + heading vectors and side rays
+render_plot_option = 3
+
+# Figure size (inches) and resolution of the rendered frames
+render_figure_size = [6.4, 4.8]
+render_dpi = 100
+# -- End report parameters
+
+
+# -- Begin engine parameters
+# Largest absolute difference allowed between any batch engine column and the legacy row loop
+batch_engine_tolerance = 1e-6
+
+# Skip the d_lon / d_lat geometry of frames that provably cannot infringe the safety envelope, results are unchanged
+prune_frames = True
+
+# Formulas of the safety envelope (d_lon_min, d_lat_min, SEI, SEV, SEVM): 'numpy', or 'numba' for a JIT compiled
+# per-frame kernel (jit_kernels.py). Without numba installed 'numba' falls back to 'numpy'.
+formula_backend = 'numpy'
+# -- End engine parameters
+
+
+# -- Begin triage parameters
+# Score logs in two tiers: a screening pass finds the frames that may infringe the safety envelope and only windows
+# around them are scored in full. The DA scores are unchanged, but no per-frame results, episode tables, reports or
+# renders are saved, only the summary table. Triaged logs are read whole, stream_logs does not apply.
+triage_logs = False
+
+# Frames scored either side of every frame the screening pass keeps
+triage_padding = 20
+
+# Windows fewer than this many frames apart are scored as one, every window costs a few milliseconds on its own
+triage_merge_gap = 1000
+# -- End triage parameters
+
+
+# -- Begin resampling parameters
+# Resample every log to this rate (Hz) before it is scored, so that SERT and ORT have the same resolution whatever
+# rate a log was recorded at. None scores the logged frames as they are. A rate below the logged one downsamples,
+# which is only meant for screening: events shorter than the new frame interval can be missed.
+resample_rate = None
+# -- End resampling parameters
+
+
+# -- Begin instrumentation parameters
+# Time the stages of scoring (read, screen, geometry, sei, sevm, episodes, cim, output) and save profile.json and
+# profile.prom (Prometheus text format) in the run folder. python main.py <experiment folder> --profile also does.
+profile_stages = False
+
+# Samples kept per stage for the percentiles, the counts and totals include every sample
+profile_window = 10000
+
+# Level of the scoring log messages, 'DEBUG' logs per-frame details
+log_level = 'WARNING'
+# -- End instrumentation parameters
+
+
+# -- Begin batch parameters
+# Number of worker processes used to score logs, None uses every core
+batch_workers = None
+
+# Logs queued per worker, keeps memory bounded when a folder holds thousands of logs
+batch_queue_per_worker = 4
+# -- End batch parameters
+
+
+# -- Begin resume parameters
+# Skip logs that were already scored with the same configuration and have not changed since, their summary rows
+# are taken from Output/manifest.jsonl. python main.py <experiment folder> --rescore scores everything again.
+resume_runs = True
+# -- End resume parameters
+
+
+# -- Begin streaming parameters
+# Score each log in bounded chunks instead of loading it whole, for very long drives
+stream_logs = False
+
+# Rows read per chunk when streaming
+stream_chunk_rows = 100000
+# -- End streaming parameters
+
+
+# -- Begin result parameters
+# Output format of the per-frame results and summary tables: 'csv' (one file per table and log), 'parquet'
+# (one file per table and log), 'dataset' (an Arrow dataset per table, partitioned by scenario) or 'sqlite'
+# (one database per run). Parquet and dataset need pyarrow.
+result_format = 'csv'
+
+# Parquet compression codec
+result_compression = 'zstd'
+
+# Rows per Parquet row group, streamed logs are written out in pieces of this size
+result_row_group_rows = 100000
+# -- End result parameters
+
+
+# -- Begin log cache parameters
+# Keep a columnar binary copy of every parsed log so that re-runs skip CSV parsing
+use_log_cache = False
+
+# Folder for the cached logs, None uses <experiment folder>/Cache
+log_cache_path = None
+
+# 'feather' (needs pyarrow) or 'npy' (numpy only, numeric columns only). Both are memory-mapped when read back.
+log_cache_format = 'feather'
+# -- End log cache parameters
+
+
+# -- Begin sweep parameters
+# Values scored by the RSS parameter sweep (python main.py <experiment folder> --sweep). Every combination of
+# the VUT and challenger values is scored, parameters not listed keep their rss_average / rss_pedestrian value.
+sweep_vut_rss = {'responseTime': [0.5, 0.75, 1.0, 1.5], 'alphaLon_brakeMin': [1.78, 3.6]}
+sweep_challenger_rss = {'responseTime': [0.75, 1.0]}
+
+# Parameter sets scored together, each per-frame column of a block holds sweep_block_size x frames values
+sweep_block_size = 64
+# -- End sweep parameters
+
+
+# -- Begin benchmark parameters
+# Log lengths (frames) generated by benchmark.py
+benchmark_frames = [1000, 10000]
+
+# Timed runs per engine and log, the best one is reported
+benchmark_repeats = 3
+
+# The legacy row loop is slow, longer logs are only run with the new engines
+benchmark_legacy_max_frames = 1000
+
+# Where benchmark.py saves its results
+benchmark_output = 'benchmark_results.json'
+# -- End benchmark parameters
@@ -0,0 +1,136 @@
+# This script will serve to split the per-frame metric columns of a scored log into episodes, so that each
+# infringement, violation and response can be looked at as one event instead of a run of frames.
+
+# -- Begin imports
+
+import numpy as np
+import pandas as pd
+
+import config
+import metrics_formulas as mf
+
+# -- End imports
+
+
+# -- Begin global variables
+
+EPISODE_COLUMNS = ['Metric', 'Start Frame', 'End Frame', 'Start Time', 'End Time', 'Duration', 'Ended',
+                   'Peak Magnitude', 'Violation', 'Violation Magnitude']
+
+# End global variables
+
+
+# Begin helper methods
+
+def find_runs(flags):
+    '''
+    Returns [starts, ends], the first and last frame of every run of consecutive True flags.
+    '''
+    flags = np.asarray(flags, dtype=bool)
+    edges = np.diff(np.concatenate([[0], flags.astype(np.int8), [0]]))
+
+    return [np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1]
+
+def run_maxima(values, flags, starts):
+    # Peak of values over each run, frames between runs are masked out so that one reduceat covers every run
+    if len(starts) == 0:
+        return np.zeros(0)
+
+    masked = np.where(np.asarray(flags, dtype=bool), np.asarray(values, dtype=np.float64), -np.inf)
+
+    return np.maximum.reduceat(masked, starts)
+
+def window_maxima(values, starts, ends):
+    # Peak of values over each [start, end] window, the windows must not overlap
+    if len(starts) == 0:
+        return np.zeros(0)
+
+    bounds = np.stack([starts, ends + 1], axis=1).ravel()
+
+    return np.maximum.reduceat(np.append(np.asarray(values, dtype=np.float64), 0), bounds)[::2]
+
+# End helper methods
+
+
+# Begin episode table
+
+def segment_episodes(timestamp, sei, sev, vut_acc, sevm = None):
+    '''
+    Episode table of a scored log, one row per SEI episode, SEV episode and OEDR response.
+
+    SEI episodes last from the first SEI frame to the first frame without SEI (the SERT), they are
+    violations when the SERT is above config.sert_limit. OEDR responses last from the initiating SEI frame to the
+    first braking frame (the ORT) and are violations above config.ort_limit. Peak Magnitude is the largest SEVM
+    of the episode when sevm is given. Episodes still open at the end of the log have Ended == False and no violation.
+    '''
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+    frames = len(timestamp)
+    sevm = np.zeros(frames) if sevm is None else np.asarray(sevm, dtype=np.float64)
+
+    tables = []
+
+    for metric, flags, limit, scale in [('SEI', sei, config.sert_limit, 2), ('SEV', sev, None, None)]:
+        starts, ends = find_runs(flags)
+
+        # An episode ends on the first frame after its run, if the log goes on
+        ended = ends + 1 < frames
+        end_frames = np.minimum(ends + 1, frames - 1)
+        duration = timestamp[end_frames] - timestamp[starts]
+
+        if limit is None:
+            violation = np.zeros(len(starts), dtype=bool)
+            violation_magnitude = np.zeros(len(starts))
+        else:
+            violation = ended & (duration > limit)
+            violation_magnitude = np.where(ended, np.clip((duration - limit)/scale, 0, 1), 0.0)
+
+        tables.append(pd.DataFrame({
+            'Metric':              metric,
+            'Start Frame':         starts,
+            'End Frame':           ends,
+            'Start Time':          timestamp[starts],
+            'End Time':            timestamp[end_frames],
+            'Duration':            duration,
+            'Ended':               ended,
+            'Peak Magnitude':      run_maxima(sevm, flags, starts),
+            'Violation':           violation,
+            'Violation Magnitude': violation_magnitude,
+        }, columns=EPISODE_COLUMNS))
+
+    # The same response search as the ORT column, so that the two always agree
+    starts, ends, _ = mf.find_responses(sei, vut_acc)
+    duration = timestamp[ends] - timestamp[starts]
+
+    tables.append(pd.DataFrame({
+        'Metric':              'ORT',
+        'Start Frame':         starts,
+        'End Frame':           ends,
+        'Start Time':          timestamp[starts],
+        'End Time':            timestamp[ends],
+        'Duration':            duration,
+        'Ended':               True,
+        'Peak Magnitude':      window_maxima(sevm, starts, ends),
+        'Violation':           duration > config.ort_limit,
+        'Violation Magnitude': np.clip((duration - config.ort_limit)/3, 0, 1),
+    }, columns=EPISODE_COLUMNS))
+
+    return pd.concat(tables, ignore_index=True)
+
+def episode_counts(episode_df):
+    '''
+    The da_score_dict counts derived from an episode table.
+    '''
+    metric = episode_df['Metric']
+
+    return {
+        'SEIC':   int((metric == 'SEI').sum()),
+        'SEVC':   int((metric == 'SEV').sum()),
+        'SERTVC': int(((metric == 'SEI') & episode_df['Violation']).sum()),
+        'ORTVC':  int(((metric == 'ORT') & episode_df['Violation']).sum()),
+    }
+
+def segment_scored_log(data_df):
+    # Episode table of a log scored by main.process_log
+    return segment_episodes(data_df['timestamp'], data_df['SEI'], data_df['SEV'], data_df['VUT acc'], data_df['SEVM'])
+
+# End episode table
@@ -0,0 +1,199 @@
+# This script will serve to time the stages of the scoring hot path and to log what the scoring does, so that a
+# slow run can be explained without attaching a profiler. Timers cost one flag check when profiling is disabled.
+
+# -- Begin imports
+
+import numpy as np
+
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import nullcontext
+from functools import wraps
+
+import config
+
+# -- End imports
+
+
+# -- Begin global variables
+
+# Stages timed by the batch engine and main, in the order they run for a log
+STAGES = ['read', 'screen', 'geometry', 'sei', 'sevm', 'episodes', 'cim', 'output', 'log']
+
+PERCENTILES = [50, 90, 99]
+
+# Files saved in the run folder by save_profile
+PROFILE_JSON = 'profile.json'
+PROFILE_PROMETHEUS = 'profile.prom'
+
+# Prometheus metric the stage times are exported as
+PROMETHEUS_METRIC = 'da_score_stage_seconds'
+
+# Logger of the scoring modules, per-frame details are logged at DEBUG
+logger = logging.getLogger('da_score')
+
+_enabled = config.profile_stages
+_timers = {}
+
+# Returned by timer while profiling is disabled, reusable and free to enter
+_DISABLED = nullcontext()
+
+# End global variables
+
+
+# Begin stage timers
+
+class StageTimer:
+    # Count, total and maximum of every sample of one stage, and the most recent ones for the percentiles
+    def __init__(self, window = config.profile_window):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def stats(self):
+        stats = {'count': self.count,
+                 'total': self.total,
+                 'mean': self.total / self.count if self.count > 0 else 0.0,
+                 'max': self.max}
+
+        samples = np.asarray(self.samples)
+        for percentile in PERCENTILES:
+            stats['p{}'.format(percentile)] = float(np.percentile(samples, percentile)) if len(samples) > 0 else 0.0
+
+        return stats
+
+class _Timing:
+    # Context manager adding the time spent inside it to the stage
+    __slots__ = ['name', 'start_time']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        record(self.name, time.perf_counter() - self.start_time)
+
+def enable(enabled = True):
+    # Also the initializer of the worker processes, so that they profile when the parent does
+    global _enabled
+    _enabled = enabled
+
+def is_enabled():
+    return _enabled
+
+def timer(name):
+    '''
+    with timer('geometry'): ... adds the time spent in the block to the stage. Does nothing while disabled.
+    '''
+    return _Timing(name) if _enabled else _DISABLED
+
+def timed(name):
+    # Decorator form of timer, the whole function call is one sample of the stage
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+
+            with _Timing(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def record(name, seconds):
+    if name not in _timers:
+        _timers[name] = StageTimer()
+
+    _timers[name].add(seconds)
+
+def reset():
+    _timers.clear()
+
+# End stage timers
+
+
+# Begin profiles
+
+def samples():
+    '''
+    The recorded samples as plain lists, small enough to send from a worker process back to the parent.
+    '''
+    return {name: [stage.count, stage.total, stage.max, list(stage.samples)] for name, stage in _timers.items()}
+
+def merge(worker_samples):
+    # Adds the samples returned by samples() in another process
+    for name, (count, total, maximum, recent) in worker_samples.items():
+        if name not in _timers:
+            _timers[name] = StageTimer()
+
+        stage = _timers[name]
+        stage.count += count
+        stage.total += total
+        stage.max = max(stage.max, maximum)
+        stage.samples.extend(recent)
+
+def profile():
+    '''
+    Stats of every stage recorded so far, in STAGES order: count, total, mean, max and PERCENTILES, in seconds.
+    '''
+    names = [name for name in STAGES if name in _timers] + sorted(name for name in _timers if name not in STAGES)
+
+    return {name: _timers[name].stats() for name in names}
+
+def to_prometheus(stage_stats):
+    '''
+    The stage stats of profile() in the Prometheus text exposition format, as a summary with a stage label.
+    '''
+    lines = ['# HELP {} Time spent in each stage of scoring.'.format(PROMETHEUS_METRIC),
+             '# TYPE {} summary'.format(PROMETHEUS_METRIC)]
+
+    for name, stats in stage_stats.items():
+        for percentile in PERCENTILES:
+            lines.append('{}{{stage="{}",quantile="{}"}} {!r}'.format(PROMETHEUS_METRIC, name, percentile / 100, stats['p{}'.format(percentile)]))
+
+        lines.append('{}_sum{{stage="{}"}} {!r}'.format(PROMETHEUS_METRIC, name, stats['total']))
+        lines.append('{}_count{{stage="{}"}} {}'.format(PROMETHEUS_METRIC, name, stats['count']))
+
+    return '\n'.join(lines) + '\n'
+
+def save_profile(run_folder_path, run_info = None):
+    '''
+    Saves the profile of the run to PROFILE_JSON, with run_info (e.g. logs and wall time) alongside the stages,
+    and to PROFILE_PROMETHEUS. Returns the stage stats.
+    '''
+    stage_stats = profile()
+
+    with open(os.path.join(run_folder_path, PROFILE_JSON), 'w') as f:
+        json.dump({'run': run_info or {}, 'stages': stage_stats}, f, indent=2)
+
+    with open(os.path.join(run_folder_path, PROFILE_PROMETHEUS), 'w') as f:
+        f.write(to_prometheus(stage_stats))
+
+    return stage_stats
+
+# End profiles
+
+
+# Begin logging
+
+def configure_logging(level = config.log_level):
+    # Only the entry points configure logging, importing the scoring modules leaves it to the caller
+    logging.basicConfig(format='%(levelname)s %(name)s: %(message)s')
+    logger.setLevel(level)
+
+# End logging
@@ -0,0 +1,155 @@
+# This script will serve to define the compiled formula kernels of the batch engine. Numba is optional, without it
+# metrics_formulas uses its NumPy formulas, which these kernels match.
+
+# -- Begin imports
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# -- End imports
+
+
+# -- Begin global variables
+
+JIT_AVAILABLE = njit is not None
+
+# Same codes as metrics_formulas.CASE_*
+CASE_SAME = 0
+CASE_OPPOSITE = 1
+CASE_INTERSECTING = 2
+
+# End global variables
+
+
+# Begin scalar formulas
+
+def _jit(function):
+    # Division by zero gives inf / nan as in NumPy instead of raising. Compiled on first use and cached on disk.
+    if njit is None:
+        return function
+
+    return njit(cache=True, nogil=True, error_model='numpy')(function)
+
+@_jit
+def _maximum(a, b):
+    # np.maximum, nan if either value is nan
+    if a != a or b != b:
+        return np.nan
+
+    return a if a > b else b
+
+@_jit
+def _clip(value, low, high):
+    # np.clip, nan stays nan
+    if value < low:
+        return low
+    if value > high:
+        return high
+
+    return value
+
+@_jit
+def _d_lon_min(case, v1_sp_lon, v1_rho, v1_max_accel_lon, v1_min_decel_lon, v2_sp_lon, v2_rho, v2_max_accel_lon, v2_min_decel_lon, v2_max_decel_lon):
+    # metrics_formulas.calculate_d_lon_min_array for one frame
+    if case == CASE_SAME:
+        return _maximum(0.0, v1_sp_lon * v1_rho
+                             + 0.5 * v1_max_accel_lon * v1_rho ** 2
+                             + ((v1_sp_lon + v1_rho * v1_max_accel_lon) ** 2)/(2 * v1_min_decel_lon)
+                             - ((v2_sp_lon) ** 2)/(2 * v2_max_decel_lon))
+
+    if case == CASE_OPPOSITE:
+        return (((2 * v1_sp_lon + v1_rho * v1_max_accel_lon)/2) * v1_rho
+                + ((v1_sp_lon + v1_rho * v1_max_accel_lon) ** 2)/(2 * v1_min_decel_lon)
+                + ((2 * abs(v2_sp_lon) + v2_rho * v2_max_accel_lon)/2) * v2_rho
+                + ((abs(v2_sp_lon) + v2_rho * v2_max_accel_lon) ** 2)/(2 * v2_min_decel_lon))
+
+    if case == CASE_INTERSECTING:
+        return (v2_sp_lon * v2_rho
+                + 0.5 * v2_max_accel_lon * (v2_rho ** 2)
+                + ((v2_sp_lon + v2_rho * v2_max_accel_lon) ** 2)/(2 * v2_min_decel_lon))
+
+    return np.nan
+
+@_jit
+def _d_lat_min(mu, left_sp_lat, left_rho, left_max_accel_lat, left_min_decel_lat, right_sp_lat, right_rho, right_max_accel_lat, right_min_decel_lat):
+    # metrics_formulas.calculate_d_lat_min_array for one frame
+    first_term = ((2 * left_sp_lat + left_rho * left_max_accel_lat) / 2) * left_rho
+    second_term = ((left_sp_lat + left_rho * left_max_accel_lat) ** 2)/(2 * left_min_decel_lat)
+    third_term = ((2 * right_sp_lat - right_rho * right_max_accel_lat) / 2) * right_rho
+    fourth_term = ((right_sp_lat - right_rho * right_max_accel_lat) ** 2)/(2 * right_min_decel_lat)
+
+    return mu + _maximum((first_term + second_term - (third_term - fourth_term)), 0.0)
+
+@_jit
+def _msev_mag(case_heading, opposite, v1_d_lon_min, v2_d_lon_min, v1_sp_lon, v2_sp_lon, v2_a_lon_max_decel, n, v1_a_lon_max_decel):
+    # metrics_formulas._msev_mag_array for one frame
+    if opposite and not case_heading:
+        return 1.0
+
+    d_lon_min_same = _maximum(v1_d_lon_min, v2_d_lon_min)
+
+    if case_heading:
+        mag = (v2_sp_lon / (2 * d_lon_min_same))/v1_a_lon_max_decel
+    else:
+        mrd = (v1_sp_lon ** 2) / (2 * d_lon_min_same + ((v2_sp_lon ** 2) / (2 * n * v2_a_lon_max_decel)))
+        mag = mrd/v1_a_lon_max_decel
+
+    return _clip(mag, 0.0, 1.0)
+
+# End scalar formulas
+
+
+# Begin fused kernels
+
+@_jit
+def envelope_kernel(vut_case, challenger_case, vut_sp, challenger_sp, left_lat_sp, right_lat_sp, vut_d_lon, vut_d_lat,
+                    challenger_lon_acc, challenger_lat_acc, vut_heading_offset, challenger_heading_offset,
+                    front_bumper_distance, rear_bumper_distance, vut_rss, challenger_rss, mu, sevm_n,
+                    vut_d_lon_min, vut_d_lat_min, challenger_d_lon_min, lon_violation, lat_violation, sei, sev, sevm):
+    '''
+    SEI, SEV and SEVM of every frame in one pass, the safety envelope block of metrics_formulas._score_frames.
+
+    The per-frame inputs are contiguous float64 arrays (int arrays for the cases). vut_rss and challenger_rss are
+    float64 arrays of [responseTime, alphaLon_accelMax, alphaLon_brakeMin, alphaLon_brakeMax, alphaLat_accelMax,
+    alphaLat_accelMin], see rss_vector. The results are written to the last eight arrays.
+    '''
+    vut_rho, vut_accel_max, vut_brake_min, vut_brake_max, vut_lat_accel_max, vut_lat_accel_min = vut_rss[0], vut_rss[1], vut_rss[2], vut_rss[3], vut_rss[4], vut_rss[5]
+    ch_rho, ch_accel_max, ch_brake_min, ch_brake_max, ch_lat_accel_max, ch_lat_accel_min = challenger_rss[0], challenger_rss[1], challenger_rss[2], challenger_rss[3], challenger_rss[4], challenger_rss[5]
+
+    for i in range(len(vut_sp)):
+        # Safety Envelope Infringement
+        vut_d_lon_min[i] = _d_lon_min(vut_case[i], vut_sp[i], vut_rho, vut_accel_max, vut_brake_min,
+                                      challenger_sp[i], ch_rho, ch_accel_max, ch_brake_min, ch_brake_max)
+        vut_d_lat_min[i] = _d_lat_min(mu, left_lat_sp[i], vut_rho, vut_lat_accel_max, vut_lat_accel_min,
+                                      right_lat_sp[i], ch_rho, ch_lat_accel_max, ch_lat_accel_min)
+        challenger_d_lon_min[i] = _d_lon_min(challenger_case[i], challenger_sp[i], ch_rho, ch_accel_max, ch_brake_min,
+                                             vut_sp[i], vut_rho, vut_accel_max, vut_brake_min, vut_brake_max)
+
+        lon_violation[i] = vut_d_lon[i] < vut_d_lon_min[i]
+        lat_violation[i] = vut_d_lat[i] < vut_d_lat_min[i]
+        sei[i] = lon_violation[i] and (vut_case[i] == CASE_INTERSECTING or lat_violation[i])
+
+        # Safety Envelope Violation
+        sev[i] = (lon_violation[i] and lat_violation[i]
+                  and challenger_lon_acc[i] <= ch_brake_max
+                  and abs(challenger_lat_acc[i]) <= abs(ch_lat_accel_max))
+
+        # Safety Envelope Violation Magnitude
+        if sei[i]:
+            heading_difference = vut_heading_offset[i] - challenger_heading_offset[i]
+            sevm[i] = _msev_mag(abs(heading_difference) > 5, heading_difference >= 0 and front_bumper_distance[i] < rear_bumper_distance[i],
+                                vut_d_lon_min[i], challenger_d_lon_min[i], vut_sp[i], challenger_sp[i],
+                                vut_accel_max, sevm_n, vut_accel_max)
+        else:
+            sevm[i] = 0.0
+
+def rss_vector(rss):
+    # The RSS parameters in the order envelope_kernel reads them
+    return np.array([rss.responseTime, rss.alphaLon_accelMax, rss.alphaLon_brakeMin, rss.alphaLon_brakeMax,
+                     rss.alphaLat_accelMax, rss.alphaLat_accelMin], dtype=np.float64)
+
+# End fused kernels
@@ -0,0 +1,123 @@
+# This script will serve to cache parsed input logs in a columnar binary format, so that a log is only
+# parsed from CSV once no matter how many times it is scored.
+
+# -- Begin imports
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+# -- End imports
+
+
+# -- Begin global variables
+
+# Bump when the cached contents change (e.g. a new derived column) so that old entries are not reused
+CACHE_VERSION = 1
+
+HASH_BLOCK_SIZE = 1 << 20
+
+# End global variables
+
+
+# Begin helper methods
+
+def hash_file(file):
+    '''
+    Content hash of a file, read in blocks so that large logs are never held in memory.
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def get_cache_format(cache_format):
+    # Feather needs pyarrow, the .npy format only needs numpy
+    if cache_format == 'feather' and feather is None:
+        return 'npy'
+
+    return cache_format
+
+def _write_atomic(path, write):
+    # Write to a temporary file first so that an interrupted run never leaves a truncated cache entry
+    temp_path = path + '.tmp'
+    write(temp_path)
+    os.replace(temp_path, path)
+
+def _save_feather(data_df, path):
+    # Uncompressed, so that the file can be memory-mapped when it is read back
+    _write_atomic(path, lambda temp_path: feather.write_feather(data_df, temp_path, compression='uncompressed'))
+
+def _load_feather(path):
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+def _save_npy(data_df, path):
+    # One float64 row per column, so that every column is contiguous in the file
+    values = np.ascontiguousarray(data_df.to_numpy(dtype=np.float64).T)
+
+    with open(path + '.json', 'w') as f:
+        json.dump({'columns': list(data_df.columns)}, f)
+
+    def write(temp_path):
+        with open(temp_path, 'wb') as f:
+            np.save(f, values)
+
+    _write_atomic(path, write)
+
+def _load_npy(path):
+    with open(path + '.json') as f:
+        columns = json.load(f)['columns']
+
+    values = np.load(path, mmap_mode='r')
+
+    # The transpose is the block layout pandas uses, so every column stays a view of the memory-mapped file
+    return pd.DataFrame(values.T, columns=columns, copy=False)
+
+# End helper methods
+
+
+# Begin cache
+
+def load_log(file, cache_path, prepare = None, cache_format = 'feather'):
+    '''
+    Returns the parsed log as a DataFrame, from the cache when an entry for its contents exists.
+
+    On a miss the CSV is parsed, prepare (if given) adds derived columns in place, and the result is cached.
+    Entries are keyed by the content hash of the CSV, so renamed or copied logs still hit and edited logs miss.
+    '''
+    cache_format = get_cache_format(cache_format)
+    cache_name = os.path.join(cache_path, '{}-v{}.{}'.format(hash_file(file), CACHE_VERSION, cache_format))
+
+    if os.path.exists(cache_name):
+        if cache_format == 'feather':
+            return _load_feather(cache_name)
+        return _load_npy(cache_name)
+
+    data_df = pd.read_csv(file, sep = r',', skipinitialspace= True)
+
+    if prepare is not None:
+        prepare(data_df)
+
+    os.makedirs(cache_path, exist_ok=True)
+
+    if cache_format == 'feather':
+        _save_feather(data_df, cache_name)
+    elif all(pd.api.types.is_numeric_dtype(dtype) for dtype in data_df.dtypes):
+        _save_npy(data_df, cache_name)
+    else:
+        print('Log {} has non-numeric columns and can only be cached with pyarrow installed.'.format(file))
+
+    return data_df
+
+# End cache
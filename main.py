@@ -1,12 +1,539 @@
 # This script will serve as the main entry point for the visualization. Every function should be as basic
 # as possible, reusability and maintainability are the highest priority. Define everything, leave nothing to question.
 
+# -- Begin imports
+
+import pandas as pd
+import glob
+import os
+import sys
+
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import config
+import metrics_formulas as mf
+import log_cache
+import instrumentation
+import resampling
+import result_sink
+import run_manifest
+import episodes
+import multi_actor
+import visualization
+
+# -- End imports
+
+
+# Begin helper methods
+
+def calculate_delta_vel_lon(data_df):
+    '''
+    calculate delta in velocity
+    delta_v = v_fol - v_lead
+    '''
+
+    delta_vel = data_df['VUT sp'] - data_df['challenger sp']
+    data_df['delta_vel_lon'] = delta_vel
+
+# Get the difference in accelerations of the two vehicles
+def calculate_delta_acc_lon(data_df):
+    '''
+    calculate delta in acceleration
+    delta_acc_lon = a_fol - a_lead
+    '''
+
+    delta_acc = data_df['VUT lon acc'] - data_df['challenger lon acc']
+    data_df['delta_acc_lon'] = delta_acc
+
+def add_derived_columns(data_df):
+    # Multi-actor logs have no VUT / challenger columns, their pairs are built when they are scored
+    if multi_actor.is_multi_actor(data_df):
+        return
+
+    calculate_delta_vel_lon(data_df)
+    calculate_delta_acc_lon(data_df)
+
+def read_log(file, cache_path = None):
+    '''
+    Parses one log. With a cache_path the parsed log, derived columns included, comes from the log cache.
+    '''
+    with instrumentation.timer('read'):
+        if cache_path is None:
+            return pd.read_csv(file, sep = r',', skipinitialspace= True)
+
+        return log_cache.load_log(file, cache_path, add_derived_columns, config.log_cache_format)
+
+def process_log(data_df):
+    '''
+    Scores one log with the batch engine in metrics_formulas.
+
+    Returns [data_df, da_score_dict, overall_da_score], the same as the legacy row loop.
+    '''
+    if 'delta_acc_lon' not in data_df.columns:
+        add_derived_columns(data_df)
+
+    ## Collision Incident Check Begin ##
+    ci_occurs = 0
+
+    # If a collision occurs, remove the last row as it doesn't have useful info
+    if (data_df.loc[len(data_df.index) - 1]['timestamp'] == 0):
+        ci_occurs = 1
+        data_df = data_df.drop(index = [len(data_df.index) - 1])
+
+    ## Collision Incident Check End ##
+
+    # Resampled after the collision check, the collision row has no valid timestamp
+    if config.resample_rate is not None:
+        data_df = resampling.resample_log(data_df, config.resample_rate)
+
+    metric_columns, da_score_dict, overall_da_score = mf.calculate_metrics_batch(data_df, ci_occurs)
+
+    for key, value in metric_columns.items():
+        data_df[key] = value
+
+    # PET compares every frame with every other one, so it is only available when the whole log is scored at once
+    if 'PET' in config.metrics:
+        data_df['PET'] = mf.calculate_pet_array(data_df['VUT x'], data_df['VUT y'], data_df['VUT heading'], config.vut_dimensions[0],
+                                                data_df['challenger x'], data_df['challenger y'], data_df['challenger heading'], config.challenger_dimensions[0],
+                                                data_df['timestamp'], config.pet_radius)
+
+    return [data_df, da_score_dict, overall_da_score]
+
+def process_log_triage(data_df):
+    '''
+    Scores one log's DA score in two tiers, see metrics_formulas.calculate_da_score_triage. No per-frame columns
+    are added to data_df.
+
+    Returns [da_score_dict, overall_da_score], the same as process_log.
+    '''
+    ## Collision Incident Check Begin ##
+    ci_occurs = 0
+
+    # If a collision occurs, remove the last row as it doesn't have useful info
+    if (data_df.loc[len(data_df.index) - 1]['timestamp'] == 0):
+        ci_occurs = 1
+        data_df = data_df.drop(index = [len(data_df.index) - 1])
+
+    ## Collision Incident Check End ##
+
+    if config.resample_rate is not None:
+        data_df = resampling.resample_log(data_df, config.resample_rate)
+
+    da_score_dict, overall_da_score, _ = mf.calculate_da_score_triage(data_df, ci_occurs)
+
+    return [da_score_dict, overall_da_score]
+
+def get_scenario_name_from_filename(file):
+    return os.path.splitext(os.path.basename(file))[0]
+
+def get_input_files(data_path):
+    '''
+    Checks the experiment folder layout and returns [input_files, output_path], creating missing folders.
+    '''
+    input_path = os.path.join(data_path + '/Input')
+    output_path = os.path.join(data_path + '/Output')
+
+    # Check to see if the experiment folder exists
+    if not os.path.exists(data_path):
+        print('Experiment Folder path does not exist. Creating path. Please place input data into the Input folder and re-run this script.')
+        os.makedirs(input_path)
+        os.makedirs(output_path)
+        return [[], output_path]
+
+    # Grab the input data
+    if not os.path.exists(input_path):
+        print('Input folder path not found. Please place input data into the Input folder and re-run this script.')
+        os.makedirs(input_path)
+        return [[], output_path]
+
+    input_files = sorted(glob.glob(input_path + '/*.csv'))
+
+    # Check to see if there are any files to be processed
+    if len(input_files) == 0:
+        print('ERROR: No files found to be processed. Aborting.')
+    else:
+        print('Files to be processed: {}'.format(len(input_files)))
+
+    # Create the output file path
+    if not os.path.exists(output_path):
+        print('Output folder path not found. Creating path...')
+        os.makedirs(output_path)
+
+    return [input_files, output_path]
+
+def process_log_streaming(file, sink, scenario_name, chunk_rows = config.stream_chunk_rows):
+    '''
+    Scores one log in chunks of chunk_rows rows, appending each chunk's results to the scenario's 'dsa_results'
+    table in sink as it is scored.
+
+    The episode trackers and the running da_score_dict are carried across chunk boundaries, so memory stays
+    bounded by the chunk size however long the drive is. With config.resample_rate the chunks are resampled
+    as they are read. Returns [da_score_dict, overall_da_score].
+    '''
+    state = mf.EpisodeState()
+    da_score_dict = None
+
+    resampler = None if config.resample_rate is None else resampling.Resampler(config.resample_rate)
+
+    # The last two rows are held back until the next chunk arrives. The collision row (timestamp == 0) can
+    # only be recognised at the end of the log and CI is then reported on the row before it.
+    held_rows = None
+
+    def score_chunk(chunk_df, ci_occurs):
+        nonlocal da_score_dict
+
+        if len(chunk_df) == 0:
+            return
+
+        calculate_delta_vel_lon(chunk_df)
+        calculate_delta_acc_lon(chunk_df)
+
+        metric_columns, chunk_da_score_dict, _ = mf.calculate_metrics_batch(chunk_df, ci_occurs, state=state)
+
+        for key, value in metric_columns.items():
+            chunk_df[key] = value
+
+        with instrumentation.timer('output'):
+            sink.append('dsa_results', chunk_df, scenario_name)
+
+        if da_score_dict is None:
+            da_score_dict = chunk_da_score_dict
+        else:
+            da_score_dict = mf.merge_da_score(da_score_dict, chunk_da_score_dict)
+
+    def resample(chunk_df, last = False):
+        if resampler is None:
+            return chunk_df
+
+        resampled_df = resampler.push(chunk_df)
+        if last:
+            resampled_df = pd.concat([resampled_df, resampler.finish()], ignore_index=True)
+
+        return resampled_df
+
+    for chunk_df in pd.read_csv(file, sep = r',', skipinitialspace= True, chunksize=chunk_rows):
+        if held_rows is not None:
+            chunk_df = pd.concat([held_rows, chunk_df], ignore_index=True)
+
+        held_rows = chunk_df.iloc[-2:].reset_index(drop=True)
+        score_chunk(resample(chunk_df.iloc[:-2].reset_index(drop=True)), 0)
+
+    ## Collision Incident Check Begin ##
+    ci_occurs = 0
+
+    # If a collision occurs, remove the last row as it doesn't have useful info
+    if held_rows is not None and len(held_rows) > 0:
+        if held_rows['timestamp'].iloc[-1] == 0:
+            ci_occurs = 1
+            held_rows = held_rows.iloc[:-1]
+
+        score_chunk(resample(held_rows.reset_index(drop=True), last=True), ci_occurs)
+
+    ## Collision Incident Check End ##
+
+    return [da_score_dict, mf.calculate_overall_da_score(da_score_dict)]
+
+def score_log_file(file, run_folder_path, stream = config.stream_logs, cache_path = None, triage = config.triage_logs):
+    '''
+    Scores one log file and saves its per-frame results. Runs inside a worker process, all state is local.
+    Streamed logs are always read from the CSV, the log cache is only used for whole logs. Triaged logs only
+    have their DA score computed, nothing is saved for them.
+
+    Returns the scenario's row of the DA score summary table.
+    '''
+    scenario_name = get_scenario_name_from_filename(file)
+
+    if multi_actor.is_multi_actor(pd.read_csv(file, sep = r',', skipinitialspace= True, nrows=0)):
+        return score_multi_actor_file(file, run_folder_path, cache_path)
+
+    if triage:
+        da_score_dict, overall_da_score = process_log_triage(read_log(file, cache_path))
+
+        da_score_row = dict(da_score_dict)
+        da_score_row['DA Score'] = overall_da_score
+        da_score_row['Scenario Number'] = scenario_name
+
+        return da_score_row
+
+    with result_sink.open_sink(run_folder_path) as sink:
+        if stream:
+            da_score_dict, overall_da_score = process_log_streaming(file, sink, scenario_name)
+        else:
+            current_log_df = read_log(file, cache_path)
+
+            processed_df = process_log(current_log_df)
+
+            with instrumentation.timer('output'):
+                sink.append('dsa_results', processed_df[0], scenario_name)
+
+            # Episodes span chunks, so the table is only written when the whole log is scored at once
+            if config.episode_tables:
+                sink.append('episodes', episodes.segment_scored_log(processed_df[0]), scenario_name)
+
+            da_score_dict, overall_da_score = processed_df[1], processed_df[2]
+
+        if config.visualize_logs:
+            # Streamed logs are read back from their results, only the plotted columns
+            if stream:
+                plot_columns = ['timestamp'] + [col for col in visualization.PLOT_COLUMNS if col in mf.DA_SCORE_METRICS or col in config.metrics]
+                plot_df = sink.read('dsa_results', scenario_name, plot_columns)
+            else:
+                plot_df = processed_df[0]
+
+            visualization.create_visualizations(plot_df, run_folder_path, scenario_name)
+
+    if config.render_scenarios and not stream:
+        render_name = scenario_name + ('-scenario' if config.render_format == 'png' else '-scenario.' + config.render_format)
+        visualization.render_scenario(processed_df[0], os.path.join(run_folder_path, render_name))
+
+    # The DA Score row
+    da_score_row = dict(da_score_dict)
+    da_score_row['DA Score'] = overall_da_score
+    da_score_row['Scenario Number'] = scenario_name
+
+    return da_score_row
+
+def score_multi_actor_file(file, run_folder_path, cache_path = None):
+    '''
+    Scores a multi-actor log, the VUT (config.multi_actor_vut_id) against every actor around it. The per pair
+    results are saved next to the other results, and the VUT's DA score row is returned.
+    '''
+    scenario_name = get_scenario_name_from_filename(file)
+
+    pair_df, ego_df = multi_actor.score_scene(read_log(file, cache_path), [config.multi_actor_vut_id])
+
+    with instrumentation.timer('output'), result_sink.open_sink(run_folder_path) as sink:
+        sink.append('pairs', pair_df, scenario_name)
+
+    # The same key order as the rows of score_log_file, Scenario Number first
+    da_score_row = {'Scenario Number': scenario_name}
+    da_score_row.update(ego_df.iloc[0].drop(['Ego', 'Scored Actors']).to_dict())
+
+    return da_score_row
+
+def sweep_multi_actor_log(actors_df, parameter_sets):
+    '''
+    The VUT's [da_score_dict, overall_da_score] in a multi-actor log for every [vut_rss, challenger_rss] pair in
+    parameter_sets. The pairs of actors change with the RSS parameters (broad phase), so the scene is scored once
+    per parameter set rather than with stacked parameters.
+    '''
+    results = []
+
+    for vut_rss, challenger_rss in parameter_sets:
+        _, ego_df = multi_actor.score_scene(actors_df, [config.multi_actor_vut_id], vut_rss, challenger_rss)
+        da_score_dict = ego_df.iloc[0].drop(['Ego', 'Scored Actors']).to_dict()
+        results.append([da_score_dict, da_score_dict['DA Score']])
+
+    return results
+
+def sweep_log_file(file, parameter_sets, cache_path = None):
+    '''
+    Scores one log file for every [vut_rss, challenger_rss] pair in parameter_sets. Runs inside a worker process.
+
+    Returns the scenario's rows of the sweep table, one per parameter set.
+    '''
+    scenario_name = get_scenario_name_from_filename(file)
+    data_df = read_log(file, cache_path)
+
+    if multi_actor.is_multi_actor(data_df):
+        results = sweep_multi_actor_log(data_df, parameter_sets)
+    else:
+        ## Collision Incident Check Begin ##
+        ci_occurs = 0
+
+        # If a collision occurs, remove the last row as it doesn't have useful info
+        if (data_df.loc[len(data_df.index) - 1]['timestamp'] == 0):
+            ci_occurs = 1
+            data_df = data_df.drop(index = [len(data_df.index) - 1])
+
+        ## Collision Incident Check End ##
+
+        if config.resample_rate is not None:
+            data_df = resampling.resample_log(data_df, config.resample_rate)
+
+        results = mf.calculate_metrics_sweep(data_df, parameter_sets, ci_occurs)
+
+    sweep_rows = []
+
+    for parameter_set, (pair, result) in enumerate(zip(parameter_sets, results)):
+        sweep_row = {'Scenario Number': scenario_name, 'Parameter Set': parameter_set}
+
+        for prefix, rss in zip(['VUT', 'challenger'], pair):
+            for name in mf.RSS_PARAMETER_NAMES:
+                sweep_row['{} {}'.format(prefix, name)] = getattr(rss, name)
+
+        sweep_row.update(result[0])
+        sweep_row['Scenario Number'] = scenario_name
+        sweep_row['DA Score'] = result[1]
+        sweep_rows.append(sweep_row)
+
+    return sweep_rows
+
+def run_task(task, file, *task_args):
+    '''
+    Runs task in a worker process. Returns [result, signature, seconds, stage_samples], the input is hashed before
+    it is scored and stage_samples holds the stage times of this log when profiling (instrumentation.samples).
+    '''
+    start_time = time.time()
+    instrumentation.reset()
+
+    with instrumentation.timer('log'):
+        signature = run_manifest.file_signature(file)
+        result = task(file, *task_args)
+
+    return [result, signature, time.time() - start_time, instrumentation.samples()]
+
+# End helper methods
+
+
+# Begin batch entry point
+
+def calculate_safety_metrics_parallel(data_path, workers = config.batch_workers, sweep = False, resume = config.resume_runs, profile = config.profile_stages):
+    '''
+    Scores every log in the Input folder in a process pool.
+
+    Each finished scenario's DA score is appended to the summary table as soon as it completes. Only
+    workers * config.batch_queue_per_worker logs are in flight at a time, so thousands of logs can be queued.
+
+    With sweep, every log is scored for each combination of config.sweep_vut_rss and config.sweep_challenger_rss
+    and the summary is one tidy table with a row per scenario and parameter set.
+
+    Every scored log is recorded in the run manifest. With resume, logs that are unchanged since they were
+    scored with the same configuration are not scored again, their recorded rows go into the summary table and
+    their results stay in the run folder they were saved to.
+
+    With profile, the stage times of every scored log are collected from the workers and saved to the run folder,
+    see instrumentation.save_profile.
+    '''
+    start_elapsed_time = time.time()
+
+    # A bad configuration fails here rather than inside every worker
+    run_manifest.check_config(sweep)
+
+    input_files, output_path = get_input_files(data_path)
+
+    if len(input_files) == 0:
+        return
+
+    now = datetime.now()
+    run_folder_path = os.path.join(output_path, now.strftime('%d-%m-%Y-%H%M%S'))
+    os.makedirs(run_folder_path, exist_ok=True)
+
+    cache_path = None
+    if config.use_log_cache:
+        cache_path = config.log_cache_path or os.path.join(data_path, 'Cache')
+
+    if sweep:
+        parameter_sets = mf.rss_sweep_grid(config.sweep_vut_rss, config.sweep_challenger_rss)
+        print('Parameter sets per log: {}'.format(len(parameter_sets)))
+
+        summary_table = 'RSS Sweep'
+        task, task_args = sweep_log_file, [parameter_sets, cache_path]
+    else:
+        summary_table = 'DA Scores'
+        task, task_args = score_log_file, [run_folder_path, config.stream_logs, cache_path, config.triage_logs]
+
+    snapshot = run_manifest.config_snapshot(sweep)
+    fingerprint = run_manifest.config_fingerprint(snapshot)
+    manifest = run_manifest.load_manifest(output_path) if resume else {}
+
+    files_to_score = []
+    reused_rows = []
+
+    for file in input_files:
+        entry = manifest.get((os.path.basename(file), fingerprint))
+
+        if entry is not None and run_manifest.is_unchanged(entry, file):
+            reused_rows.extend(entry['rows'])
+        else:
+            files_to_score.append(file)
+
+    if resume:
+        print('Logs to be scored: {} ({} unchanged since they were scored)'.format(len(files_to_score), len(input_files) - len(files_to_score)))
+
+    run_manifest.record_run(output_path, run_folder_path, snapshot)
+
+    workers = workers or os.cpu_count()
+    pending_files = iter(files_to_score)
+    completed = 0
+
+    instrumentation.enable(profile)
+    instrumentation.reset()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=instrumentation.enable, initargs=(profile,)) as pool, result_sink.open_sink(run_folder_path) as summary_sink:
+        in_flight = {}
+
+        if len(reused_rows) > 0:
+            summary_sink.append(summary_table, pd.DataFrame(reused_rows))
+
+        def submit_next():
+            file = next(pending_files, None)
+            if file is not None:
+                in_flight[pool.submit(run_task, task, file, *task_args)] = file
+
+        for _ in range(workers * config.batch_queue_per_worker):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                file = in_flight.pop(future)
+                submit_next()
+                completed += 1
+
+                try:
+                    result, signature, seconds, stage_samples = future.result()
+                except Exception as e:
+                    print('ERROR: {} could not be processed: {}'.format(file, repr(e)))
+                    continue
+
+                # A sweep returns one row per parameter set
+                da_score_rows = result if sweep else [result]
+                instrumentation.merge(stage_samples)
+
+                summary_sink.append(summary_table, pd.DataFrame(da_score_rows))
+                run_manifest.record_log(output_path, file, signature, fingerprint, run_folder_path, da_score_rows, seconds)
+
+                da_scores = [da_score_row['DA Score'] for da_score_row in da_score_rows]
+                if sweep:
+                    print('[{}/{}] {}: DA Score {:.2f} to {:.2f} ({:.2f}[s])'.format(completed, len(files_to_score), da_score_rows[0]['Scenario Number'], min(da_scores), max(da_scores), seconds))
+                else:
+                    print('[{}/{}] {}: DA Score {:.2f} ({:.2f}[s])'.format(completed, len(files_to_score), da_score_rows[0]['Scenario Number'], da_scores[0], seconds))
+
+    end_elapsed_time = (time.time()-start_elapsed_time)
+    print('Total elapsed time: {}[min]'.format(end_elapsed_time/60.0))
+
+    if profile:
+        run_info = {'logs scored': len(files_to_score), 'logs reused': len(input_files) - len(files_to_score),
+                    'workers': workers, 'sweep': sweep, 'seconds': end_elapsed_time}
+        instrumentation.save_profile(run_folder_path, run_info)
+        print('Profile saved to {}'.format(os.path.join(run_folder_path, instrumentation.PROFILE_JSON)))
+
+# End batch entry point
+
+
 def main():
-    print('Hello')
-    
-    print("Test")
+    # Usage: python main.py <experiment folder> [workers] [--sweep] [--rescore] [--profile]
+    sweep = '--sweep' in sys.argv
+    resume = config.resume_runs and '--rescore' not in sys.argv
+    profile = config.profile_stages or '--profile' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg not in ['--sweep', '--rescore', '--profile']]
+
+    if len(args) < 1:
+        print('Usage: python main.py <experiment folder> [workers] [--sweep] [--rescore] [--profile]')
+        return
+
+    instrumentation.configure_logging()
+
+    data_path = args[0]
+    workers = int(args[1]) if len(args) > 1 else config.batch_workers
+
+    calculate_safety_metrics_parallel(data_path, workers, sweep, resume, profile)
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1 +1,1253 @@
-# This script will serve to define the abstract metrics formulas.
\ No newline at end of file
+# This script will serve to define the abstract metrics formulas.
+
+# -- Begin imports
+
+import numpy as np
+
+import copy
+import itertools
+import time
+from collections import deque
+
+import config
+import instrumentation
+import jit_kernels
+import object as so
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# -- End imports
+
+
+# -- Begin global variables
+
+# Case codes used by the array formulas
+CASE_SAME = 0
+CASE_OPPOSITE = 1
+CASE_INTERSECTING = 2
+
+CASE_CODES = {
+    'same':         CASE_SAME,
+    'opposite':     CASE_OPPOSITE,
+    'intersecting': CASE_INTERSECTING,
+}
+
+# Side codes returned by the d_lat kernel
+SIDE_NONE = 0
+SIDE_LEFT = 1
+SIDE_RIGHT = 2
+
+# Keys of da_score_dict that are running maxima and running counts
+DA_SCORE_MAXIMA = ['SEI', 'SEVM', 'SERTV', 'SERTVM', 'EMI', 'EMIM', 'CI', 'CIM', 'ORTV', 'ORTVM']
+DA_SCORE_COUNTS = ['SEIC', 'SEVC', 'SERTVC', 'EMIC', 'ORTVC']
+
+# Per-frame columns the batch engine can produce, in output order, and the columns each is computed from
+METRIC_DEPENDENCIES = {
+    'SEI':                      ['SEI LON', 'SEI LAT'],
+    'SEV':                      ['SEI LON', 'SEI LAT'],
+    'SEVM':                     ['SEI'],
+    'SERTV':                    ['SEI'],
+    'SERTVM':                   ['SEI'],
+    'EMI':                      ['SEI'],
+    'EMIM':                     ['EMI'],
+    'CI':                       [],
+    'CIM':                      ['CI'],
+    'ORTV':                     ['SEI'],
+    'ORTVM':                    ['SEI'],
+    'DA Score':                 ['SEI', 'SEVM', 'SERTV', 'SERTVM', 'EMI', 'EMIM', 'CI', 'CIM', 'ORTV', 'ORTVM'],
+    'VUT Accel':                [],
+    'VUT Speed':                [],
+    'Distance to SO':           [],
+    'Safety Envelope Distance': [],
+    'TTC':                      ['Distance to SO'],
+    'MTTC':                     ['Distance to SO'],
+    'THW':                      ['Distance to SO'],
+    # Whole logs only, added by main.process_log
+    'PET':                      [],
+    'SEI LON':                  [],
+    'SEI LAT':                  [],
+    'SER LON':                  [],
+    'SER LAT':                  [],
+    'SER':                      [],
+    'SERV LON':                 ['SER LON'],
+    'SERV LAT':                 ['SER LAT'],
+    'SERV':                     ['SER'],
+}
+
+# Columns read by summarize_da_score, always produced
+DA_SCORE_METRICS = ['SEI', 'SEV', 'SEVM', 'SERTV', 'SERTVM', 'EMI', 'EMIM', 'CI', 'CIM', 'ORTV', 'ORTVM']
+
+SURROGATE_METRICS = ['TTC', 'MTTC', 'THW']
+
+# Offset subtracted from the heading ray distance when computing d_lat
+D_LAT_OFFSET = 1.5
+# Minimum side to side distance for the challenger to count as beside the VUT
+D_LAT_SIDE_MIN = 0.2
+
+# Distance (m) the triage bounds of _far_frames must clear by, so that rounding can't rule out a frame
+TRIAGE_MARGIN = 1e-3
+
+# The missing numba warning of config.formula_backend = 'numba' is only logged once
+_jit_warning_shown = False
+
+# End global variables
+
+
+# Begin geometry kernels
+
+def paths_intersecting_array(vut, challenger):
+    # Both VUT side rays against both challenger side rays in one call, shape (2, 2, N)
+    vut_start, vut_end = np.stack([vut.left_side_line, vut.right_side_line], axis=1)
+    challenger_start, challenger_end = np.stack([challenger.left_side_line, challenger.right_side_line], axis=1)
+
+    return so.segments_intersect(vut_start[:, None], vut_end[:, None], challenger_start[None], challenger_end[None]).any(axis=(0, 1))
+
+def facing_front_or_rear_array(vut, challenger):
+    return (so.segments_intersect(*vut.heading_vector, *challenger.front_bumper)
+            | so.segments_intersect(*vut.heading_vector, *challenger.rear_bumper))
+
+def bumper_distances_array(vut, challenger):
+    '''
+    Distances from the VUT front bumper to the challenger front and rear bumpers.
+    '''
+    start, end = np.stack([challenger.front_bumper, challenger.rear_bumper], axis=1)
+
+    return so.segment_distance(*vut.front_bumper, start, end)
+
+def classify_case_array(vut, challenger):
+    '''
+    Vectorized case classification, the CASE_* code of every frame.
+    '''
+    intersecting = paths_intersecting_array(vut, challenger) & ~facing_front_or_rear_array(vut, challenger)
+    distance_to_front_bumper, distance_to_rear_bumper = bumper_distances_array(vut, challenger)
+
+    return np.where(intersecting, CASE_INTERSECTING, np.where(distance_to_front_bumper < distance_to_rear_bumper, CASE_OPPOSITE, CASE_SAME))
+
+def d_lon_aligned_array(vut, challenger, bumper_distances = None):
+    '''
+    d_lon of the same and opposite direction cases. Returns [opposite, d_lon], opposite being True where the
+    challenger's front bumper is the closer one. bumper_distances reuses a bumper_distances_array result.
+    '''
+    # Longitudinal leg of the triangle between the bumpers
+    if bumper_distances is None:
+        bumper_distances = bumper_distances_array(vut, challenger)
+    distance_to_front_bumper, distance_to_rear_bumper = bumper_distances
+    opposite = distance_to_front_bumper < distance_to_rear_bumper
+
+    c = np.where(opposite, distance_to_front_bumper, distance_to_rear_bumper)
+    a = np.where(opposite,
+                 so.point_segment_distance(challenger.front, *vut.heading_vector),
+                 so.point_segment_distance(challenger.rear, *vut.heading_vector))
+
+    squared = c ** 2 - a ** 2
+
+    return [opposite, np.sqrt(np.where(squared >= 0, squared, 0.0))]
+
+def d_lon_array(vut, challenger):
+    '''
+    Vectorized d_lon. Returns [case, d_lon] where case holds the CASE_* codes.
+    '''
+    intersecting = paths_intersecting_array(vut, challenger) & ~facing_front_or_rear_array(vut, challenger)
+
+    # Intersecting paths, distance from the VUT corners to the closest intersection point
+    # Both VUT side rays against the challenger side rays and bumpers, shape (2, 4, N)
+    vut_start, vut_end = np.stack([vut.left_side_line, vut.right_side_line], axis=1)
+    challenger_start, challenger_end = np.stack([challenger.left_side_line, challenger.right_side_line,
+                                                 challenger.front_bumper, challenger.rear_bumper], axis=1)
+
+    hit, start, end = so.segment_intersection(vut_start[:, None], vut_end[:, None], challenger_start[None], challenger_end[None])
+
+    # Every corner against every intersection, shape (4, 2, 4, N)
+    distance = so.point_segment_distance(vut.corners[:, None, None], start[None], end[None])
+    d_lon_intersecting = np.where(hit[None], distance, np.inf).min(axis=(0, 1, 2))
+
+    opposite, d_lon_aligned = d_lon_aligned_array(vut, challenger)
+
+    case = np.where(intersecting, CASE_INTERSECTING, np.where(opposite, CASE_OPPOSITE, CASE_SAME))
+    d_lon = np.where(intersecting, d_lon_intersecting, d_lon_aligned)
+
+    return [case, d_lon]
+
+def d_lat_array(vut, challenger):
+    '''
+    Vectorized d_lat. Returns [side, d_lat] where side holds the SIDE_* codes.
+    '''
+    # Both VUT sides against both challenger sides, shape (2, 2, N)
+    vut_start, vut_end = np.stack([vut.left_side, vut.right_side], axis=1)
+    challenger_start, challenger_end = np.stack([challenger.left_side, challenger.right_side], axis=1)
+
+    side_distances = so.segment_distance(vut_start[:, None], vut_end[:, None], challenger_start[None], challenger_end[None])
+    distance_from_left_to_left, distance_from_left_to_right = side_distances[0]
+    distance_from_right_to_left, distance_from_right_to_right = side_distances[1]
+
+    # Front bumper, rear bumper and heading ray against the challenger box, shape (3, N)
+    start, end = np.stack([vut.front_bumper, vut.rear_bumper, vut.heading_vector], axis=1)
+    distance_from_front_to_chall, distance_from_rear_to_chall, distance_from_heading_to_chall = challenger.distance_to_segment(start, end)
+
+    front_closer = distance_from_front_to_chall < distance_from_rear_to_chall
+
+    right = ((distance_from_right_to_left < distance_from_left_to_left)
+             & (distance_from_right_to_left > D_LAT_SIDE_MIN)
+             & front_closer)
+    left = (~right
+            & (distance_from_left_to_right < distance_from_right_to_right)
+            & (distance_from_left_to_right > D_LAT_SIDE_MIN)
+            & front_closer)
+
+    d_lat = distance_from_heading_to_chall - D_LAT_OFFSET
+
+    side = np.where(right, SIDE_RIGHT, np.where(left, SIDE_LEFT, SIDE_NONE))
+
+    return [side, np.where(right | left, d_lat, 0.0)]
+
+# End geometry kernels
+
+
+# Begin formula kernels
+
+def case_codes(case):
+    '''
+    Converts case names ('same', 'opposite', 'intersecting') to CASE_* codes. Integer codes are returned unchanged.
+
+    Unknown names map to -1, for which the d_lon_min kernel returns nan.
+    '''
+    case = np.asarray(case)
+
+    if case.dtype.kind in 'iu':
+        return case
+
+    codes = np.full(case.shape, -1, dtype=np.int8)
+
+    for name, code in CASE_CODES.items():
+        codes[case == name] = code
+
+    return codes
+
+def calculate_d_lon_min_array(case, v1_sp_lon, v1_rho, v1_max_accel_lon, v1_min_decel_lon, v2_sp_lon, v2_rho, v2_max_accel_lon, v2_min_decel_lon, v2_max_decel_lon):
+    '''
+    Array version of calculate_d_lon_min.
+
+    Every argument broadcasts, so case can be a per-row array of names or CASE_* codes and the speeds can be
+    one log (frames,) or a whole batch of logs (logs, frames). The RSS parameters may be scalars or arrays.
+    '''
+    case = case_codes(case)
+
+    v1_sp_lon = np.asarray(v1_sp_lon, dtype=np.float64)
+    v2_sp_lon = np.asarray(v2_sp_lon, dtype=np.float64)
+
+    # Same Direction, v1 = rear, v2 = front
+    same = np.maximum(0, v1_sp_lon * v1_rho
+                         + 0.5 * v1_max_accel_lon * v1_rho ** 2
+                         + ((v1_sp_lon + v1_rho * v1_max_accel_lon) ** 2)/(2 * v1_min_decel_lon)
+                         - ((v2_sp_lon) ** 2)/(2 * v2_max_decel_lon))
+
+    # Opposite Direction, v1 = vut, v2 = challenger
+    opposite = (((2 * v1_sp_lon + v1_rho * v1_max_accel_lon)/2) * v1_rho
+                + ((v1_sp_lon + v1_rho * v1_max_accel_lon) ** 2)/(2 * v1_min_decel_lon)
+                + ((2 * np.abs(v2_sp_lon) + v2_rho * v2_max_accel_lon)/2) * v2_rho
+                + ((np.abs(v2_sp_lon) + v2_rho * v2_max_accel_lon) ** 2)/(2 * v2_min_decel_lon))
+
+    # Intersecting Paths, v2 = challenger
+    intersecting = (v2_sp_lon * v2_rho
+                    + 0.5 * v2_max_accel_lon * (v2_rho ** 2)
+                    + ((v2_sp_lon + v2_rho * v2_max_accel_lon) ** 2)/(2 * v2_min_decel_lon))
+
+    return np.select([case == CASE_SAME, case == CASE_OPPOSITE, case == CASE_INTERSECTING], [same, opposite, intersecting], np.nan)
+
+def calculate_d_lat_min_array(mu, left_sp_lat, left_rho, left_max_accel_lat, left_min_decel_lat, right_sp_lat, right_rho, right_max_accel_lat, right_min_decel_lat):
+    '''
+    Array version of calculate_d_lat_min, every argument broadcasts.
+    '''
+    left_sp_lat = np.asarray(left_sp_lat, dtype=np.float64)
+    right_sp_lat = np.asarray(right_sp_lat, dtype=np.float64)
+
+    first_term = ((2 * left_sp_lat + left_rho * left_max_accel_lat) / 2) * left_rho
+    second_term = ((left_sp_lat + left_rho * left_max_accel_lat) ** 2)/(2 * left_min_decel_lat)
+    third_term = ((2 * right_sp_lat - right_rho * right_max_accel_lat) / 2) * right_rho
+    fourth_term = ((right_sp_lat - right_rho * right_max_accel_lat) ** 2)/(2 * right_min_decel_lat)
+
+    return mu + np.maximum((first_term + second_term - (third_term - fourth_term)), 0)
+
+def _msev_mag_array(case_heading, opposite, v1_d_lon_min, v2_d_lon_min, v1_sp_lon, v2_sp_lon, v2_a_lon_max_decel, n, v1_a_lon_max_decel):
+    d_lon_min_same = np.maximum(v1_d_lon_min, v2_d_lon_min)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mag_int = (v2_sp_lon / (2 * d_lon_min_same))/v1_a_lon_max_decel
+
+        mrd = (v1_sp_lon ** 2) / (2 * d_lon_min_same + ((v2_sp_lon ** 2) / (2 * n * v2_a_lon_max_decel)))
+        mag_cf = mrd/v1_a_lon_max_decel
+
+    mag = np.select([case_heading, opposite], [mag_int, 1.0], mag_cf)
+
+    return np.clip(mag, 0, 1)
+
+def _ci_mag_array(delta_v, vut, challenger):
+    start, end = np.stack([challenger.left_side, challenger.right_side, challenger.rear_bumper, challenger.front_bumper], axis=1)
+    distance_to_l_side, distance_to_r_side, distance_to_rear, distance_to_front = so.segment_distance(*vut.front_bumper, start, end)
+
+    case = np.minimum.reduce([distance_to_l_side, distance_to_r_side, distance_to_rear, distance_to_front])
+
+    return np.select([(case == distance_to_l_side) | (case == distance_to_r_side), case == distance_to_rear],
+                     [0.1548 * np.exp(0.1784 * delta_v), 0.0137 * np.exp(0.1733 * delta_v)],
+                     0.0458 * np.exp(0.165 * delta_v))
+
+def _rising_edges(flags, previous_flag = False):
+    previous = np.concatenate([[previous_flag], flags[:-1]])
+
+    return flags & ~previous
+
+def _sert_array(sei, timestamp, state):
+    '''
+    Safety Envelope Restoration Time, reported on the first frame after each SEI episode ends.
+
+    An episode still open at the end of the frames is carried over in state.
+    '''
+    previous = np.concatenate([[state.sei_previous], sei[:-1]])
+    starts = np.flatnonzero(sei & ~previous)
+    ends = np.flatnonzero(~sei & previous)
+
+    start_times = timestamp[starts]
+    if state.sei_previous:
+        start_times = np.concatenate([[state.sert_start], start_times])
+
+    sert = np.zeros(len(sei))
+    sert[ends] = timestamp[ends] - start_times[:len(ends)]
+
+    if len(sei) > 0:
+        state.sei_previous = bool(sei[-1])
+        state.sert_start = start_times[-1] if state.sei_previous else None
+
+    return sert
+
+def find_responses(sei, vut_acc, pending = False):
+    '''
+    Returns [starts, ends, waiting] of every OEDR response: from a frame with SEI to the first braking frame
+    (VUT acc < 0) at or after it. A new response can only be initiated after the previous one ended, so this loops
+    over responses, not frames.
+
+    With pending, a response initiated before these frames is still waiting for braking, it starts on frame 0.
+    waiting is the start of the response still waiting for braking at the end of the frames, None when there is none.
+    '''
+    sei_frames = np.flatnonzero(np.asarray(sei, dtype=bool))
+    braking_frames = np.flatnonzero(np.asarray(vut_acc, dtype=np.float64) < 0)
+
+    starts = []
+    ends = []
+    frame = 0
+    start = 0 if pending else None
+
+    while True:
+        if start is None:
+            k = np.searchsorted(sei_frames, frame)
+            if k == len(sei_frames):
+                break
+            start = sei_frames[k]
+
+        j = np.searchsorted(braking_frames, start)
+        if j == len(braking_frames):
+            break
+
+        starts.append(start)
+        ends.append(braking_frames[j])
+        frame = braking_frames[j] + 1
+        start = None
+
+    return [np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64), start]
+
+def _ort_array(sei, vut_acc, timestamp, state):
+    '''
+    OEDR Response Time, reported on the first braking frame at or after each response is initiated.
+
+    A response still waiting for braking at the end of the frames is carried over in state.
+    '''
+    carried_start = state.ort_start
+    starts, ends, waiting = find_responses(sei, vut_acc, carried_start is not None)
+
+    start_times = timestamp[starts]
+    if carried_start is not None and len(starts) > 0:
+        start_times[0] = carried_start
+
+    ort = np.zeros(len(sei))
+    ort[ends] = timestamp[ends] - start_times
+
+    # A carried response that saw no braking keeps its start time
+    if waiting is None:
+        state.ort_start = None
+    elif carried_start is None or len(starts) > 0:
+        state.ort_start = timestamp[waiting]
+
+    return ort
+
+# End formula kernels
+
+
+# Begin surrogate safety metrics
+
+def _kdtree_pairs(points, other_points, radius):
+    tree = cKDTree(points)
+    pairs = tree.sparse_distance_matrix(cKDTree(other_points), radius, output_type='ndarray')
+
+    # The tree includes pairs at exactly radius, the legacy loop does not
+    close = pairs['v'] < radius
+
+    return [pairs['i'][close], pairs['j'][close]]
+
+def calculate_pet_array(ego_center_x, ego_center_y, ego_yaw, ego_length, other_center_x, other_center_y, other_yaw, other_length, timestamp, radius = 1.0):
+    '''
+    Post Encroachment Time Curve [s], array version of calculate_pet_curve in old/umich_metrics.py.
+
+    For every frame, the smallest time difference to any frame where the other actor's rear bumper was within
+    radius of the ego front bumper, nan when there is none. Conflict points are found with a KD-tree when scipy
+    is installed and with a uniform grid otherwise, instead of comparing every pair of frames.
+    '''
+    ego_yaw = np.asarray(ego_yaw, dtype=np.float64)
+    other_yaw = np.asarray(other_yaw, dtype=np.float64)
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+
+    ego_front_bumper = np.stack([np.asarray(ego_center_x, dtype=np.float64) + np.cos(ego_yaw) * ego_length/2,
+                                 np.asarray(ego_center_y, dtype=np.float64) + np.sin(ego_yaw) * ego_length/2], axis=-1)
+    other_rear_bumper = np.stack([np.asarray(other_center_x, dtype=np.float64) - np.cos(other_yaw) * other_length/2,
+                                  np.asarray(other_center_y, dtype=np.float64) - np.sin(other_yaw) * other_length/2], axis=-1)
+
+    pet = np.full(len(timestamp), np.inf)
+
+    if len(timestamp) == 0:
+        return pet
+
+    if cKDTree is not None:
+        i, j = _kdtree_pairs(ego_front_bumper, other_rear_bumper, radius)
+    else:
+        i, j = so.grid_pairs(ego_front_bumper, other_rear_bumper, radius)
+
+    np.minimum.at(pet, i, np.abs(timestamp[i] - timestamp[j]))
+    pet[np.isinf(pet)] = np.nan
+
+    return pet
+
+def calculate_ttc_array(delta_pos, delta_vel, ttc_max = 10):
+    '''
+    Time To Collision [s], array version of calculate_ttc. ttc_max where the gap is not closing.
+    '''
+    delta_pos = np.asarray(delta_pos, dtype=np.float64)
+    delta_vel = np.asarray(delta_vel, dtype=np.float64)
+
+    closing = delta_vel > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ttc = np.where(closing, delta_pos / np.where(closing, delta_vel, 1), ttc_max)
+
+    # min(ttc_max, ttc) in the scalar version, nan becomes ttc_max
+    return np.where(ttc < ttc_max, ttc, ttc_max)
+
+def calculate_mttc_array(delta_pos, delta_vel, delta_acc, mttc_max = 10):
+    '''
+    Modified Time To Collision [s], array version of calculate_mttc.
+
+    Solves delta_pos = delta_vel * t + delta_acc * t^2 / 2 and takes the smallest positive root, mttc_max when
+    there is none. Agrees with calculate_mttc within float tolerance, np.sqrt and ** 0.5 can round differently.
+    '''
+    d = np.asarray(delta_pos, dtype=np.float64)
+    v = np.asarray(delta_vel, dtype=np.float64)
+    a = np.asarray(delta_acc, dtype=np.float64)
+    d, v, a = np.broadcast_arrays(d, v, a)
+
+    discriminant = v ** 2 + 2 * a * d
+    accelerating = (a != 0) & (discriminant >= 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Constant closing speed
+        constant = d / np.where(v > 0, v, 1)
+        constant = np.where(mttc_max < constant, mttc_max, constant)
+
+        safe_a = np.where(accelerating, a, 1)
+        root = np.sqrt(np.where(accelerating, discriminant, 0))
+        t_1 = (-v - root) / safe_a
+        t_2 = (-v + root) / safe_a
+
+    roots = np.select([(t_1 > 0) & (t_2 > 0), t_1 > 0, t_2 > 0], [np.minimum(t_1, t_2), t_1, t_2], mttc_max)
+
+    mttc = np.select([(a == 0) & (v > 0), accelerating], [constant, roots], mttc_max)
+
+    return np.where(mttc_max < mttc, mttc_max, mttc)
+
+def calculate_thw_array(distance, speed, thw_max = 10):
+    '''
+    Time Headway [s], array version of calculate_thw.
+    '''
+    distance = np.asarray(distance, dtype=np.float64)
+    speed = np.asarray(speed, dtype=np.float64)
+
+    moving = speed > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        thw = np.where(moving, distance / np.where(moving, speed, 1), thw_max)
+
+    return np.where(thw_max < thw, thw_max, thw)
+
+def calculate_surrogate_columns(columns, distance):
+    '''
+    TTC, MTTC and THW columns for a log, distance being the VUT to challenger gap of every frame.
+    '''
+    vut_sp = np.asarray(columns['VUT sp'], dtype=np.float64)
+    delta_vel = vut_sp - np.asarray(columns['challenger sp'], dtype=np.float64)
+    delta_acc = np.asarray(columns['VUT lon acc'], dtype=np.float64) - np.asarray(columns['challenger lon acc'], dtype=np.float64)
+
+    return {
+        'TTC':  calculate_ttc_array(distance, delta_vel, config.ttc_max),
+        'MTTC': calculate_mttc_array(distance, delta_vel, delta_acc, config.mttc_max),
+        'THW':  calculate_thw_array(distance, vut_sp, config.thw_max),
+    }
+
+# End surrogate safety metrics
+
+
+# Begin batch engine
+
+def resolve_metrics(metrics):
+    '''
+    The columns to compute to produce metrics (names from METRIC_DEPENDENCIES) and the DA score, dependencies
+    included, in output order. Raises ValueError for unknown names.
+    '''
+    unknown = [name for name in metrics if name not in METRIC_DEPENDENCIES]
+    if len(unknown) > 0:
+        raise ValueError('Unknown metrics {}, expected names from {}'.format(unknown, list(METRIC_DEPENDENCIES.keys())))
+
+    needed = set()
+    pending = DA_SCORE_METRICS + list(metrics)
+
+    while len(pending) > 0:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(METRIC_DEPENDENCIES[name])
+
+    return [name for name in METRIC_DEPENDENCIES if name in needed]
+
+class EpisodeState:
+    # State of the episode trackers, carried from one chunk of a log to the next
+    def __init__(self):
+        # SEI and SEV of the last frame scored, sei_happening / sev_happening in the legacy loop
+        self.sei_previous = False
+        self.sev_previous = False
+
+        # Start of the open SEI episode, sert_start in the legacy loop
+        self.sert_start = None
+
+        # Start of the response waiting for the VUT to brake, None when no response is initiated
+        self.ort_start = None
+
+        # Frames scored so far and how many of them were skipped by the early exit or the broad phase
+        self.frames = 0
+        self.skipped_frames = 0
+
+def _prunable_frames(geometry, vut, challenger, vut_rss, challenger_rss):
+    '''
+    Frames that provably cannot infringe the safety envelope, found without the full d_lon / d_lat geometry.
+
+    SEI needs d_lon < d_lon_min. When the paths do not intersect, d_lon and the case only depend on the bumpers,
+    so the side rays and one triangle per frame decide it exactly.
+    '''
+    intersecting = paths_intersecting_array(vut, challenger) & ~facing_front_or_rear_array(vut, challenger)
+    opposite, d_lon = d_lon_aligned_array(vut, challenger, [geometry['front bumper distance'], geometry['rear bumper distance']])
+
+    d_lon_min = calculate_d_lon_min_array(np.where(opposite, CASE_OPPOSITE, CASE_SAME), geometry['VUT sp'], vut_rss.responseTime, vut_rss.alphaLon_accelMax, vut_rss.alphaLon_brakeMin,
+                                          geometry['challenger sp'], challenger_rss.responseTime, challenger_rss.alphaLon_accelMax, challenger_rss.alphaLon_brakeMin, challenger_rss.alphaLon_brakeMax)
+
+    return ~intersecting & ~(d_lon < d_lon_min)
+
+@instrumentation.timed('geometry')
+def _frame_geometry(columns, vut_dimensions, challenger_dimensions, active = None, prune_rss = None):
+    '''
+    Everything the metrics need that does not depend on the RSS parameters, computed once per log.
+
+    active optionally masks the frames that need the full d_lon / d_lat geometry. The other frames get an infinite
+    d_lon, so that they can never infringe the safety envelope, and the same or opposite case of their bumpers.
+    With prune_rss, a [vut_rss, challenger_rss] pair, the frames that cannot infringe the envelope under those
+    parameters are masked out as well. The results do not change, geometry['skipped frames'] counts them.
+    '''
+    # Views of the log columns, nothing is copied when they already are float64
+    vut_trajectory = so.Trajectory.from_columns(columns, 'VUT')
+    challenger_trajectory = so.Trajectory.from_columns(columns, 'challenger')
+
+    geometry = {'timestamp':          vut_trajectory.timestamp,
+                'VUT sp':             vut_trajectory.speed,
+                'challenger sp':      challenger_trajectory.speed,
+                'VUT lon acc':        vut_trajectory.lon_acc,
+                'VUT lat acc':        vut_trajectory.lat_acc,
+                'VUT acc':            vut_trajectory.acc,
+                'challenger lon acc': challenger_trajectory.lon_acc,
+                'challenger lat acc': challenger_trajectory.lat_acc}
+
+    vut = vut_trajectory.box(vut_dimensions)
+    challenger = challenger_trajectory.box(challenger_dimensions)
+
+    geometry['vut'] = vut
+    geometry['challenger'] = challenger
+    geometry['front bumper distance'], geometry['rear bumper distance'] = bumper_distances_array(vut, challenger)
+
+    if prune_rss is not None:
+        prunable = _prunable_frames(geometry, vut, challenger, *prune_rss)
+        active = ~prunable if active is None else np.asarray(active, dtype=bool) & ~prunable
+
+    geometry['skipped frames'] = 0 if active is None else int(np.count_nonzero(~np.asarray(active, dtype=bool)))
+
+    if active is None or np.all(active):
+        active_vut, active_challenger = vut, challenger
+    else:
+        active = np.asarray(active, dtype=bool)
+        active_vut, active_challenger = vut.select(active), challenger.select(active)
+
+    # Geometry from both perspectives, the challenger perspective only needs the case for its d_lon_min
+    vut_case, vut_d_lon = d_lon_array(active_vut, active_challenger)
+    vut_side, vut_d_lat = d_lat_array(active_vut, active_challenger)
+    challenger_case = classify_case_array(active_challenger, active_vut)
+
+    if active_vut is vut:
+        geometry['vut case'], geometry['vut d_lon'] = vut_case, vut_d_lon
+        geometry['vut side'], geometry['vut d_lat'] = vut_side, vut_d_lat
+        geometry['challenger case'] = challenger_case
+    else:
+        frames = len(vut)
+        opposite = geometry['front bumper distance'] < geometry['rear bumper distance']
+
+        geometry['vut case'] = np.where(opposite, CASE_OPPOSITE, CASE_SAME)
+        geometry['vut d_lon'] = np.full(frames, np.inf)
+        geometry['vut side'] = np.full(frames, SIDE_NONE)
+        geometry['vut d_lat'] = np.zeros(frames)
+        geometry['challenger case'] = np.full(frames, CASE_SAME)
+
+        for name, value in [('vut case', vut_case), ('vut d_lon', vut_d_lon), ('vut side', vut_side),
+                            ('vut d_lat', vut_d_lat), ('challenger case', challenger_case)]:
+            geometry[name][active] = value
+
+    left = geometry['vut side'] == SIDE_LEFT
+    geometry['left lat sp'] = np.where(left, vut_trajectory.lat_speed, challenger_trajectory.lat_speed)
+    geometry['right lat sp'] = np.where(left, challenger_trajectory.lat_speed, vut_trajectory.lat_speed)
+
+    vut_heading = np.degrees(vut_trajectory.heading)
+    challenger_heading = np.degrees(challenger_trajectory.heading)
+    geometry['vut heading offset'] = np.minimum(vut_heading, 360 - vut_heading)
+    geometry['challenger heading offset'] = np.minimum(challenger_heading, 360 - challenger_heading)
+
+    return geometry
+
+def _envelope_columns(geometry, vut_rss, challenger_rss):
+    '''
+    The safety envelope block of _score_frames with the NumPy formulas. Returns [vut_d_lon_min, vut_d_lat_min,
+    lon_violation, lat_violation, sei, sev, sevm], broadcast against stacked RSS parameters.
+    '''
+    vut_sp = geometry['VUT sp']
+    challenger_sp = geometry['challenger sp']
+    vut_case = geometry['vut case']
+
+    # Safety Envelope Infringement
+    with instrumentation.timer('sei'):
+        vut_d_lon_min = calculate_d_lon_min_array(vut_case, vut_sp, vut_rss.responseTime, vut_rss.alphaLon_accelMax, vut_rss.alphaLon_brakeMin,
+                                                  challenger_sp, challenger_rss.responseTime, challenger_rss.alphaLon_accelMax, challenger_rss.alphaLon_brakeMin, challenger_rss.alphaLon_brakeMax)
+        vut_d_lat_min = calculate_d_lat_min_array(config.mu, geometry['left lat sp'], vut_rss.responseTime, vut_rss.alphaLat_accelMax, vut_rss.alphaLat_accelMin,
+                                                  geometry['right lat sp'], challenger_rss.responseTime, challenger_rss.alphaLat_accelMax, challenger_rss.alphaLat_accelMin)
+        challenger_d_lon_min = calculate_d_lon_min_array(geometry['challenger case'], challenger_sp, challenger_rss.responseTime, challenger_rss.alphaLon_accelMax, challenger_rss.alphaLon_brakeMin,
+                                                         vut_sp, vut_rss.responseTime, vut_rss.alphaLon_accelMax, vut_rss.alphaLon_brakeMin, vut_rss.alphaLon_brakeMax)
+
+        lon_violation = geometry['vut d_lon'] < vut_d_lon_min
+        lat_violation = geometry['vut d_lat'] < vut_d_lat_min
+        sei = lon_violation & ((vut_case == CASE_INTERSECTING) | lat_violation)
+
+        # Safety Envelope Violation
+        sev = (lon_violation & lat_violation
+               & (geometry['challenger lon acc'] <= challenger_rss.alphaLon_brakeMax)
+               & (np.abs(geometry['challenger lat acc']) <= np.abs(challenger_rss.alphaLat_accelMax)))
+
+    # Safety Envelope Violation Magnitude
+    with instrumentation.timer('sevm'):
+        vut_heading_offset = geometry['vut heading offset']
+        challenger_heading_offset = geometry['challenger heading offset']
+
+        sevm = _msev_mag_array(np.abs(vut_heading_offset - challenger_heading_offset) > 5,
+                               ((vut_heading_offset - challenger_heading_offset) >= 0) & (geometry['front bumper distance'] < geometry['rear bumper distance']),
+                               vut_d_lon_min, challenger_d_lon_min, vut_sp, challenger_sp,
+                               vut_rss.alphaLon_accelMax, config.sevm_n, vut_rss.alphaLon_accelMax)
+        sevm = np.where(sei, sevm, 0.0)
+
+    return [vut_d_lon_min, vut_d_lat_min, lon_violation, lat_violation, sei, sev, sevm]
+
+def _envelope_columns_jit(geometry, vut_rss, challenger_rss):
+    # _envelope_columns with the fused kernel of jit_kernels, scalar RSS parameters only
+    def column(name, dtype = np.float64):
+        return np.ascontiguousarray(geometry[name], dtype=dtype)
+
+    frames = len(geometry['timestamp'])
+    vut_d_lon_min, vut_d_lat_min, challenger_d_lon_min, sevm = [np.empty(frames) for _ in range(4)]
+    lon_violation, lat_violation, sei, sev = [np.empty(frames, dtype=bool) for _ in range(4)]
+
+    # The kernel fuses SEI, SEV and SEVM, they are timed together as the sei stage
+    with instrumentation.timer('sei'):
+        jit_kernels.envelope_kernel(column('vut case', np.int64), column('challenger case', np.int64), column('VUT sp'), column('challenger sp'),
+                                    column('left lat sp'), column('right lat sp'), column('vut d_lon'), column('vut d_lat'),
+                                    column('challenger lon acc'), column('challenger lat acc'), column('vut heading offset'), column('challenger heading offset'),
+                                    column('front bumper distance'), column('rear bumper distance'), jit_kernels.rss_vector(vut_rss), jit_kernels.rss_vector(challenger_rss),
+                                    float(config.mu), float(config.sevm_n),
+                                    vut_d_lon_min, vut_d_lat_min, challenger_d_lon_min, lon_violation, lat_violation, sei, sev, sevm)
+
+    return [vut_d_lon_min, vut_d_lat_min, lon_violation, lat_violation, sei, sev, sevm]
+
+def _use_jit(vut_rss, challenger_rss):
+    '''
+    True when config.formula_backend is 'numba' and the fused kernel applies: numba is installed and the RSS
+    parameters are scalars, parameter sweeps stack them (stack_rss_parameters) and use the NumPy formulas.
+    '''
+    global _jit_warning_shown
+
+    if config.formula_backend != 'numba':
+        return False
+
+    if not jit_kernels.JIT_AVAILABLE:
+        if not _jit_warning_shown:
+            instrumentation.logger.warning('numba is not installed, the NumPy formulas are used instead')
+            _jit_warning_shown = True
+        return False
+
+    return all(np.ndim(getattr(rss, name)) == 0 for rss in [vut_rss, challenger_rss] for name in RSS_PARAMETER_NAMES)
+
+def _score_frames(geometry, ci_occurs, vut_rss, challenger_rss, states, metrics = None):
+    '''
+    Per-frame metric columns from precomputed geometry. metrics lists the columns to compute, as resolved by
+    resolve_metrics, the DA score metrics are computed either way. None computes the columns of config.metrics.
+
+    With scalar RSS parameters every column has shape (frames,). With the parameters stacked by stack_rss_parameters
+    the parameter dependent columns have shape (parameter sets, frames) and states holds one EpisodeState per set.
+    '''
+    if metrics is None:
+        metrics = resolve_metrics(config.metrics)
+
+    timestamp = geometry['timestamp']
+    frames = len(timestamp)
+
+    vut_sp = geometry['VUT sp']
+    challenger_sp = geometry['challenger sp']
+    vut_lon_acc = geometry['VUT lon acc']
+    vut_lat_acc = geometry['VUT lat acc']
+
+    # Safety Envelope Infringement, Violation and Violation Magnitude
+    if _use_jit(vut_rss, challenger_rss):
+        vut_d_lon_min, vut_d_lat_min, lon_violation, lat_violation, sei, sev, sevm = _envelope_columns_jit(geometry, vut_rss, challenger_rss)
+    else:
+        vut_d_lon_min, vut_d_lat_min, lon_violation, lat_violation, sei, sev, sevm = _envelope_columns(geometry, vut_rss, challenger_rss)
+
+    # The episode trackers run once per parameter set
+    with instrumentation.timer('episodes'):
+        sei_rows = np.atleast_2d(sei)
+
+        # Safety Envelope Restoration Time Violation
+        sert = np.stack([_sert_array(row, timestamp, state) for row, state in zip(sei_rows, states)]).reshape(sei.shape)
+        sertv = sert > config.sert_limit
+        sertvm = np.clip((sert - config.sert_limit)/2, 0, 1)
+
+        # OEDR Response Time Violation
+        ort = np.stack([_ort_array(row, geometry['VUT acc'], timestamp, state) for row, state in zip(sei_rows, states)]).reshape(sei.shape)
+        ortv = ort > config.ort_limit
+        ortvm = np.clip((ort - config.ort_limit)/3, 0, 1)
+
+    # Collision Incident
+    with instrumentation.timer('cim'):
+        ci = np.zeros(frames, dtype=bool)
+        if ci_occurs and frames > 0:
+            ci[-1] = True
+
+        cim = np.where(ci, _ci_mag_array(vut_sp - challenger_sp, geometry['vut'], geometry['challenger']), 0.0)
+
+    # Emergency Maneuver Incident
+    emi = ((vut_lon_acc > config.emi_lon_acc_limit) | (vut_lat_acc > config.emi_lat_acc_limit)) & sei
+    emim = emi.astype(np.float64)
+
+    if frames > 0:
+        for row, state in zip(np.atleast_2d(sev), states):
+            state.sev_previous = bool(row[-1])
+
+    metric_columns = {
+        'SEI':      sei.astype(int),
+        'SEV':      sev.astype(int),
+        'SEVM':     sevm,
+        'SERTV':    sertv.astype(int),
+        'SERTVM':   sertvm,
+        'EMI':      emi.astype(int),
+        'EMIM':     emim,
+        'CI':       ci.astype(int),
+        'CIM':      cim,
+        'ORTV':     ortv.astype(int),
+        'ORTVM':    ortvm,
+    }
+
+    # Visualization and debug columns, only computed when asked for
+    if 'DA Score' in metrics:
+        metric_columns['DA Score'] = np.maximum(1 - (sei * sevm + ci * cim + ortv * ortvm + emi * emim + sertv * sertvm), 0) * 100
+    if 'VUT Accel' in metrics:
+        metric_columns['VUT Accel'] = vut_lon_acc
+    if 'VUT Speed' in metrics:
+        metric_columns['VUT Speed'] = vut_sp
+    if 'Distance to SO' in metrics:
+        metric_columns['Distance to SO'] = geometry['vut'].distance_to_box(geometry['challenger'])
+    if 'Safety Envelope Distance' in metrics:
+        metric_columns['Safety Envelope Distance'] = vut_d_lon_min
+
+    if 'SEI LON' in metrics:
+        metric_columns['SEI LON'] = lon_violation.astype(int)
+    if 'SEI LAT' in metrics:
+        metric_columns['SEI LAT'] = lat_violation.astype(int)
+
+    # Safety Envelope Ratios, infinite when the minimum distance is not positive
+    if any(name in metrics for name in ['SER LON', 'SER LAT', 'SER']):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ser_lon = np.where(vut_d_lon_min > 0, geometry['vut d_lon'] / vut_d_lon_min, np.inf)
+            ser_lat = np.where(vut_d_lat_min > 0, geometry['vut d_lat'] / vut_d_lat_min, np.inf)
+            ser = np.where((vut_d_lon_min > 0) & (vut_d_lat_min > 0), np.sqrt(ser_lon ** 2 + ser_lat ** 2), np.inf)
+
+        for name, ratio in [['SER LON', ser_lon], ['SER LAT', ser_lat], ['SER', ser]]:
+            metric_columns[name] = ratio
+            # Safety Envelope Ratio Violation
+            metric_columns[name.replace('SER', 'SERV')] = (~((ratio > config.ser_min) & (ratio < config.ser_max))).astype(int)
+
+    return {name: metric_columns[name] for name in metrics if name in metric_columns}
+
+def calculate_metrics_batch(columns, ci_occurs = 0, vut_rss = config.rss_average, challenger_rss = config.rss_pedestrian,
+                            vut_dimensions = config.vut_dimensions, challenger_dimensions = config.challenger_dimensions, state = None,
+                            metrics = config.metrics, active = None, prune = config.prune_frames):
+    '''
+    Batch engine, computes every per-frame metric column of a log in one pass.
+
+    columns is anything indexable by the log column names (a DataFrame or a dict of arrays), headings in radians.
+    Matches the legacy row loop in old/mm_da_score_calculation_ped.py to within config.batch_engine_tolerance.
+
+    To score a log in consecutive chunks, pass the same EpisodeState to every call and combine the
+    returned dicts with merge_da_score. metrics names the per-frame columns to produce, see resolve_metrics.
+    Frames masked out by active are not checked for safety envelope infringements, see _frame_geometry. With prune,
+    frames that cannot infringe the envelope skip most of the geometry, state counts them in skipped_frames.
+
+    Returns [metric_columns, da_score_dict, overall_da_score].
+    '''
+    if state is None:
+        state = EpisodeState()
+
+    sei_previous = state.sei_previous
+    sev_previous = state.sev_previous
+
+    needed = resolve_metrics(metrics)
+
+    geometry = _frame_geometry(columns, vut_dimensions, challenger_dimensions, active, [vut_rss, challenger_rss] if prune else None)
+    metric_columns = _score_frames(geometry, ci_occurs, vut_rss, challenger_rss, [state], needed)
+
+    state.frames += len(geometry['timestamp'])
+    state.skipped_frames += geometry['skipped frames']
+
+    instrumentation.logger.debug('Scored %d frames, %d skipped by the early exit', len(geometry['timestamp']), geometry['skipped frames'])
+
+    if any(name in needed for name in SURROGATE_METRICS):
+        metric_columns.update(calculate_surrogate_columns(columns, metric_columns['Distance to SO']))
+
+    # Columns only computed for another one are not returned
+    metric_columns = {name: metric_columns[name] for name in needed if name in metric_columns and (name in DA_SCORE_METRICS or name in metrics)}
+
+    da_score_dict = summarize_da_score(metric_columns, sei_previous, sev_previous)
+
+    return [metric_columns, da_score_dict, calculate_overall_da_score(da_score_dict)]
+
+def summarize_da_score(metric_columns, sei_previous = False, sev_previous = False):
+    '''
+    Reduces per-frame metric columns to the legacy da_score_dict of maxima and counts.
+
+    sei_previous and sev_previous are the flags of the frame before the first one, so that an episode
+    continuing from an earlier chunk is not counted twice.
+    '''
+    def maximum(name):
+        values = np.nan_to_num(np.asarray(metric_columns[name], dtype=np.float64), nan=0.0)
+        return max(float(np.max(values)), 0) if len(values) > 0 else 0
+
+    da_score_dict = {
+        'Scenario Number': 0,
+        'DA Score': 0.0,
+        'SEI':      0,
+        'SEVM':     maximum('SEVM'),
+        'SEIC':     int(np.count_nonzero(_rising_edges(np.asarray(metric_columns['SEI'], dtype=bool), sei_previous))),
+        'SEVC':     int(np.count_nonzero(_rising_edges(np.asarray(metric_columns['SEV'], dtype=bool), sev_previous))),
+        'SERTV':    0,
+        'SERTVM':   maximum('SERTVM'),
+        'SERTVC':   int(np.count_nonzero(metric_columns['SERTV'])),
+        'EMI':      0,
+        'EMIM':     maximum('EMIM'),
+        'EMIC':     int(np.count_nonzero(metric_columns['EMI'])),
+        'CI':       0,
+        'CIM':      maximum('CIM'),
+        'ORTV':     0,
+        'ORTVM':    maximum('ORTVM'),
+        'ORTVC':    int(np.count_nonzero(metric_columns['ORTV'])),
+    }
+
+    # A magnitude is only ever non-zero on frames where its incident flag is set
+    for flag, magnitude in [('SEI', 'SEVM'), ('SERTV', 'SERTVM'), ('EMI', 'EMIM'), ('CI', 'CIM'), ('ORTV', 'ORTVM')]:
+        if da_score_dict[magnitude] > 0:
+            da_score_dict[flag] = 1
+
+    return da_score_dict
+
+def merge_da_score(da_score_dict, chunk_da_score_dict):
+    '''
+    Combines the da_score_dict of a new chunk into the running da_score_dict of the log.
+    '''
+    merged = dict(da_score_dict)
+
+    for key in DA_SCORE_MAXIMA:
+        merged[key] = max(da_score_dict[key], chunk_da_score_dict[key])
+    for key in DA_SCORE_COUNTS:
+        merged[key] = da_score_dict[key] + chunk_da_score_dict[key]
+
+    return merged
+
+def calculate_overall_da_score(da_score_dict):
+    overall_da_score = (max(1 - sum([da_score_dict['SEI'] * da_score_dict['SEVM'],
+                                     da_score_dict['CI'] * da_score_dict['CIM'],
+                                     da_score_dict['ORTV'] * da_score_dict['ORTVM'],
+                                     da_score_dict['EMI'] * da_score_dict['EMIM'],
+                                     da_score_dict['SERTV'] * da_score_dict['SERTVM']]), 0.0)) * 100
+
+    # Always a float, so that the DA Score column has one type whichever log comes first
+    if da_score_dict['CI'] == 1:
+        overall_da_score = 0.0
+
+    return overall_da_score
+
+# End batch engine
+
+
+# Begin triage
+
+def _far_frames(vut_trajectory, challenger_trajectory, vut_dimensions, challenger_dimensions, vut_rss, challenger_rss):
+    '''
+    Frames far enough apart that they cannot infringe the safety envelope, from closed forms in the VUT frame
+    rather than the boxes. Conservative: a frame only counts as far when the challenger's side rays stay clear of the
+    VUT's side rays (so the paths do not intersect) and a lower bound on the bumper-to-bumper d_lon exceeds
+    d_lon_min in both the same and the opposite direction case.
+    '''
+    half_length, half_width = vut_dimensions[0]/2, vut_dimensions[1]/2
+    challenger_half_length, challenger_half_width = challenger_dimensions[0]/2, challenger_dimensions[1]/2
+
+    # Challenger center and heading in the VUT frame, VUT center at the origin heading along x
+    cos_heading, sin_heading = np.cos(vut_trajectory.heading), np.sin(vut_trajectory.heading)
+    dx = challenger_trajectory.x - vut_trajectory.x
+    dy = challenger_trajectory.y - vut_trajectory.y
+    x = dx * cos_heading + dy * sin_heading
+    y = dy * cos_heading - dx * sin_heading
+    heading = challenger_trajectory.heading - vut_trajectory.heading
+    ux, uy = np.cos(heading), np.sin(heading)
+
+    # The challenger's side rays lie in a circle around the middle of their span
+    ray_length = challenger_dimensions[0] * so.SIDE_RAY_MULTIPLIER
+    offset = (ray_length - challenger_half_length)/2
+    radius = np.hypot((ray_length + challenger_half_length)/2, challenger_half_width)
+    mx, my = x + ux * offset, y + uy * offset
+
+    # The VUT's side rays run along y = +-half_width, from the rear bumper to SIDE_RAY_MULTIPLIER lengths ahead
+    gap_x = mx - np.clip(mx, -half_length, vut_dimensions[0] * so.SIDE_RAY_MULTIPLIER)
+    clear = ((np.hypot(gap_x, my - half_width) > radius + TRIAGE_MARGIN)
+             & (np.hypot(gap_x, my + half_width) > radius + TRIAGE_MARGIN))
+
+    # d_lon = sqrt(c^2 - a^2) with c >= (distance from the bumper point to the VUT front bumper) - half the
+    # challenger's width and a the distance from the bumper point to the heading ray, for either bumper
+    d_lon_squared = np.inf
+    for sign in [1, -1]:
+        px, py = x + sign * ux * challenger_half_length, y + sign * uy * challenger_half_length
+        c = np.maximum(np.hypot(px - half_length, np.maximum(np.abs(py) - half_width, 0)) - challenger_half_width, 0)
+        a = np.hypot(px - np.clip(px, 0, so.HEADING_RAY_LENGTH), py)
+        d_lon_squared = np.minimum(d_lon_squared, c ** 2 - a ** 2)
+
+    d_lon = np.sqrt(np.maximum(d_lon_squared, 0))
+
+    d_lon_min = np.maximum.reduce([calculate_d_lon_min_array(case, vut_trajectory.speed, vut_rss.responseTime, vut_rss.alphaLon_accelMax, vut_rss.alphaLon_brakeMin,
+                                                             challenger_trajectory.speed, challenger_rss.responseTime, challenger_rss.alphaLon_accelMax,
+                                                             challenger_rss.alphaLon_brakeMin, challenger_rss.alphaLon_brakeMax)
+                                   for case in [CASE_SAME, CASE_OPPOSITE]])
+
+    return clear & (d_lon > d_lon_min + TRIAGE_MARGIN)
+
+def screen_frames(columns, vut_rss = config.rss_average, challenger_rss = config.rss_pedestrian,
+                  vut_dimensions = config.vut_dimensions, challenger_dimensions = config.challenger_dimensions):
+    '''
+    Screening pass of the triage: True on the frames that may infringe the safety envelope, every other frame
+    provably has SEI, SEV and their lon violation unset.
+
+    Frames ruled out by the closed form bound of _far_frames cost a few array operations. Only the others get their
+    boxes, bumper distances and the early exit test of _prunable_frames.
+    '''
+    vut_trajectory = so.Trajectory.from_columns(columns, 'VUT')
+    challenger_trajectory = so.Trajectory.from_columns(columns, 'challenger')
+
+    near = ~_far_frames(vut_trajectory, challenger_trajectory, vut_dimensions, challenger_dimensions, vut_rss, challenger_rss)
+    vut_trajectory, challenger_trajectory = vut_trajectory.select(near), challenger_trajectory.select(near)
+
+    vut = vut_trajectory.box(vut_dimensions)
+    challenger = challenger_trajectory.box(challenger_dimensions)
+
+    geometry = {'VUT sp': vut_trajectory.speed, 'challenger sp': challenger_trajectory.speed}
+    geometry['front bumper distance'], geometry['rear bumper distance'] = bumper_distances_array(vut, challenger)
+
+    hot = np.zeros(len(near), dtype=bool)
+    hot[near] = ~_prunable_frames(geometry, vut, challenger, vut_rss, challenger_rss)
+
+    return hot
+
+def triage_windows(hot, padding = config.triage_padding, merge_gap = config.triage_merge_gap):
+    '''
+    [start, end) frame ranges covering every hot frame and padding frames either side of it, ranges less than
+    merge_gap frames apart are merged. padding is at least 1, so every range ends on a frame that is not hot or at
+    the end of the log.
+    '''
+    hot_frames = np.flatnonzero(hot)
+    padding = max(int(padding), 1)
+
+    if len(hot_frames) == 0:
+        return []
+
+    starts = np.maximum(hot_frames - padding, 0)
+    ends = np.maximum.accumulate(np.minimum(hot_frames + padding + 1, len(hot)))
+
+    # A new window starts wherever the previous ranges end merge_gap frames or more before this one starts
+    new = np.concatenate([[True], starts[1:] >= ends[:-1] + merge_gap])
+    last = np.concatenate([new[1:], [True]])
+
+    return [[int(start), int(end)] for start, end in zip(starts[new], ends[last])]
+
+def calculate_da_score_triage(columns, ci_occurs = 0, vut_rss = config.rss_average, challenger_rss = config.rss_pedestrian,
+                              vut_dimensions = config.vut_dimensions, challenger_dimensions = config.challenger_dimensions,
+                              padding = config.triage_padding, merge_gap = config.triage_merge_gap, state = None):
+    '''
+    Two-tier scoring of a log's DA score. screen_frames marks the frames that may infringe the safety envelope,
+    only the triage_windows around them are scored by calculate_metrics_batch, in order and with one EpisodeState.
+
+    The frames between windows have no SEI, so they add nothing to the DA score except the end of an OEDR response
+    started in a window: its first braking frame is scored on its own. CI is reported on the last frame, which is
+    always scored when ci_occurs. The result equals calculate_metrics_batch on the whole log, no per-frame columns
+    are produced.
+
+    Returns [da_score_dict, overall_da_score, windows].
+    '''
+    if state is None:
+        state = EpisodeState()
+
+    # Arrays of the log columns, so that every window is a slice of them
+    log_columns = {name: np.asarray(columns[name]) for name in columns}
+    frames = len(log_columns['timestamp'])
+
+    with instrumentation.timer('screen'):
+        hot = screen_frames(log_columns, vut_rss, challenger_rss, vut_dimensions, challenger_dimensions)
+        windows = triage_windows(hot, padding, merge_gap)
+
+    if ci_occurs and frames > 0 and (len(windows) == 0 or windows[-1][1] < frames):
+        windows.append([frames - 1, frames])
+
+    braking_frames = np.flatnonzero(log_columns['VUT acc'] < 0)
+    da_score_dict = None
+    scored_frames = 0
+
+    def score(start, end):
+        nonlocal da_score_dict, scored_frames
+
+        window_columns = {name: values[start:end] for name, values in log_columns.items()}
+        _, window_da_score_dict, _ = calculate_metrics_batch(window_columns, ci_occurs and end == frames, vut_rss, challenger_rss,
+                                                             vut_dimensions, challenger_dimensions, state, [], hot[start:end], False)
+
+        if da_score_dict is None:
+            da_score_dict = window_da_score_dict
+        else:
+            da_score_dict = merge_da_score(da_score_dict, window_da_score_dict)
+        scored_frames += end - start
+
+    def score_response(previous_end, next_start):
+        # An OEDR response still waiting for braking ends on the first braking frame of the gap, if there is one
+        if state.ort_start is None:
+            return
+
+        k = np.searchsorted(braking_frames, previous_end)
+        if k < len(braking_frames) and braking_frames[k] < next_start:
+            score(braking_frames[k], braking_frames[k] + 1)
+
+    previous_end = 0
+    for start, end in windows:
+        score_response(previous_end, start)
+        score(start, end)
+        previous_end = end
+
+    score_response(previous_end, frames)
+
+    # Nothing to score, the DA score of frames without any incident
+    if da_score_dict is None:
+        da_score_dict = summarize_da_score({name: np.zeros(min(frames, 1)) for name in DA_SCORE_METRICS})
+
+    # Frames outside the windows count as skipped, like the frames the early exit skips inside them
+    state.frames += frames - scored_frames
+    state.skipped_frames += frames - scored_frames
+
+    instrumentation.logger.debug('Triage scored %d of %d frames in %d windows', scored_frames, frames, len(windows))
+
+    return [da_score_dict, calculate_overall_da_score(da_score_dict), windows]
+
+# End triage
+
+
+# Begin RSS parameter sweep
+
+RSS_PARAMETER_NAMES = ['alphaLon_accelMax', 'alphaLon_brakeMax', 'alphaLon_brakeMin', 'responseTime', 'alphaLat_accelMin', 'alphaLat_accelMax']
+
+def rss_parameter_grid(base, values):
+    '''
+    Every combination of values, a dict of RssParameters attribute name -> list of values.
+
+    Attributes not in values keep the value they have in base.
+    '''
+    names = list(values.keys())
+    grid = []
+
+    for combination in itertools.product(*[values[name] for name in names]):
+        parameters = copy.copy(base)
+        for name, value in zip(names, combination):
+            setattr(parameters, name, value)
+        grid.append(parameters)
+
+    return grid
+
+def rss_sweep_grid(vut_values, challenger_values, vut_rss = config.rss_average, challenger_rss = config.rss_pedestrian):
+    '''
+    Returns the [vut_rss, challenger_rss] pairs for every combination of the VUT and challenger values.
+    '''
+    return [[vut, challenger] for vut in rss_parameter_grid(vut_rss, vut_values)
+                              for challenger in rss_parameter_grid(challenger_rss, challenger_values)]
+
+def stack_rss_parameters(rss_list):
+    # One RssParameters whose attributes are (parameter sets, 1) columns, these broadcast against (frames,)
+    return config.RssParameters(**{name: np.array([getattr(rss, name) for rss in rss_list], dtype=np.float64)[:, None]
+                                   for name in RSS_PARAMETER_NAMES})
+
+def calculate_metrics_sweep(columns, parameter_sets, ci_occurs = 0, vut_dimensions = config.vut_dimensions,
+                            challenger_dimensions = config.challenger_dimensions, block_size = config.sweep_block_size):
+    '''
+    Scores one log for every [vut_rss, challenger_rss] pair in parameter_sets.
+
+    The geometry (d_lon, d_lat, case and side) is computed once, only the RSS arithmetic and the episode trackers
+    run per parameter set, broadcast over (parameter sets, frames) in blocks of block_size sets.
+    Each result equals calculate_metrics_batch with that pair.
+
+    Returns a list of [da_score_dict, overall_da_score], one per parameter set in order.
+    '''
+    geometry = _frame_geometry(columns, vut_dimensions, challenger_dimensions)
+    results = []
+
+    for block_start in range(0, len(parameter_sets), block_size):
+        block = parameter_sets[block_start:block_start + block_size]
+        states = [EpisodeState() for _ in block]
+
+        metric_columns = _score_frames(geometry, ci_occurs, stack_rss_parameters([pair[0] for pair in block]),
+                                       stack_rss_parameters([pair[1] for pair in block]), states, resolve_metrics([]))
+
+        for i in range(len(block)):
+            set_columns = {key: value[i] if np.ndim(value) == 2 else value for key, value in metric_columns.items()}
+            da_score_dict = summarize_da_score(set_columns)
+            results.append([da_score_dict, calculate_overall_da_score(da_score_dict)])
+
+    return results
+
+# End RSS parameter sweep
+
+
+# Begin online scorer
+
+class DAScorer:
+    # Scores a run frame by frame while it is still executing, frames being dicts keyed by the log column names.
+    # Every push does a constant amount of work, the episode trackers and da_score_dict maxima are updated in place.
+    def __init__(self, vut_rss = config.rss_average, challenger_rss = config.rss_pedestrian,
+                 vut_dimensions = config.vut_dimensions, challenger_dimensions = config.challenger_dimensions, latency_window = 10000):
+        self.vut_rss = vut_rss
+        self.challenger_rss = challenger_rss
+        self.vut_dimensions = vut_dimensions
+        self.challenger_dimensions = challenger_dimensions
+
+        self.state = EpisodeState()
+        self.da_score_dict = None
+        self.frame_da_score = 100
+        self.frames = 0
+
+        # Kept so that a collision row can mark CI on the frame before it
+        self._last_frame = None
+        self._state_before_last_frame = None
+
+        # Latency of the most recent pushes in microseconds
+        self.latencies_us = deque(maxlen=latency_window)
+
+    def push(self, frame):
+        '''
+        Scores one frame and returns its DA score.
+
+        A frame with timestamp == 0 after the first one is the collision row: it is not scored itself, CI and CIM
+        are reported on the previous frame as in the batch engine.
+        '''
+        start_time = time.perf_counter()
+
+        if frame['timestamp'] == 0 and self._last_frame is not None:
+            self._mark_collision()
+        else:
+            columns = {key: [value] for key, value in frame.items()}
+            state_before = copy.copy(self.state)
+
+            metric_columns, frame_da_score_dict, _ = calculate_metrics_batch(columns, 0, self.vut_rss, self.challenger_rss,
+                                                                             self.vut_dimensions, self.challenger_dimensions, self.state,
+                                                                             ['DA Score'])
+
+            self._merge(frame_da_score_dict)
+            self.frame_da_score = float(metric_columns['DA Score'][0])
+            self._last_frame = columns
+            self._state_before_last_frame = state_before
+            self.frames += 1
+
+        self.latencies_us.append((time.perf_counter() - start_time) * 1e6)
+
+        return self.frame_da_score
+
+    def _merge(self, frame_da_score_dict):
+        if self.da_score_dict is None:
+            self.da_score_dict = frame_da_score_dict
+        else:
+            self.da_score_dict = merge_da_score(self.da_score_dict, frame_da_score_dict)
+
+    def _mark_collision(self):
+        # Re-score the last frame as the collision frame, only CI and CIM change
+        state = copy.copy(self._state_before_last_frame)
+
+        metric_columns, frame_da_score_dict, _ = calculate_metrics_batch(self._last_frame, 1, self.vut_rss, self.challenger_rss,
+                                                                         self.vut_dimensions, self.challenger_dimensions, state,
+                                                                         ['DA Score'])
+
+        self.da_score_dict['CI'] = max(self.da_score_dict['CI'], frame_da_score_dict['CI'])
+        self.da_score_dict['CIM'] = max(self.da_score_dict['CIM'], frame_da_score_dict['CIM'])
+        self.frame_da_score = float(metric_columns['DA Score'][0])
+
+    @property
+    def overall_da_score(self):
+        if self.da_score_dict is None:
+            return 100
+
+        return calculate_overall_da_score(self.da_score_dict)
+
+    def latency_stats(self):
+        '''
+        Mean, median, 99th percentile and max latency in microseconds over the recent pushes.
+        '''
+        if len(self.latencies_us) == 0:
+            return {}
+
+        latencies = np.asarray(self.latencies_us)
+
+        return {'count': len(latencies),
+                'mean': float(latencies.mean()),
+                'p50': float(np.percentile(latencies, 50)),
+                'p99': float(np.percentile(latencies, 99)),
+                'max': float(latencies.max())}
+
+# End online scorer
@@ -0,0 +1,195 @@
+# This script will serve to score logs with any number of road users per frame. Every ego actor is scored against
+# every other actor with the single pair batch engine, after a broad phase has removed the pairs that are too far
+# apart to interact.
+
+# -- Begin imports
+
+import numpy as np
+import pandas as pd
+
+import config
+import metrics_formulas as mf
+import object as so
+import resampling
+
+# -- End imports
+
+
+# -- Begin global variables
+
+# Per actor columns of a multi-actor log, which has one row per actor and frame plus 'timestamp' and 'actor'.
+# Optional 'length' and 'width' columns override config.vut_dimensions / config.challenger_dimensions.
+ACTOR_COLUMNS = list(so.TRAJECTORY_FIELDS.values())
+
+# End global variables
+
+
+# Begin helper methods
+
+def is_multi_actor(data_df):
+    return 'actor' in data_df.columns
+
+def split_collision_rows(actors_df):
+    '''
+    Returns [actors_df, collided], the log without its collision rows and the actors that had one.
+
+    A collision is marked the way process_log expects it in single pair logs, by a row with timestamp == 0 after
+    an actor's last frame. A pair collided when both of its actors have a collision row. A single collision row
+    is rejected, the actor it collided with is unknown.
+    '''
+    last_rows = actors_df.groupby('actor', sort=False).tail(1)
+    collision_rows = last_rows[last_rows['timestamp'] == 0]
+    collided = list(collision_rows['actor'])
+
+    if len(collided) == 1:
+        raise ValueError('Only actor {} has a collision row, a collision needs one for each actor involved'.format(collided[0]))
+
+    return [actors_df.drop(index=collision_rows.index), collided]
+
+def actor_dimensions(track_df, default):
+    if 'length' in track_df.columns and 'width' in track_df.columns:
+        return [float(track_df['length'].iloc[0]), float(track_df['width'].iloc[0])]
+
+    return default
+
+def interaction_distance(actors_df, vut_rss = config.rss_average, challenger_rss = config.rss_pedestrian):
+    '''
+    Broad phase cull distance of a log: the largest d_lon_min or d_lat_min any pair can reach at the log's highest
+    speeds, plus the half diagonals of the two largest boxes. Pairs further apart than this are treated as not
+    interacting.
+    '''
+    max_sp = np.abs(actors_df['sp'].to_numpy(dtype=np.float64)).max()
+    max_lat_sp = np.abs(actors_df['lat sp'].to_numpy(dtype=np.float64)).max()
+
+    # Every case at every combination of standing still and the highest speed, from both perspectives
+    sp = np.array([0, max_sp])[:, None]
+    other_sp = np.array([0, max_sp])[None, :]
+    d_lon_min = 0
+
+    for ego_rss, other_rss in [[vut_rss, challenger_rss], [challenger_rss, vut_rss]]:
+        for case in [mf.CASE_SAME, mf.CASE_OPPOSITE, mf.CASE_INTERSECTING]:
+            d_lon_min = max(d_lon_min, np.nanmax(mf.calculate_d_lon_min_array(
+                case, sp, ego_rss.responseTime, ego_rss.alphaLon_accelMax, ego_rss.alphaLon_brakeMin,
+                other_sp, other_rss.responseTime, other_rss.alphaLon_accelMax, other_rss.alphaLon_brakeMin, other_rss.alphaLon_brakeMax)))
+
+    lat_sp = np.array([-max_lat_sp, max_lat_sp])
+    d_lat_min = np.max(mf.calculate_d_lat_min_array(config.mu, lat_sp[:, None], vut_rss.responseTime, vut_rss.alphaLat_accelMax, vut_rss.alphaLat_accelMin,
+                                                    lat_sp[None, :], challenger_rss.responseTime, challenger_rss.alphaLat_accelMax, challenger_rss.alphaLat_accelMin))
+
+    dimensions = [config.vut_dimensions, config.challenger_dimensions]
+    if 'length' in actors_df.columns and 'width' in actors_df.columns:
+        dimensions.append([actors_df['length'].max(), actors_df['width'].max()])
+    half_diagonal = max(np.hypot(*dimension) / 2 for dimension in dimensions)
+
+    return float(max(d_lon_min, d_lat_min) + 2 * half_diagonal)
+
+def candidate_pairs(actors_df, ego_ids, cull_distance = None):
+    '''
+    The (frame, ego, other) rows of every ego and other actor close enough to be scored.
+
+    Actor centers are bucketed in a uniform grid per frame, so the cost grows with the number of nearby pairs
+    rather than with the square of the number of actors. Without a cull_distance every pair in a frame is returned.
+    '''
+    frame = actors_df['frame'].to_numpy()
+    actor = actors_df['actor'].to_numpy()
+    ego_rows = np.flatnonzero(actors_df['actor'].isin(ego_ids).to_numpy())
+
+    if cull_distance is None:
+        pairs_df = actors_df[['frame', 'actor']].iloc[ego_rows].merge(actors_df[['frame', 'actor']], on='frame', suffixes=('_ego', '_other'))
+        pairs_df = pairs_df.rename(columns={'actor_ego': 'ego', 'actor_other': 'other'})
+    else:
+        points = actors_df[['x', 'y']].to_numpy(dtype=np.float64)
+        i, j = so.grid_pairs(points[ego_rows], points, cull_distance, frame[ego_rows], frame)
+        pairs_df = pd.DataFrame({'frame': frame[j], 'ego': actor[ego_rows[i]], 'other': actor[j]})
+
+    return pairs_df[pairs_df['ego'] != pairs_df['other']]
+
+# End helper methods
+
+
+# Begin scene scoring
+
+def score_scene(actors_df, ego_ids = None, vut_rss = config.rss_average, challenger_rss = config.rss_pedestrian,
+                broad_phase = config.multi_actor_broad_phase, cull_distance = config.multi_actor_cull_distance,
+                resample_rate = config.resample_rate):
+    '''
+    Scores a multi-actor log. ego_ids are the actors whose DA score is wanted, None scores every actor
+    against every other one. Egos use vut_rss and the actors around them challenger_rss.
+
+    With broad_phase, only the frames where a pair is within cull_distance (None derives it with
+    interaction_distance) are checked for safety envelope infringements, and pairs that never come that close are
+    not scored at all.
+
+    With a resample_rate every actor is resampled onto one shared grid first, so that actors logged at different
+    times or rates are compared at the same instants. Otherwise actors are paired on equal timestamps.
+
+    Pairs whose actors both end in a collision row (see split_collision_rows) have a Collision Incident on their
+    last common frame.
+
+    Returns [pair_df, ego_df]: one row per scored pair and one row per ego, both with the da_score_dict columns.
+    '''
+    # Removed before resampling and pairing, the collision rows have no valid timestamp
+    actors_df, collided = split_collision_rows(actors_df)
+
+    if resample_rate is not None:
+        actors_df = resampling.resample_actors(actors_df, resample_rate)
+
+    actors_df = actors_df.sort_values(['timestamp', 'actor'], kind='stable').reset_index(drop=True)
+    actors_df['frame'] = pd.factorize(actors_df['timestamp'], sort=True)[0]
+
+    if ego_ids is None:
+        ego_ids = list(actors_df['actor'].unique())
+
+    if broad_phase and cull_distance is None:
+        cull_distance = interaction_distance(actors_df, vut_rss, challenger_rss)
+
+    pairs_df = candidate_pairs(actors_df, ego_ids, cull_distance if broad_phase else None)
+    tracks = dict(list(actors_df.groupby('actor', sort=False)))
+
+    # Every actor's columns are gathered into a trajectory once, the pairs select their common frames from it
+    trajectories = {actor: so.Trajectory.from_columns(track_df) for actor, track_df in tracks.items()}
+    track_frames = {actor: track_df['frame'].to_numpy() for actor, track_df in tracks.items()}
+
+    pair_rows = []
+    ego_dicts = {}
+
+    for (ego, other), near_df in pairs_df.groupby(['ego', 'other'], sort=False):
+        frames, ego_rows, other_rows = np.intersect1d(track_frames[ego], track_frames[other], return_indices=True)
+
+        ego_trajectory = trajectories[ego].select(ego_rows)
+        columns = {'timestamp': ego_trajectory.timestamp}
+        columns.update(ego_trajectory.columns('VUT'))
+        columns.update(trajectories[other].select(other_rows).columns('challenger'))
+
+        active = np.isin(frames, near_df['frame'].to_numpy()) if broad_phase else None
+
+        ci_occurs = int(ego in collided and other in collided)
+
+        _, da_score_dict, overall_da_score = mf.calculate_metrics_batch(columns, ci_occurs, vut_rss, challenger_rss,
+                                                                        actor_dimensions(tracks[ego], config.vut_dimensions),
+                                                                        actor_dimensions(tracks[other], config.challenger_dimensions),
+                                                                        metrics=[], active=active)
+
+        pair_row = {'Ego': ego, 'Actor': other, 'Frames': len(frames),
+                    'Checked Frames': int(np.count_nonzero(active)) if broad_phase else len(frames)}
+        pair_row.update(da_score_dict)
+        pair_row['DA Score'] = overall_da_score
+        del pair_row['Scenario Number']
+        pair_rows.append(pair_row)
+
+        ego_dicts[ego] = da_score_dict if ego not in ego_dicts else mf.merge_da_score(ego_dicts[ego], da_score_dict)
+
+    ego_rows = []
+    for ego in ego_ids:
+        # An ego that never came close to anyone has nothing to lose points for
+        da_score_dict = ego_dicts.get(ego, mf.summarize_da_score({name: np.zeros(0) for name in mf.DA_SCORE_METRICS}))
+
+        ego_row = {'Ego': ego, 'Scored Actors': sum(1 for pair_row in pair_rows if pair_row['Ego'] == ego)}
+        ego_row.update(da_score_dict)
+        ego_row['DA Score'] = mf.calculate_overall_da_score(da_score_dict)
+        del ego_row['Scenario Number']
+        ego_rows.append(ego_row)
+
+    return [pd.DataFrame(pair_rows), pd.DataFrame(ego_rows)]
+
+# End scene scoring
@@ -1,2 +1,498 @@
 # This script will serve to define the objects in a scenario, such as a vehicle or pedestrian.
-# The object will have attributes and functions that can be called.
\ No newline at end of file
+# The object will have attributes and functions that can be called.
+
+# -- Begin imports
+
+import numpy as np
+
+# Only the vehicle class of the legacy row loop needs shapely, the array geometry does not
+try:
+    import shapely
+    from shapely import affinity
+except ImportError:
+    shapely = None
+
+# -- End imports
+
+
+# -- Begin global variables
+
+# Length of the heading ray and multiplier of the side rays, matching the legacy vehicle class
+HEADING_RAY_LENGTH = 1000
+SIDE_RAY_MULTIPLIER = 30
+BUMPER_LINE_LENGTH = 1000
+
+# Trajectory fields and the log column each is read from, '<actor> <column>' in a log (e.g. 'VUT lat sp')
+TRAJECTORY_FIELDS = {
+    'x':         'x',
+    'y':         'y',
+    'heading':   'heading',     # radians
+    'speed':     'sp',          # longitudinal speed
+    'lat_speed': 'lat sp',
+    'lon_acc':   'lon acc',
+    'lat_acc':   'lat acc',
+    'acc':       'acc',
+}
+
+# End global variables
+
+
+# Begin geometry kernels
+#
+# Points are arrays of shape (..., 2) and a segment is a pair of points, so every kernel works on one frame
+# or on N frames at once. Inputs broadcast, so stacking several segments on a leading axis tests them all in
+# one call instead of one call per pair.
+
+def cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+def dot(a, b):
+    return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1]
+
+def norm(a):
+    return np.hypot(a[..., 0], a[..., 1])
+
+def point_segment_distance(p, a, b):
+    ab = b - a
+    denom = dot(ab, ab)
+    degenerate = denom == 0
+
+    t = np.where(degenerate, 0.0, dot(p - a, ab) / np.where(degenerate, 1.0, denom))
+    t = np.clip(t, 0, 1)
+
+    return norm(p - (a + t[..., None] * ab))
+
+def segment_intersection(a, b, c, d):
+    '''
+    Intersection of segments a-b and c-d.
+
+    Returns [hit, start, end], the intersection being the segment start-end (a single point when start == end).
+    Collinear overlapping segments return the overlapping part, the same as shapely.
+    '''
+    r = b - a
+    s = d - c
+    qp = c - a
+
+    denom = cross(r, s)
+    qp_r = cross(qp, r)
+    parallel = denom == 0
+    safe_denom = np.where(parallel, 1.0, denom)
+
+    t = cross(qp, s) / safe_denom
+    u = qp_r / safe_denom
+    crossing = ~parallel & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+
+    # Collinear segments, project c and d onto a-b
+    rr = dot(r, r)
+    safe_rr = np.where(rr > 0, rr, 1.0)
+    t0 = dot(qp, r) / safe_rr
+    t1 = dot(d - a, r) / safe_rr
+    lo = np.maximum(np.minimum(t0, t1), 0)
+    hi = np.minimum(np.maximum(t0, t1), 1)
+    overlapping = parallel & (qp_r == 0) & (lo <= hi)
+
+    t_start = np.where(overlapping, lo, t)
+    t_end = np.where(overlapping, hi, t)
+
+    start = a + t_start[..., None] * r
+    end = a + t_end[..., None] * r
+
+    return [crossing | overlapping, start, end]
+
+def segments_intersect(a, b, c, d):
+    return segment_intersection(a, b, c, d)[0]
+
+def segment_distance(a, b, c, d):
+    a, b, c, d = np.broadcast_arrays(a, b, c, d)
+
+    # The four endpoint to segment distances in one call
+    distance = point_segment_distance(np.stack([a, b, c, d]), np.stack([c, c, a, a]), np.stack([d, d, b, b])).min(axis=0)
+
+    return np.where(segments_intersect(a, b, c, d), 0.0, distance)
+
+def grid_pairs(points, other_points, radius, groups = None, other_groups = None):
+    '''
+    Index pairs [i, j] with points[i] and other_points[j] less than radius apart, found with a uniform grid.
+
+    other_points are bucketed into radius sized cells so that only the 3 x 3 cells around each point are compared.
+    With groups (e.g. frame numbers) only points of the same group are paired.
+    '''
+    points = np.asarray(points, dtype=np.float64)
+    other_points = np.asarray(other_points, dtype=np.float64)
+
+    if len(points) == 0 or len(other_points) == 0:
+        return [np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)]
+
+    if groups is None:
+        groups = np.zeros(len(points), dtype=np.int64)
+        other_groups = np.zeros(len(other_points), dtype=np.int64)
+
+    # Shifted by one cell so that the neighbouring cells of every point have non-negative coordinates
+    origin = np.minimum(points.min(axis=0), other_points.min(axis=0)) - radius
+    cells = np.floor((points - origin) / radius).astype(np.int64)
+    other_cells = np.floor((other_points - origin) / radius).astype(np.int64)
+
+    # One integer key per group and cell, with a spare row and column so that neighbouring cells never wrap around
+    columns, rows = np.maximum(cells.max(axis=0), other_cells.max(axis=0)) + 2
+
+    def cell_key(group, cell_x, cell_y):
+        return (np.asarray(group, dtype=np.int64) * columns + cell_x) * rows + cell_y
+
+    other_keys = cell_key(other_groups, other_cells[:, 0], other_cells[:, 1])
+    order = np.argsort(other_keys, kind='stable')
+    sorted_keys = other_keys[order]
+
+    pairs_i = []
+    pairs_j = []
+
+    for dx in [-1, 0, 1]:
+        for dy in [-1, 0, 1]:
+            keys = cell_key(groups, cells[:, 0] + dx, cells[:, 1] + dy)
+            starts = np.searchsorted(sorted_keys, keys, side='left')
+            counts = np.searchsorted(sorted_keys, keys, side='right') - starts
+
+            # Expand every point into one candidate per other point in the cell
+            i = np.repeat(np.arange(len(points)), counts)
+            offsets = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+            pairs_i.append(i)
+            pairs_j.append(order[np.repeat(starts, counts) + offsets])
+
+    i = np.concatenate(pairs_i)
+    j = np.concatenate(pairs_j)
+    close = norm(points[i] - other_points[j]) < radius
+
+    return [i[close], j[close]]
+
+# End geometry kernels
+
+
+# Begin class definitions
+
+class vehicle:
+    # Given an x, y, heading, and dimensions, a vehicle is constructed.
+    # Derived geometry is cached and only rebuilt after the center, heading or dimensions change.
+    def __init__(self, x: float, y: float, heading: float, dimensions: [float]):
+        if shapely is None:
+            raise ImportError('shapely is needed for the vehicle class')
+
+        self._cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self.center = shapely.Point(x, y)
+
+        # heading in degrees, counter-clockwise from the x axis
+        self.heading = heading
+
+        # dimensions = [length, width]
+        self.dimensions = dimensions
+
+        # speed = m/s
+        self.speed = 0
+
+    @property
+    def center(self):
+        return self._center
+
+    @center.setter
+    def center(self, value):
+        if getattr(self, '_center', None) is None or (value.x, value.y) != (self._center.x, self._center.y):
+            self._cache.clear()
+        self._center = value
+
+    @property
+    def heading(self):
+        return self._heading
+
+    @heading.setter
+    def heading(self, value):
+        if getattr(self, '_heading', None) != value:
+            self._cache.clear()
+        self._heading = value
+
+    @property
+    def dimensions(self):
+        return self._dimensions
+
+    @dimensions.setter
+    def dimensions(self, value):
+        # Stored as a tuple so the dimensions can't change without going through this setter
+        value = tuple(value)
+        if getattr(self, '_dimensions', None) != value:
+            self._cache.clear()
+        self._dimensions = value
+
+    @property
+    def bbox(self):
+        return self.get_bbox()
+
+    @bbox.setter
+    def bbox(self, value):
+        # The legacy row loop assigns vut.bbox = vut.get_bbox() every frame
+        self._cache['bbox'] = value
+
+    def _cached(self, name, build):
+        if name in self._cache:
+            self.cache_hits += 1
+            return self._cache[name]
+
+        self.cache_misses += 1
+        self._cache[name] = build()
+
+        return self._cache[name]
+
+    def cache_info(self):
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'size': len(self._cache)}
+
+    def reset_cache_counters(self):
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def get_bbox(self):
+        return self._cached('bbox', self._build_bbox)
+
+    def _build_bbox(self):
+        length = self.dimensions[1]
+        width = self.dimensions[0]
+
+        # Top right, top left, bottom left and bottom right corners
+        tr = shapely.Point(self.center.x + width/2, self.center.y + length/2)
+        tl = shapely.Point(self.center.x - width/2, self.center.y + length/2)
+        bl = shapely.Point(self.center.x - width/2, self.center.y - length/2)
+        br = shapely.Point(self.center.x + width/2, self.center.y - length/2)
+
+        rect = shapely.Polygon([bl, tl, tr, br])
+
+        # Rotate to match the heading angle
+        return affinity.rotate(rect, self.heading, 'centroid')
+
+        #############
+        #           #
+        #   --F--   #
+        #   |   |   #
+        #   LS  RS  #
+        #   |   |   #
+        #   --R--   #
+        #           #
+        #############
+    def front_bumper(self):
+        return self._cached('front_bumper', lambda: self._build_edge(self.dimensions[0]/2, 0, 0, self.dimensions[1]/2))
+
+    def rear_bumper(self):
+        return self._cached('rear_bumper', lambda: self._build_edge(-self.dimensions[0]/2, 0, 0, self.dimensions[1]/2))
+
+    def left_side(self):
+        return self._cached('left_side', lambda: self._build_edge(0, self.dimensions[1]/2, self.dimensions[0]/2, 0))
+
+    def right_side(self):
+        return self._cached('right_side', lambda: self._build_edge(0, -self.dimensions[1]/2, self.dimensions[0]/2, 0))
+
+    def _build_edge(self, d_x, d_y, half_x, half_y):
+        # Midpoint of the edge and the edge itself, laid out around the center and rotated to the heading
+        mid = shapely.Point(self.center.x + d_x, self.center.y + d_y)
+
+        end_point1 = shapely.Point(mid.x + half_x, mid.y + half_y)
+        end_point2 = shapely.Point(mid.x - half_x, mid.y - half_y)
+
+        midr = affinity.rotate(geom=mid, angle=self.heading, origin=self.center)
+
+        line = shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])
+
+        liner = affinity.rotate(geom=line, angle=self.heading, origin=self.center)
+
+        return [midr, liner]
+
+    def heading_vector(self):
+        #############
+        #     |     #
+        #     |     #
+        #     |     #
+        #     ▮     #
+        #############
+        return self._cached('heading_vector', lambda: self._build_ray(self.center, HEADING_RAY_LENGTH, 0))
+
+    def front_bumper_line(self):
+        return self._cached('front_bumper_line', lambda: self._build_cross_line(self.front_bumper()[0]))
+
+    def rear_bumper_line(self):
+        return self._cached('rear_bumper_line', lambda: self._build_cross_line(self.rear_bumper()[0]))
+
+    def left_side_line(self):
+        return self._cached('left_side_line', lambda: self._build_ray(self.left_side()[0], self.dimensions[0] * SIDE_RAY_MULTIPLIER, self.dimensions[0]/2))
+
+    def right_side_line(self):
+        return self._cached('right_side_line', lambda: self._build_ray(self.right_side()[0], self.dimensions[0] * SIDE_RAY_MULTIPLIER, self.dimensions[0]/2))
+
+    def _build_ray(self, origin, forward, backward):
+        end_point1 = shapely.Point(origin.x + forward, origin.y)
+        end_point2 = shapely.Point(origin.x - backward, origin.y)
+
+        if backward == 0:
+            line = shapely.LineString([[origin.x, origin.y], [end_point1.x, end_point1.y]])
+        else:
+            line = shapely.LineString([end_point1, end_point2])
+
+        return affinity.rotate(line, self.heading, origin=origin)
+
+    def _build_cross_line(self, origin):
+        end_point1 = shapely.Point(origin.x, origin.y + BUMPER_LINE_LENGTH/2)
+        end_point2 = shapely.Point(origin.x, origin.y - BUMPER_LINE_LENGTH/2)
+
+        line = shapely.LineString([end_point1, end_point2])
+
+        return affinity.rotate(line, self.heading, origin=origin)
+
+class OrientedBox:
+    # Given arrays of x, y, heading (radians) and dimensions, the bounding box of every frame is constructed
+    def __init__(self, x, y, heading, dimensions: [float]):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        heading = np.asarray(heading, dtype=np.float64)
+
+        # dimensions = [length, width]
+        self.dimensions = dimensions
+        self.half_length = dimensions[0]/2
+        self.half_width = dimensions[1]/2
+
+        self.center = np.stack([x, y], axis=-1)
+        self.heading = heading
+
+        # Unit vectors along the heading and to the left of it
+        self.u = np.stack([np.cos(heading), np.sin(heading)], axis=-1)
+        self.n = np.stack([-np.sin(heading), np.cos(heading)], axis=-1)
+
+        #############
+        #           #
+        #   --F--   #
+        #   |   |   #
+        #   LS  RS  #
+        #   |   |   #
+        #   --R--   #
+        #           #
+        #############
+        self.front = self.center + self.u * self.half_length
+        self.rear = self.center - self.u * self.half_length
+        self.left = self.center + self.n * self.half_width
+        self.right = self.center - self.n * self.half_width
+
+        # Corners are computed once so that segments sharing a corner share it bit for bit
+        front_left = self.front + self.n * self.half_width
+        front_right = self.front - self.n * self.half_width
+        rear_left = self.rear + self.n * self.half_width
+        rear_right = self.rear - self.n * self.half_width
+
+        # bl, tl, tr, br, the same order as the legacy bbox, shape (4, N, 2)
+        self.corners = np.stack([rear_right, rear_left, front_left, front_right])
+
+        self.front_bumper = (front_left, front_right)
+        self.rear_bumper = (rear_left, rear_right)
+        self.left_side = (front_left, rear_left)
+        self.right_side = (front_right, rear_right)
+
+        # Rays used to classify the case and find d_lon
+        length = dimensions[0]
+        self.left_side_line = (self.left + self.u * length * SIDE_RAY_MULTIPLIER, self.left - self.u * self.half_length)
+        self.right_side_line = (self.right + self.u * length * SIDE_RAY_MULTIPLIER, self.right - self.u * self.half_length)
+        self.heading_vector = (self.center, self.center + self.u * HEADING_RAY_LENGTH)
+
+        self.front_bumper_line = (self.front + self.n * BUMPER_LINE_LENGTH/2, self.front - self.n * BUMPER_LINE_LENGTH/2)
+        self.rear_bumper_line = (self.rear + self.n * BUMPER_LINE_LENGTH/2, self.rear - self.n * BUMPER_LINE_LENGTH/2)
+
+    def __len__(self):
+        return len(self.center)
+
+    def select(self, index):
+        # The boxes of the frames picked by index, a boolean mask or frame numbers
+        return OrientedBox(self.center[index, 0], self.center[index, 1], self.heading[index], self.dimensions)
+
+    def edges(self):
+        # The four edges as a pair of stacked start and end points, each of shape (4, N, 2)
+        return (self.corners, np.roll(self.corners, -1, axis=0))
+
+    def contains(self, p):
+        offset = p - self.center
+
+        return ((np.abs(dot(offset, self.u)) <= self.half_length)
+                & (np.abs(dot(offset, self.n)) <= self.half_width))
+
+    def distance_to_segment(self, a, b):
+        # Segments of shape (..., N, 2) against the four edges, shape (..., 4, N) before the min
+        distance = segment_distance(a[..., None, :, :], b[..., None, :, :], *self.edges()).min(axis=-2)
+
+        inside = self.contains(a) | self.contains(b)
+
+        return np.where(inside, 0.0, distance)
+
+    def distance_to_box(self, other):
+        self_start, self_end = self.edges()
+        other_start, other_end = other.edges()
+
+        # Every corner against every edge of the other box, shape (4, 4, N)
+        distance = np.minimum(point_segment_distance(self.corners[:, None], other_start[None], other_end[None]).min(axis=(0, 1)),
+                              point_segment_distance(other.corners[:, None], self_start[None], self_end[None]).min(axis=(0, 1)))
+
+        overlapping = (self.contains(other.center) | other.contains(self.center)
+                       | segments_intersect(self_start[:, None], self_end[:, None], other_start[None], other_end[None]).any(axis=(0, 1)))
+
+        return np.where(overlapping, 0.0, distance)
+
+class Trajectory:
+    '''
+    One actor's motion as a structure of arrays: timestamp and every TRAJECTORY_FIELDS field as a contiguous float64
+    array with one value per frame.
+
+    Arrays that already are contiguous float64 are kept as they are, so a trajectory built from the columns of a
+    parsed log or from the rows of a memory-mapped file is a set of views and nothing is copied. Fields the log
+    does not have (e.g. 'challenger acc') are None.
+    '''
+    def __init__(self, timestamp, x, y, heading, speed = None, lat_speed = None, lon_acc = None, lat_acc = None, acc = None):
+        self.timestamp = np.ascontiguousarray(timestamp, dtype=np.float64)
+
+        for name, values in zip(TRAJECTORY_FIELDS, [x, y, heading, speed, lat_speed, lon_acc, lat_acc, acc]):
+            setattr(self, name, None if values is None else np.ascontiguousarray(values, dtype=np.float64))
+
+    @classmethod
+    def from_columns(cls, columns, actor = None):
+        '''
+        The trajectory of actor ('VUT', 'challenger') from anything indexable by the log column names, e.g. a
+        DataFrame or a dict of arrays. Without an actor the columns are the bare names of TRAJECTORY_FIELDS, as in
+        the tracks of a multi-actor log.
+        '''
+        prefix = '' if actor is None else actor + ' '
+
+        return cls(columns['timestamp'], *[columns[prefix + column] if prefix + column in columns else None
+                                           for column in TRAJECTORY_FIELDS.values()])
+
+    @classmethod
+    def load(cls, path):
+        # A trajectory saved with save, memory-mapped so that every field is a view of the file
+        return cls(*np.load(path, mmap_mode='r'))
+
+    def save(self, path):
+        # One float64 row per field, the same layout as the .npy log cache, so every field is contiguous in the file
+        np.save(path, self.to_array())
+
+    def to_array(self):
+        # Shape (fields + 1, frames), timestamp first, missing fields are nan
+        return np.stack([self.timestamp] + [np.full(len(self), np.nan) if getattr(self, name) is None else getattr(self, name)
+                                            for name in TRAJECTORY_FIELDS])
+
+    def columns(self, actor = None):
+        # The fields under their log column names, views of this trajectory, missing fields are left out
+        prefix = '' if actor is None else actor + ' '
+
+        return {prefix + column: getattr(self, name) for name, column in TRAJECTORY_FIELDS.items() if getattr(self, name) is not None}
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def select(self, index):
+        # The frames picked by index, a boolean mask or frame numbers
+        return Trajectory(self.timestamp[index], *[None if getattr(self, name) is None else getattr(self, name)[index]
+                                                   for name in TRAJECTORY_FIELDS])
+
+    def box(self, dimensions):
+        # The OrientedBox of every frame
+        return OrientedBox(self.x, self.y, self.heading, dimensions)
+
+# End class definitions
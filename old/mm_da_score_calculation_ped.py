@@ -11,7 +11,9 @@
 
 import pandas as pd
 import glob
+import logging
 import os
+import sys
 
 import plotly.graph_objects as go
 import matplotlib.pyplot as plt
@@ -25,12 +27,23 @@ from shapely import affinity
 import safety_metrics.umich_metrics as sm
 import dsa_metrics_analysis as sma
 
+# The vehicle class with cached derived geometry is defined in object.py, one folder up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from object import vehicle
+
 # -- End imports
 
 
 # -- Begin global variables
 log = 'mm'
 
+# Per-frame details (SEI tuples, ORT start and end times) are logged at DEBUG
+logger = logging.getLogger('da_score.legacy')
+
+# Step through every frame interactively with draw_scenario, needs a display and blocks the loop.
+# visualization.render_scenario draws logs headless instead.
+draw_frames = False
+
 columns_dict = {
     'SEI':      [],         # Safety Envelope Infringement
 
@@ -117,383 +130,6 @@ columns_to_remove = [
 
 # Begin class definitions
 
-class vehicle:
-    # Given an x, y, heading, and dimensions, a vehicle is constructed
-    def __init__(self, x: float, y: float, heading: float, dimensions: [float]):
-        self.center = shapely.Point(x, y)
-
-        # UMich heading has been given as compass angle
-        self.heading = heading
-        
-        # dimensions = [length, width]
-        self.dimensions = dimensions
-
-        # speed = m/s
-        self.speed = 0
-
-    def get_bbox(self):
-        length = self.dimensions[1]
-        width = self.dimensions[0]
-
-        # Convert angle from compass to regular
-        #angle = (450 - self.heading) % 360
-        angle = self.heading
-
-        # Top right corner
-        tr_x = self.center.x + width/2
-        tr_y = self.center.y + length/2
-        tr = shapely.Point(tr_x, tr_y)
-
-        # Top left corner
-        tl_x = self.center.x - width/2
-        tl_y = self.center.y + length/2
-        tl = shapely.Point(tl_x, tl_y)
-
-        # Bottom left corner
-        bl_x = self.center.x - width/2
-        bl_y = self.center.y - length/2
-        bl = shapely.Point(bl_x, bl_y)
-
-        # Bottom right corner
-        br_x = self.center.x + width/2
-        br_y = self.center.y - length/2
-        br = shapely.Point(br_x, br_y)
-
-        rect = shapely.Polygon([bl, tl, tr, br])
-
-        # Rotate to match the heading angle
-        return affinity.rotate(rect, angle, 'centroid')
-    
-        #############
-        #           #
-        #   --F--   #
-        #   |   |   #
-        #   LS  RS  #
-        #   |   |   #
-        #   --R--   #
-        #           #
-        #############
-    """ def front_bumper(self):
-        
-        length = self.dimensions[0]
-        width = self.dimensions[1]
-
-        d_l_x = length/2 * math.sin(math.radians(self.heading))
-        d_l_y = length/2 * math.cos(math.radians(self.heading))
-
-        fb = shapely.Point(self.center.x + d_l_x, self.center.y + d_l_y)
-
-        d_w_x = width/2 * math.sin(math.radians(self.heading) - math.pi/2)
-        d_w_y = width/2 * math.cos(math.radians(self.heading) - math.pi/2)
-
-        end_point1 = shapely.Point(fb.x + d_w_x, fb.y + d_w_y)
-        end_point2 = shapely.Point(fb.x - d_w_x, fb.y - d_w_y)
-
-        return [fb, shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])] """
-    
-    def front_bumper(self):
-        length = self.dimensions[0]
-        width = self.dimensions[1]
-
-        fb = shapely.Point(self.center.x + length/2, self.center.y)
-
-        end_point1 = shapely.Point(fb.x, fb.y + width/2)
-        end_point2 = shapely.Point(fb.x, fb.y - width/2)
-
-        fbr = affinity.rotate(geom=fb, angle=self.heading, origin=self.center)
-
-        fbl = shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])
-
-        fblr = affinity.rotate(geom=fbl, angle=self.heading, origin=self.center)
-
-        return [fbr, fblr]
-    
-    # def rear_bumper(self):
-    #     #############
-    #     #           #
-    #     #   -----   #
-    #     #   |   |   #
-    #     #   |   |   #
-    #     #   |   |   #
-    #     #   --0--   #
-    #     #           #
-    #     #############
-    #     length = self.dimensions[0]
-    #     width = self.dimensions[1]
-
-    #     d_l_x = length/2 * math.sin(math.radians(self.heading))
-    #     d_l_y = length/2 * math.cos(math.radians(self.heading))
-
-    #     rb = shapely.Point(self.center.x - d_l_x, self.center.y - d_l_y)
-
-    #     d_w_x = width/2 * math.sin(math.radians(self.heading) - math.pi/2)
-    #     d_w_y = width/2 * math.cos(math.radians(self.heading) - math.pi/2)
-
-    #     end_point1 = shapely.Point(rb.x + d_w_x, rb.y + d_w_y)
-    #     end_point2 = shapely.Point(rb.x - d_w_x, rb.y - d_w_y)
-
-    #     return [rb, shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])]
-    
-    def rear_bumper(self):
-        length = self.dimensions[0]
-        width = self.dimensions[1]
-
-        rb = shapely.Point(self.center.x - length/2, self.center.y)
-
-        end_point1 = shapely.Point(rb.x, rb.y + width/2)
-        end_point2 = shapely.Point(rb.x, rb.y - width/2)
-
-        rbr = affinity.rotate(geom=rb, angle=self.heading, origin=self.center)
-
-        rbl = shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])
-
-        rblr = affinity.rotate(geom=rbl, angle=self.heading, origin=self.center)
-
-        return [rbr, rblr]
-    
-    # def left_side(self):
-    #     #############
-    #     #           #
-    #     #   -----   #
-    #     #   |   |   #
-    #     #   0   |   #
-    #     #   |   |   #
-    #     #   -----   #
-    #     #           #
-    #     #############
-    #     length = self.dimensions[0]
-    #     width = self.dimensions[1]
-
-    #     d_w_x = width/2 * math.sin(math.radians(self.heading) - math.pi/2)
-    #     d_w_y = width/2 * math.cos(math.radians(self.heading) - math.pi/2)
-
-    #     ls = shapely.Point(self.center.x + d_w_x, self.center.y + d_w_y)
-
-    #     d_l_x = length/2 * math.sin(math.radians(self.heading))
-    #     d_l_y = length/2 * math.cos(math.radians(self.heading))
-
-    #     end_point1 = shapely.Point(ls.x + d_l_x, ls.y + d_l_y)
-    #     end_point2 = shapely.Point(ls.x - d_l_x, ls.y - d_l_y)
-
-    #     return [ls, shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])]
-    
-    def left_side(self):
-        length = self.dimensions[0]
-        width = self.dimensions[1]
-
-        ls = shapely.Point(self.center.x, self.center.y + width/2)
-
-        end_point1 = shapely.Point(ls.x + length/2, ls.y)
-        end_point2 = shapely.Point(ls.x - length/2, ls.y)
-
-        lsr = affinity.rotate(geom=ls, angle=self.heading, origin=self.center)
-
-        lsl = shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])
-
-        lslr = affinity.rotate(geom=lsl, angle=self.heading, origin=self.center)
-
-        return [lsr, lslr]
-
-
-    # def right_side(self):
-    #     #############
-    #     #           #
-    #     #   -----   #
-    #     #   |   |   #
-    #     #   |   0   #
-    #     #   |   |   #
-    #     #   -----   #
-    #     #           #
-    #     #############
-    #     # length = self.dimensions[0]
-    #     # d_x = length/2 * math.sin(math.radians(self.heading) - math.pi/2)
-    #     # d_y = length/2 * math.cos(math.radians(self.heading) - math.pi/2)
-
-    #     # rs = shapely.Point(self.center.x - d_x, self.center.y - d_y)
-
-    #     # end_point1 = shapely.Point(rs.x + d_x, rs.y + d_y)
-    #     # end_point2 = shapely.Point(rs.x - d_x, rs.y - d_y)
-
-    #     # return [rs, shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])]
-    
-    #     length = self.dimensions[0]
-    #     width = self.dimensions[1]
-
-    #     d_w_x = width/2 * math.sin(math.radians(self.heading) - math.pi/2)
-    #     d_w_y = width/2 * math.cos(math.radians(self.heading) - math.pi/2)
-
-    #     rs = shapely.Point(self.center.x - d_w_x, self.center.y - d_w_y)
-
-    #     d_l_x = length/2 * math.sin(math.radians(self.heading))
-    #     d_l_y = length/2 * math.cos(math.radians(self.heading))
-
-    #     end_point1 = shapely.Point(rs.x + d_l_x, rs.y + d_l_y)
-    #     end_point2 = shapely.Point(rs.x - d_l_x, rs.y - d_l_y)
-
-    #     return [rs, shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])]
-
-    def right_side(self):
-        length = self.dimensions[0]
-        width = self.dimensions[1]
-
-        rs = shapely.Point(self.center.x, self.center.y - width/2)
-
-        end_point1 = shapely.Point(rs.x + length/2, rs.y)
-        end_point2 = shapely.Point(rs.x - length/2, rs.y)
-
-        rsr = affinity.rotate(geom=rs, angle=self.heading, origin=self.center)
-
-        rsl = shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])
-
-        rslr = affinity.rotate(geom=rsl, angle=self.heading, origin=self.center)
-
-        return [rsr, rslr]
-    
-    def rotate_point(x, y, angle, length):
-        xr = (x * math.cos(angle)) - (y * math.sin(angle))
-        xy = (x * math.sin(angle)) + (y * math.cos(angle)) + length
-
-    def heading_vector(self):
-        #############
-        #     |     #
-        #     |     #
-        #     |     #
-        #     ▮     #
-        #############
-        length = 1000
-        #d_x = length/2 * math.sin(math.radians(self.heading))
-        #d_y = length/2 * math.cos(math.radians(self.heading))
-
-        end_point = shapely.Point(self.center.x + length, self.center.y)
-
-        line = shapely.LineString([[self.center.x, self.center.y], [end_point.x, end_point.y]])
-
-        return affinity.rotate(line, self.heading, origin=self.center)
-
-        return shapely.LineString([[self.center.x, self.center.y], [end_point.x, end_point.y]])
-    
-    # def front_bumper_line(self):
-    #     #############
-    #     #           #
-    #     #<----F---->#
-    #     #   |   |   #
-    #     #   |   |   #
-    #     #   |   |   #
-    #     #   --R--   #
-    #     #           #
-    #     #############
-    #     width = 1000
-    #     d_x = width/2 * math.sin(math.radians(self.heading) - math.pi/2)
-    #     d_y = width/2 * math.cos(math.radians(self.heading) - math.pi/2)
-
-    #     end_point1 = shapely.Point(self.front_bumper()[0].x + d_x, self.front_bumper()[0].y + d_y)
-    #     end_point2 = shapely.Point(self.front_bumper()[0].x - d_x, self.front_bumper()[0].y - d_y)
-
-    #     return shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])
-
-    def front_bumper_line(self):
-        length = 1000
-        end_point1 = shapely.Point(self.front_bumper()[0].x, self.front_bumper()[0].y + length/2)
-        end_point2 = shapely.Point(self.front_bumper()[0].x, self.front_bumper()[0].y - length/2)
-
-        line = shapely.LineString([end_point1, end_point2])
-
-        return affinity.rotate(line, self.heading, origin=self.front_bumper()[0])
-    
-    # def rear_bumper_line(self):
-    #     #############
-    #     #           #
-    #     #   --F--   #
-    #     #   |   |   #
-    #     #   |   |   #
-    #     #   |   |   #
-    #     #<----R---->#
-    #     #           #
-    #     #############
-    #     width = 1000
-    #     d_x = width/2 * math.sin(math.radians(self.heading) - math.pi/2)
-    #     d_y = width/2 * math.cos(math.radians(self.heading) - math.pi/2)
-
-    #     end_point1 = shapely.Point(self.rear_bumper()[0].x + d_x, self.rear_bumper()[0].y + d_y)
-    #     end_point2 = shapely.Point(self.rear_bumper()[0].x - d_x, self.rear_bumper()[0].y - d_y)
-
-    #     return shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])
-    
-    def rear_bumper_line(self):
-        length = 1000
-        end_point1 = shapely.Point(self.rear_bumper()[0].x, self.rear_bumper()[0].y + length/2)
-        end_point2 = shapely.Point(self.rear_bumper()[0].x, self.rear_bumper()[0].y - length/2)
-
-        line = shapely.LineString([end_point1, end_point2])
-
-        return affinity.rotate(line, self.heading, origin=self.rear_bumper()[0])
-    
-    # def left_side_line(self):
-    #     #############
-    #     #   |       #
-    #     #   |----   #
-    #     #   |   |   #
-    #     #   L   |   #
-    #     #   |   |   #
-    #     #   |----   #
-    #     #           #
-    #     #############
-    #     length = self.dimensions[0] * 30
-    #     d_x1 = length/2 * math.sin(math.radians(self.heading))
-    #     d_y1 = length/2 * math.cos(math.radians(self.heading))
-
-    #     length = self.dimensions[0]
-
-    #     d_x2 = length/2 * math.sin(math.radians(self.heading))
-    #     d_y2 = length/2 * math.cos(math.radians(self.heading))
-
-    #     end_point1 = shapely.Point(self.left_side()[0].x + d_x1, self.left_side()[0].y + d_y1)
-    #     end_point2 = shapely.Point(self.left_side()[0].x - d_x2, self.left_side()[0].y - d_y2)
-
-    #     return shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])
-    
-    def left_side_line(self):
-        length = self.dimensions[0] * 30
-        end_point1 = shapely.Point(self.left_side()[0].x + length, self.left_side()[0].y)
-        end_point2 = shapely.Point(self.left_side()[0].x - self.dimensions[0]/2, self.left_side()[0].y)
-
-        line = shapely.LineString([end_point1, end_point2])
-
-        return affinity.rotate(line, self.heading, origin=self.left_side()[0])
-    
-    # def right_side_line(self):
-    #     #############
-    #     #       |   #
-    #     #   ----|   #
-    #     #   |   |   #
-    #     #   |   R   #
-    #     #   |   |   #
-    #     #   ----|   #
-    #     #           #
-    #     #############
-    #     length = self.dimensions[0] * 30
-    #     d_x1 = length/2 * math.sin(math.radians(self.heading))
-    #     d_y1 = length/2 * math.cos(math.radians(self.heading))
-        
-    #     length = self.dimensions[0]
-
-    #     d_x2 = length/2 * math.sin(math.radians(self.heading))
-    #     d_y2 = length/2 * math.cos(math.radians(self.heading))
-
-    #     end_point1 = shapely.Point(self.right_side()[0].x + d_x1, self.right_side()[0].y + d_y1)
-    #     end_point2 = shapely.Point(self.right_side()[0].x - d_x2, self.right_side()[0].y - d_y2)
-
-    #     return shapely.LineString([[end_point1.x, end_point1.y], [end_point2.x, end_point2.y]])
-    
-    def right_side_line(self):
-        length = self.dimensions[0] * 30
-        end_point1 = shapely.Point(self.right_side()[0].x + length, self.right_side()[0].y)
-        end_point2 = shapely.Point(self.right_side()[0].x - self.dimensions[0]/2, self.right_side()[0].y)
-
-        line = shapely.LineString([end_point1, end_point2])
-
-        return affinity.rotate(line, self.heading, origin=self.right_side()[0])
-    
 class RssParameters():
     def __init__(self, alphaLon_accelMax = 1.8, alphaLon_brakeMax = 6.1, alphaLon_brakeMin = 3.6, responseTime = 0.2, alphaLat_accelMin = 5.88, alphaLat_accelMax = 8.83):
         self.alphaLon_accelMax = alphaLon_accelMax
@@ -718,14 +354,15 @@ def process_log(data_df):
         challenger.bbox = challenger.get_bbox()
         challenger.speed = row['challenger sp']
 
-        # For setting the vehicle graph size
-        x_lim_min = min(data_df['VUT x'].min(), data_df['challenger x'].min())
-        x_lim_max = max(data_df['VUT x'].max(), data_df['challenger x'].max())
+        if draw_frames:
+            # For setting the vehicle graph size
+            x_lim_min = min(data_df['VUT x'].min(), data_df['challenger x'].min())
+            x_lim_max = max(data_df['VUT x'].max(), data_df['challenger x'].max())
 
-        y_lim_min = min(data_df['VUT y'].min(), data_df['challenger y'].min())
-        y_lim_max = max(data_df['VUT y'].max(), data_df['challenger y'].max())
+            y_lim_min = min(data_df['VUT y'].min(), data_df['challenger y'].min())
+            y_lim_max = max(data_df['VUT y'].max(), data_df['challenger y'].max())
 
-        draw_scenario(row['timestamp'], vut, challenger, x_lim_min, x_lim_max, y_lim_min, y_lim_max)
+            draw_scenario(row['timestamp'], vut, challenger, x_lim_min, x_lim_max, y_lim_min, y_lim_max)
 
         # Safety Envelope Infringement
         if (sm.d_lat(vut, challenger)[0] == 'left'):
@@ -757,7 +394,7 @@ def process_log(data_df):
                             right_min_decel_lat=rss_pedestrian.alphaLat_accelMin,
                             )
         
-        print(SEI[0], SEI[1], SEI[2], SEI[3], SEI[4], SEI[5])
+        logger.debug('SEI %s %s %s %s %s %s', SEI[0], SEI[1], SEI[2], SEI[3], SEI[4], SEI[5])
         
         SEI_challenger = sm.calculate_sei(vut=challenger,
                             challenger=vut,
@@ -882,14 +519,13 @@ def process_log(data_df):
         if (SEI[0] == 1 and initiate_violation_response == False):
             initiate_violation_response = True
             start_time = row['timestamp']
-            print(start_time)
+            logger.debug('ORT start %s', start_time)
 
         if initiate_violation_response == True:
             if row['VUT acc'] < 0:
                 end_time = row['timestamp']
-                print(end_time)
                 ORT = end_time - start_time
-                print(ORT)
+                logger.debug('ORT end %s, ORT %s', end_time, ORT)
                 initiate_violation_response = False
                 if ORT > 1:
                     ORTV = 1
@@ -1121,17 +757,19 @@ def calculate_safety_metrics(data_path):
             scen_folder_path = output_path
 
         print('Processing log file: {}'.format(scenario_name))
+        start_log_time = time.time()
 
         #Get the dataframe for the current log being processed
         current_log_df = pd.read_csv(file, sep = r',', skipinitialspace= True)
 
         processed_df = process_log(current_log_df)
-        print('Time taken to process: {}[min]'.format((time.time()-start_elapsed_time)/60.0))
+        print('Time taken to process: {}[min]'.format((time.time()-start_log_time)/60.0))
 
         result_name = os.path.join(scen_folder_path, scenario_name + '-dsa_results.csv')
 
+        start_visualize_time = time.time()
         create_visualizations(processed_df[0], scen_folder_path, scenario_name)
-        print('Time taken to visualize: {}[min]'.format((time.time()-start_elapsed_time)/60.0))
+        print('Time taken to visualize: {}[min]'.format((time.time()-start_visualize_time)/60.0))
 
         # Save the dataframe to a .csv
         processed_df[0].to_csv(result_name, index=False)
@@ -0,0 +1,167 @@
+# This script will serve to resample logs to a fixed rate before they are scored, so that time based metrics
+# (SERT, ORT) have the same resolution whatever rate a log was recorded at, and long high rate logs can be screened
+# at a low rate. Positions, speeds and accelerations are interpolated linearly, headings along the shortest arc.
+
+# -- Begin imports
+
+import numpy as np
+import pandas as pd
+
+import object as so
+
+# -- End imports
+
+
+# -- Begin global variables
+
+# Columns interpolated as angles (radians): '<actor> heading' in single pair logs, 'heading' in multi-actor logs
+HEADING_COLUMN = so.TRAJECTORY_FIELDS['heading']
+
+# Columns that label rows rather than measure anything, they take the value of the previous logged frame
+LABEL_COLUMNS = ['actor']
+
+# Grid points within this many seconds after the last logged frame still count as inside the log
+TIME_TOLERANCE = 1e-9
+
+# End global variables
+
+
+# Begin interpolation kernels
+
+def interpolate_angle(grid, timestamp, angle):
+    '''
+    Headings (radians) at the grid times, interpolated along the shortest arc between the logged frames, so that
+    a turn through 0 / 2 pi is not interpolated the long way round.
+
+    Each grid heading keeps the 2 pi offset of the nearest of its two logged frames, so the headings stay in the
+    convention they were logged in and only depend on the two frames around them: a log resampled in chunks gives
+    the same headings as the whole log.
+    '''
+    if len(timestamp) == 1:
+        return np.full(len(grid), angle[0])
+
+    # Frames on either side of each grid time, grid times outside the log take its first / last heading
+    index = np.clip(np.searchsorted(timestamp, grid, side='right') - 1, 0, len(timestamp) - 2)
+    interval = timestamp[index + 1] - timestamp[index]
+    fraction = np.clip(np.divide(grid - timestamp[index], interval, out=np.zeros(len(grid)), where=interval > 0), 0, 1)
+
+    # Shortest arc from each frame to the next, the step np.unwrap takes
+    arc = np.mod(angle[index + 1] - angle[index] + np.pi, 2 * np.pi) - np.pi
+
+    return np.where(fraction <= 0.5, angle[index] + fraction * arc, angle[index + 1] - (1 - fraction) * arc)
+
+def previous_values(grid, timestamp, values):
+    # Value of the last logged frame at or before each grid time, for columns that can't be interpolated
+    index = np.clip(np.searchsorted(timestamp, grid, side='right') - 1, 0, len(timestamp) - 1)
+
+    return values[index]
+
+def resample_frame(data_df, grid):
+    '''
+    The rows of data_df at the grid times. Every numeric column is interpolated linearly, heading columns with
+    interpolate_angle and the other columns (LABEL_COLUMNS, text) take the value of the previous logged frame.
+    '''
+    timestamp = data_df['timestamp'].to_numpy(dtype=np.float64)
+    columns = {}
+
+    for name in data_df.columns:
+        values = data_df[name].to_numpy()
+
+        if name == 'timestamp':
+            columns[name] = grid
+        elif name.split(' ')[-1] == HEADING_COLUMN:
+            columns[name] = interpolate_angle(grid, timestamp, values.astype(np.float64))
+        elif name not in LABEL_COLUMNS and pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+            columns[name] = np.interp(grid, timestamp, values.astype(np.float64))
+        else:
+            columns[name] = previous_values(grid, timestamp, values)
+
+    return pd.DataFrame(columns)
+
+# End interpolation kernels
+
+
+# Begin resampler
+
+class Resampler:
+    '''
+    Resamples a log to rate Hz, whole or chunk by chunk. The grid starts at the first logged frame and steps by
+    1 / rate, a rate below the logged one downsamples the log. Every pushed chunk returns its grid rows, the last
+    frame of the previous chunk is kept so that no grid point between two chunks is lost.
+
+    Downsampling samples the log at the grid times and does not average, so an event shorter than 1 / rate can fall
+    between two grid points. Use it to screen logs, not to score them.
+    '''
+    def __init__(self, rate, origin = None):
+        self.rate = rate
+
+        # Time of grid point 0, the first logged frame unless set, e.g. to align the actors of a multi-actor log
+        self.origin = origin
+        self.next_step = 0
+
+        self.previous_df = None
+        self.last_grid_time = None
+
+    def push(self, chunk_df):
+        if len(chunk_df) == 0:
+            return chunk_df
+
+        if self.previous_df is not None:
+            chunk_df = pd.concat([self.previous_df, chunk_df], ignore_index=True)
+
+        timestamp = chunk_df['timestamp'].to_numpy(dtype=np.float64)
+
+        if self.origin is None:
+            self.origin = timestamp[0]
+
+        first_step = max(self.next_step, int(np.ceil((timestamp[0] - self.origin) * self.rate - TIME_TOLERANCE)))
+        last_step = int(np.floor((timestamp[-1] - self.origin) * self.rate + TIME_TOLERANCE))
+        grid = self.origin + np.arange(first_step, last_step + 1) / self.rate
+
+        self.previous_df = chunk_df.iloc[-1:]
+        self.next_step = max(self.next_step, last_step + 1)
+
+        if len(grid) == 0:
+            return chunk_df.iloc[0:0]
+
+        self.last_grid_time = grid[-1]
+
+        return resample_frame(chunk_df, grid)
+
+    def finish(self):
+        '''
+        The last logged frame when it falls between two grid points, so that the end of the log (e.g. the frame a
+        collision is reported on) is always scored. Empty otherwise.
+        '''
+        if self.previous_df is None:
+            return pd.DataFrame()
+
+        last_time = float(self.previous_df['timestamp'].iloc[0])
+        if self.last_grid_time is not None and last_time <= self.last_grid_time + TIME_TOLERANCE:
+            return self.previous_df.iloc[0:0]
+
+        return self.previous_df.reset_index(drop=True)
+
+def resample_log(data_df, rate):
+    '''
+    A whole log resampled to rate Hz, its last logged frame included. Rows must be in time order.
+    '''
+    resampler = Resampler(rate)
+    resampled_df = resampler.push(data_df)
+
+    return pd.concat([resampled_df, resampler.finish()], ignore_index=True)
+
+def resample_actors(actors_df, rate):
+    '''
+    A multi-actor log with every actor resampled to rate Hz on one shared grid, so that actors logged at different
+    times or rates have a frame in common wherever their tracks overlap. Only grid points are kept.
+    '''
+    origin = actors_df['timestamp'].min()
+    tracks = []
+
+    for _, track_df in actors_df.groupby('actor', sort=False):
+        tracks.append(Resampler(rate, origin).push(track_df.sort_values('timestamp', kind='stable').reset_index(drop=True)))
+
+    return pd.concat(tracks, ignore_index=True)
+
+# End resampler
@@ -0,0 +1,278 @@
+# This script will serve to write the scored results, the per-frame tables of every log and the summary tables,
+# to the output format chosen in config.result_format. Every format sits behind the same append interface.
+
+# -- Begin imports
+
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+import config
+import metrics_formulas as mf
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# -- End imports
+
+
+# -- Begin global variables
+
+RESULT_FORMATS = ['csv', 'parquet', 'dataset', 'sqlite']
+
+# Column holding the scenario in tables shared by every log (SQLite), the same name as in the summary table
+SCENARIO_COLUMN = 'Scenario Number'
+
+# Seconds a worker waits for another one to finish writing to the SQLite database
+SQLITE_TIMEOUT = 60
+
+# Column types of the summary tables, whose rows come from different logs and parameter sets
+SUMMARY_DTYPES = {'DA Score': 'float64', 'Parameter Set': 'int64'}
+SUMMARY_DTYPES.update({name: 'int64' if name in ['SEI', 'SERTV', 'EMI', 'CI', 'ORTV'] else 'float64' for name in mf.DA_SCORE_MAXIMA})
+SUMMARY_DTYPES.update({name: 'int64' for name in mf.DA_SCORE_COUNTS})
+SUMMARY_DTYPES.update({prefix + ' ' + name: 'float64' for prefix in ['VUT', 'challenger'] for name in mf.RSS_PARAMETER_NAMES})
+
+# Tables written with fixed column types (Parquet, dataset), columns not listed take the type of the first piece
+TABLE_DTYPES = {'DA Scores': SUMMARY_DTYPES, 'RSS Sweep': SUMMARY_DTYPES}
+
+# End global variables
+
+
+# Begin result sinks
+
+def cast_columns(table, data_df):
+    '''
+    data_df with the columns TABLE_DTYPES lists for table cast to their type, so that every piece of the table has
+    the same schema whichever log it came from.
+    '''
+    dtypes = {name: dtype for name, dtype in TABLE_DTYPES.get(table, {}).items() if name in data_df.columns}
+
+    return data_df.astype(dtypes) if len(dtypes) > 0 else data_df
+
+class ResultSink(ABC):
+    '''
+    Interface of the result formats. A table is appended to piece by piece, e.g. chunk by chunk while a log is
+    streamed, and is complete once the sink is closed.
+
+    Tables belonging to one log ('dsa_results', 'episodes', 'pairs') are appended with its scenario name, run
+    level tables ('DA Scores', 'RSS Sweep') without one. Each worker process opens its own sink.
+    '''
+    def __init__(self, run_folder_path):
+        self.run_folder_path = run_folder_path
+
+    @abstractmethod
+    def append(self, table, data_df, scenario = None):
+        pass
+
+    def finish(self, table, scenario = None):
+        # Makes everything appended to the table so far readable
+        pass
+
+    @abstractmethod
+    def read(self, table, scenario = None, columns = None):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class CsvSink(ResultSink):
+    '''
+    One CSV file per table and log, <scenario>-<table>.csv, the layout of the legacy script. Appended pieces are
+    written in the column order of the first one, so rows built in another key order still line up.
+    '''
+    def __init__(self, run_folder_path):
+        super().__init__(run_folder_path)
+        # Header of every file written so far
+        self.columns = {}
+
+    def _path(self, table, scenario):
+        return os.path.join(self.run_folder_path, (table if scenario is None else scenario + '-' + table) + '.csv')
+
+    def append(self, table, data_df, scenario = None):
+        path = self._path(table, scenario)
+
+        if path not in self.columns:
+            data_df.to_csv(path, mode='w', header=True, index=False)
+            self.columns[path] = list(data_df.columns)
+            return
+
+        unknown = [column for column in data_df.columns if column not in self.columns[path]]
+        if len(unknown) > 0:
+            raise ValueError('Columns {} are not in the header of {}'.format(unknown, path))
+
+        data_df.reindex(columns=self.columns[path]).to_csv(path, mode='a', header=False, index=False)
+
+    def read(self, table, scenario = None, columns = None):
+        return pd.read_csv(self._path(table, scenario), usecols=columns)
+
+class ParquetSink(ResultSink):
+    '''
+    One Parquet file per table and log, <scenario>-<table>.parquet. Appended rows are written out as row groups
+    of about row_group_rows rows, so a streamed log never has to be held in memory whole. Run level tables are
+    written piece by piece as they are appended, the file is only readable once the sink is closed since Parquet
+    writes its footer last.
+    '''
+    def __init__(self, run_folder_path, compression = config.result_compression, row_group_rows = config.result_row_group_rows):
+        if pa is None:
+            raise ImportError('pyarrow is needed to write Parquet results')
+
+        super().__init__(run_folder_path)
+        self.compression = compression
+        self.row_group_rows = row_group_rows
+        self.writers = {}
+        self.pending = {}
+
+    def _path(self, table, scenario):
+        return os.path.join(self.run_folder_path, (table if scenario is None else scenario + '-' + table) + '.parquet')
+
+    def append(self, table, data_df, scenario = None):
+        key = (table, scenario)
+        self.pending.setdefault(key, []).append(data_df)
+
+        if scenario is None or sum(len(pending_df) for pending_df in self.pending[key]) >= self.row_group_rows:
+            self._flush(key)
+
+    def _flush(self, key):
+        pending = self.pending.pop(key, [])
+        if len(pending) == 0:
+            return
+
+        data_df = cast_columns(key[0], pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0])
+
+        if key not in self.writers:
+            arrow_table = pa.Table.from_pandas(data_df, preserve_index=False)
+            path = self._path(*key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.writers[key] = pq.ParquetWriter(path, arrow_table.schema, compression=self.compression)
+        else:
+            # Later pieces are converted to the schema of the first one, the TABLE_DTYPES columns already match it
+            arrow_table = pa.Table.from_pandas(data_df, schema=self.writers[key].schema, preserve_index=False)
+
+        self.writers[key].write_table(arrow_table, row_group_size=self.row_group_rows)
+
+    def finish(self, table, scenario = None):
+        key = (table, scenario)
+        self._flush(key)
+
+        if key in self.writers:
+            self.writers.pop(key).close()
+
+    def read(self, table, scenario = None, columns = None):
+        self.finish(table, scenario)
+        return pq.read_table(self._path(table, scenario), columns=columns).to_pandas()
+
+    def close(self):
+        for key in list(self.pending.keys()) + list(self.writers.keys()):
+            self.finish(*key)
+
+class DatasetSink(ParquetSink):
+    '''
+    An append-only Arrow dataset per table, partitioned by scenario: <table>/scenario=<scenario>/part-<n>.parquet.
+    Every sink adds new part files and never rewrites existing ones. Read a whole table back with
+    pyarrow.dataset.dataset(path, partitioning='hive'). Every piece of a run level table is its own part file,
+    readable as soon as it is appended. Its columns are cast to TABLE_DTYPES, so that the parts share one schema.
+    '''
+    def append(self, table, data_df, scenario = None):
+        super().append(table, data_df, scenario)
+
+        if scenario is None:
+            self.finish(table)
+
+    def _path(self, table, scenario):
+        folder = os.path.join(self.run_folder_path, table) if scenario is None else os.path.join(self.run_folder_path, table, 'scenario=' + scenario)
+        part = 0
+
+        while os.path.exists(os.path.join(folder, 'part-{}.parquet'.format(part))):
+            part += 1
+
+        return os.path.join(folder, 'part-{}.parquet'.format(part))
+
+    def read(self, table, scenario = None, columns = None):
+        self.finish(table, scenario)
+        folder = os.path.join(self.run_folder_path, table) if scenario is None else os.path.join(self.run_folder_path, table, 'scenario=' + scenario)
+
+        return pq.read_table(folder, columns=columns, partitioning=None).to_pandas()
+
+class SqliteSink(ResultSink):
+    '''
+    One SQLite database per run, results.sqlite, with a table per result table. Rows of per-log tables carry
+    their scenario in SCENARIO_COLUMN. Columns missing from an existing table are added to it.
+
+    A connection is only held for the duration of an append, so that none is inherited by forked worker processes.
+    '''
+    def __init__(self, run_folder_path):
+        super().__init__(run_folder_path)
+        self.path = os.path.join(run_folder_path, 'results.sqlite')
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT)
+        # Lets the summary be read while workers are still writing
+        connection.execute('PRAGMA journal_mode=WAL')
+
+        return connection
+
+    def _quote(self, name):
+        return '"' + name.replace('"', '""') + '"'
+
+    def append(self, table, data_df, scenario = None):
+        if scenario is not None:
+            data_df = data_df.copy()
+            data_df.insert(0, SCENARIO_COLUMN, scenario)
+
+        connection = self._connect()
+
+        try:
+            # Workers write to the same database, the write lock is held from the schema check to the commit
+            connection.execute('BEGIN IMMEDIATE')
+            existing = [row[1] for row in connection.execute('PRAGMA table_info({})'.format(self._quote(table)))]
+
+            if len(existing) > 0:
+                for column in data_df.columns:
+                    if column not in existing:
+                        connection.execute('ALTER TABLE {} ADD COLUMN {}'.format(self._quote(table), self._quote(column)))
+
+            data_df.to_sql(table, connection, if_exists='append', index=False)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def read(self, table, scenario = None, columns = None):
+        selected = '*' if columns is None else ', '.join(self._quote(column) for column in columns)
+        query = 'SELECT {} FROM {}'.format(selected, self._quote(table))
+        connection = self._connect()
+
+        try:
+            if scenario is None:
+                return pd.read_sql_query(query, connection)
+
+            return pd.read_sql_query(query + ' WHERE {} = ?'.format(self._quote(SCENARIO_COLUMN)), connection, params=[scenario])
+        finally:
+            connection.close()
+
+def open_sink(run_folder_path, result_format = config.result_format):
+    '''
+    The sink writing result_format, one of RESULT_FORMATS, into run_folder_path.
+    '''
+    if result_format == 'csv':
+        return CsvSink(run_folder_path)
+    elif result_format == 'parquet':
+        return ParquetSink(run_folder_path)
+    elif result_format == 'dataset':
+        return DatasetSink(run_folder_path)
+    elif result_format == 'sqlite':
+        return SqliteSink(run_folder_path)
+
+    raise ValueError('Unknown result format {}, expected one of {}'.format(result_format, RESULT_FORMATS))
+
+# End result sinks
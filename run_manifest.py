@@ -0,0 +1,257 @@
+# This script will serve to remember which logs have been scored, with which configuration and where their
+# results were saved, so that a rerun of an experiment folder only scores new or modified logs.
+
+# -- Begin imports
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import config
+import log_cache
+import metrics_formulas as mf
+import result_sink
+
+# -- End imports
+
+
+# -- Begin global variables
+
+# Bump when the scoring changes in a way the configuration does not show, so that every log is rescored
+MANIFEST_VERSION = 1
+
+# Kept in the Output folder of the experiment, one JSON object per line, appended as logs complete
+MANIFEST_NAME = 'manifest.jsonl'
+
+# Config values that change how a run executes but not what it produces
+OPERATIONAL_PARAMETERS = ['batch_engine_tolerance', 'prune_frames', 'formula_backend', 'batch_workers',
+                          'batch_queue_per_worker', 'stream_logs', 'stream_chunk_rows', 'use_log_cache', 'log_cache_path',
+                          'log_cache_format', 'resume_runs', 'profile_stages', 'profile_window', 'log_level']
+
+NUMBER = (int, float)
+NONE = type(None)
+
+# Types of the config values checked before a run, bools are never accepted as numbers
+CONFIG_TYPES = {
+    'mu': NUMBER, 'sevm_n': NUMBER, 'emi_lon_acc_limit': NUMBER, 'emi_lat_acc_limit': NUMBER, 'sert_limit': NUMBER,
+    'ort_limit': NUMBER, 'ser_min': NUMBER, 'ser_max': NUMBER, 'ttc_max': NUMBER, 'mttc_max': NUMBER, 'thw_max': NUMBER,
+    'pet_radius': NUMBER, 'multi_actor_vut_id': str, 'multi_actor_broad_phase': bool,
+    'multi_actor_cull_distance': NUMBER + (NONE,), 'episode_tables': bool, 'visualize_logs': bool,
+    'report_max_points': int, 'report_downsampling': str, 'report_plotlyjs': (bool, str), 'render_scenarios': bool,
+    'render_format': str, 'render_every': int, 'render_plot_option': int, 'render_dpi': NUMBER,
+    'batch_engine_tolerance': NUMBER, 'prune_frames': bool, 'formula_backend': str, 'triage_logs': bool,
+    'triage_padding': int, 'triage_merge_gap': int, 'resample_rate': NUMBER + (NONE,), 'profile_stages': bool,
+    'profile_window': int, 'log_level': str, 'batch_workers': (int, NONE), 'batch_queue_per_worker': int,
+    'resume_runs': bool, 'stream_logs': bool, 'stream_chunk_rows': int, 'result_format': str,
+    'result_compression': str, 'result_row_group_rows': int, 'use_log_cache': bool, 'log_cache_path': (str, NONE),
+    'log_cache_format': str, 'sweep_block_size': int,
+}
+
+# Config values that must be one of a few choices
+CONFIG_CHOICES = {
+    'report_downsampling': ['minmax', 'lttb'],
+    'render_format': ['mp4', 'gif', 'png'],
+    'render_plot_option': [1, 2, 3],
+    'formula_backend': ['numpy', 'numba'],
+    'log_level': ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+    'result_format': result_sink.RESULT_FORMATS,
+    'log_cache_format': ['feather', 'npy'],
+}
+
+# Config values that must be above 0 when they are set
+CONFIG_POSITIVE = ['report_max_points', 'render_every', 'render_dpi', 'resample_rate', 'profile_window', 'batch_workers',
+                   'batch_queue_per_worker', 'stream_chunk_rows', 'result_row_group_rows', 'sweep_block_size']
+
+# Config values that must be at least 0 when they are set
+CONFIG_NON_NEGATIVE = ['multi_actor_cull_distance', 'triage_padding', 'triage_merge_gap', 'batch_engine_tolerance']
+
+# End global variables
+
+
+# Begin configuration fingerprint
+
+def config_snapshot(sweep = False):
+    '''
+    Every config value the results depend on, RSS parameters included, as a JSON serialisable dict. The sweep
+    parameters only count for sweeps and the benchmark parameters never do.
+    '''
+    snapshot = {'manifest version': MANIFEST_VERSION, 'sweep': sweep}
+
+    for name in sorted(vars(config)):
+        value = getattr(config, name)
+
+        if name.startswith('_') or name in OPERATIONAL_PARAMETERS or name.startswith('benchmark_'):
+            continue
+        if name.startswith('sweep_') and not sweep:
+            continue
+
+        if isinstance(value, config.RssParameters):
+            snapshot[name] = dict(vars(value))
+        elif isinstance(value, (bool, int, float, str, list, dict, type(None))):
+            snapshot[name] = value
+
+    return snapshot
+
+def config_fingerprint(snapshot):
+    return hashlib.blake2b(json.dumps(snapshot, sort_keys=True, default=str).encode(), digest_size=12).hexdigest()
+
+# End configuration fingerprint
+
+
+# Begin configuration checks
+
+def _is_type(value, types):
+    types = types if isinstance(types, tuple) else (types,)
+
+    if isinstance(value, bool):
+        return bool in types
+    return isinstance(value, types)
+
+def _is_number_list(value, length = None):
+    return isinstance(value, list) and (length is None or len(value) == length) and all(_is_type(item, NUMBER) for item in value)
+
+def config_errors(sweep = False):
+    '''
+    Every problem with the types and values of the config module, as messages. The metric names, RSS parameters,
+    dimensions and, for sweeps, the sweep parameters are checked as well.
+    '''
+    errors = []
+
+    for name, types in CONFIG_TYPES.items():
+        if not hasattr(config, name):
+            errors.append('config.{} is missing'.format(name))
+            continue
+
+        value = getattr(config, name)
+        type_names = [t.__name__ for t in (types if isinstance(types, tuple) else (types,))]
+
+        if not _is_type(value, types):
+            errors.append('config.{} is {!r}, expected {}'.format(name, value, ' or '.join(type_names)))
+        elif name in CONFIG_CHOICES and value not in CONFIG_CHOICES[name]:
+            errors.append('config.{} is {!r}, expected one of {}'.format(name, value, CONFIG_CHOICES[name]))
+        elif value is not None and name in CONFIG_POSITIVE and not value > 0:
+            errors.append('config.{} is {!r}, expected a value above 0'.format(name, value))
+        elif value is not None and name in CONFIG_NON_NEGATIVE and not value >= 0:
+            errors.append('config.{} is {!r}, expected a value of at least 0'.format(name, value))
+
+    for name in sorted(vars(config)):
+        value = getattr(config, name)
+
+        if isinstance(value, config.RssParameters):
+            for parameter, parameter_value in vars(value).items():
+                if not _is_type(parameter_value, NUMBER):
+                    errors.append('config.{}.{} is {!r}, expected a number'.format(name, parameter, parameter_value))
+
+    for name in ['vut_dimensions', 'challenger_dimensions', 'render_figure_size']:
+        value = getattr(config, name, None)
+        if not _is_number_list(value, 2) or not all(item > 0 for item in value):
+            errors.append('config.{} is {!r}, expected a list of two numbers above 0'.format(name, value))
+
+    if not isinstance(getattr(config, 'metrics', None), list):
+        errors.append('config.metrics is {!r}, expected a list of metric names'.format(getattr(config, 'metrics', None)))
+    else:
+        try:
+            mf.resolve_metrics(config.metrics)
+        except ValueError as e:
+            errors.append('config.metrics: {}'.format(e))
+
+    if sweep:
+        for name in ['sweep_vut_rss', 'sweep_challenger_rss']:
+            value = getattr(config, name, None)
+
+            if not isinstance(value, dict):
+                errors.append('config.{} is {!r}, expected a dict of RSS parameter names to lists of values'.format(name, value))
+                continue
+
+            for parameter, values in value.items():
+                if parameter not in mf.RSS_PARAMETER_NAMES:
+                    errors.append('config.{} has unknown RSS parameter {!r}, expected one of {}'.format(name, parameter, mf.RSS_PARAMETER_NAMES))
+                elif not _is_number_list(values) or len(values) == 0:
+                    errors.append('config.{}[{!r}] is {!r}, expected a list of numbers'.format(name, parameter, values))
+
+    return errors
+
+def check_config(sweep = False):
+    '''
+    Raises ValueError listing every problem config_errors finds, so that a bad configuration fails before any log
+    is handed to a worker.
+    '''
+    errors = config_errors(sweep)
+
+    if len(errors) > 0:
+        raise ValueError('Invalid configuration:\n  ' + '\n  '.join(errors))
+
+# End configuration checks
+
+
+# Begin manifest
+
+def file_signature(file, digest = True):
+    # Size and modification time are checked first, the content hash only when they changed
+    stat = os.stat(file)
+    signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    if digest:
+        signature['hash'] = log_cache.hash_file(file)
+
+    return signature
+
+def is_unchanged(entry, file):
+    '''
+    True when file still has the contents it had when entry was recorded. Only files whose size or modification
+    time changed are hashed again, so checking thousands of unchanged logs only costs a stat each.
+    '''
+    signature = file_signature(file, digest=False)
+
+    if signature['size'] != entry['size']:
+        return False
+    if signature['mtime_ns'] == entry['mtime_ns']:
+        return True
+
+    return log_cache.hash_file(file) == entry['hash']
+
+def load_manifest(output_path):
+    '''
+    The latest entry of every scored log, keyed by (file name, config fingerprint). A line cut short by an
+    interrupted run is ignored.
+    '''
+    manifest = {}
+    manifest_name = os.path.join(output_path, MANIFEST_NAME)
+
+    if not os.path.exists(manifest_name):
+        return manifest
+
+    with open(manifest_name) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+
+            if entry.get('type') == 'log':
+                manifest[(entry['file'], entry['config'])] = entry
+
+    return manifest
+
+def _append(output_path, entry):
+    # numpy scalars in the summary rows are written as plain numbers
+    with open(os.path.join(output_path, MANIFEST_NAME), 'a') as f:
+        f.write(json.dumps(entry, default=lambda value: value.item() if hasattr(value, 'item') else str(value)) + '\n')
+
+def record_run(output_path, run_folder_path, snapshot):
+    _append(output_path, {'type': 'run', 'run': run_folder_path, 'config': config_fingerprint(snapshot),
+                          'started': datetime.now().isoformat(timespec='seconds'), 'config values': snapshot})
+
+def record_log(output_path, file, signature, fingerprint, run_folder_path, rows, seconds):
+    '''
+    Records a scored log: its signature (file_signature), the config it was scored with, where its results are,
+    its summary rows and how long it took.
+    '''
+    entry = {'type': 'log', 'file': os.path.basename(file), 'config': fingerprint, 'run': run_folder_path,
+             'scored': datetime.now().isoformat(timespec='seconds'), 'seconds': seconds, 'rows': rows}
+    entry.update(signature)
+
+    _append(output_path, entry)
+
+# End manifest
@@ -1 +1,353 @@
-# This script will serve to create the visualization of the scenario.
\ No newline at end of file
+# This script will serve to create the visualization of the scenario.
+
+# -- Begin imports
+
+import numpy as np
+import os
+
+import config
+import object as so
+
+try:
+    import plotly.graph_objects as go
+except ImportError:
+    go = None
+
+# The scenario renderer draws on an off-screen Agg canvas, so it never needs a display
+try:
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import matplotlib
+except ImportError:
+    Figure = None
+
+# -- End imports
+
+
+# -- Begin global variables
+
+# Per-frame result columns shown in the report, in legend order
+PLOT_COLUMNS = ['SEI', 'SEV', 'SEVM', 'SERTV', 'SERTVM', 'EMI', 'EMIM', 'CI', 'CIM', 'ORTV', 'ORTVM', 'DA Score',
+                'VUT Accel', 'VUT Speed', 'Distance to SO', 'Safety Envelope Distance']
+
+line_colors = [
+    'rgba(31, 119, 180, 1)',            # muted blue
+    'rgba(255, 127, 14, 1)',            # safety orange
+    'rgba(44, 160, 44, 1)',             # cooked asparagus green
+    'rgba(214, 39, 40, 1)',             # brick red
+    'rgba(148, 103, 189, 1)',           # muted purple
+    'rgba(140, 86, 75, 1)',             # chestnut brown
+    'rgba(227, 119, 194, 1)',           # raspberry yogurt pink
+    'rgba(127, 127, 127, 1)',           # middle gray
+    'rgba(188, 189, 34, 1)',            # curry yellow-green
+    'rgba(23, 190, 207, 1)'             # blue-teal
+]
+
+# End global variables
+
+
+# Begin downsampling
+
+def minmax_indices(y, max_points):
+    '''
+    Indices of the points kept by min/max decimation: the smallest and largest value of each of max_points / 2
+    equal buckets, plus the first and last point. Spikes such as a single SEI frame always survive.
+    '''
+    y = np.asarray(y, dtype=np.float64)
+    frames = len(y)
+
+    if frames <= max_points:
+        return np.arange(frames)
+
+    buckets = max(max_points // 2 - 1, 1)
+    bucket_size = -(-frames // buckets)
+
+    # Pad to whole buckets, nan never wins either reduction
+    padded = np.full(buckets * bucket_size, np.nan)
+    padded[:frames] = y
+    padded = padded.reshape(buckets, bucket_size)
+
+    offsets = np.arange(buckets) * bucket_size
+    lowest = offsets + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+    highest = offsets + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+
+    indices = np.concatenate([[0, frames - 1], lowest, highest])
+
+    return np.unique(indices[indices < frames])
+
+def lttb_indices(x, y, max_points):
+    '''
+    Indices of the points kept by Largest-Triangle-Three-Buckets: the first and last point, and from every
+    bucket in between the point spanning the largest triangle with the previous kept point and the next
+    bucket's average.
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    frames = len(y)
+
+    if frames <= max_points or max_points < 3:
+        return np.arange(frames)
+
+    bounds = np.linspace(1, frames - 1, max_points - 1).astype(np.int64)
+    indices = np.zeros(max_points, dtype=np.int64)
+    indices[-1] = frames - 1
+    previous = 0
+
+    for bucket in range(max_points - 2):
+        start, end = bounds[bucket], bounds[bucket + 1]
+        next_start, next_end = end, bounds[bucket + 2] if bucket + 2 < len(bounds) else frames
+
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+
+        area = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (average_y - y[previous]))
+
+        previous = start + int(np.argmax(area))
+        indices[bucket + 1] = previous
+
+    return indices
+
+def downsample(x, y, max_points = config.report_max_points, method = config.report_downsampling):
+    '''
+    Returns [x, y] reduced to about max_points points with method 'minmax' or 'lttb'.
+    '''
+    if method == 'minmax':
+        indices = minmax_indices(y, max_points)
+    elif method == 'lttb':
+        indices = lttb_indices(x, y, max_points)
+    else:
+        raise ValueError('Unknown downsampling method {}, expected minmax or lttb'.format(method))
+
+    return [np.asarray(x)[indices], np.asarray(y)[indices]]
+
+# End downsampling
+
+
+# Begin report
+
+def columns_to_plot(df):
+    return [col for col in PLOT_COLUMNS if col in df.columns]
+
+def aggregate_frames(df, columns):
+    '''
+    Mean of every column per timestamp, in one groupby. Logs with one row per timestamp are returned as is.
+    '''
+    timestamp = df['timestamp']
+
+    if timestamp.is_monotonic_increasing and timestamp.is_unique:
+        return df[['timestamp'] + columns].reset_index(drop=True)
+
+    return df.groupby('timestamp', sort=True)[columns].mean().reset_index()
+
+def create_visualizations(df, output_path, scenario_name, max_points = config.report_max_points, method = config.report_downsampling):
+    '''
+    Saves the interactive report of a scored log to Interactive_DV-<scenario_name>.html in output_path.
+
+    Every metric is plotted over time as a WebGL trace, downsampled to max_points points so that the file size and
+    the browser load do not grow with the length of the log. Returns the path of the report, None when it could
+    not be saved.
+    '''
+    if go is None:
+        print('ERROR: plotly is not installed, the Plotly plot was not saved.')
+        return None
+
+    columns = columns_to_plot(df)
+    frames_df = aggregate_frames(df, columns)
+    time_stamps = frames_df['timestamp'].to_numpy(dtype=np.float64)
+
+    fig = go.Figure()
+
+    for color_index, col in enumerate(columns):
+        x, y = downsample(time_stamps, frames_df[col].to_numpy(dtype=np.float64), max_points, method)
+
+        fig.add_trace(go.Scattergl(x=x, y=y, mode='lines', line_color=line_colors[color_index % len(line_colors)], legendgroup=col, name=col))
+
+    fig.update_layout(title = scenario_name + ' Interactive Data Visualization', xaxis_title='Time (seconds)', yaxis_title='Value', legend_title='Legend')
+
+    report_name = os.path.join(output_path, 'Interactive_DV-' + scenario_name + '.html')
+
+    try:
+        fig.write_html(report_name, include_plotlyjs=config.report_plotlyjs)
+    except Exception as e:
+        print('ERROR: Plotly plot was not saved successfully: {}'.format(repr(e)))
+        return None
+
+    return report_name
+
+# End report
+
+
+# Begin scenario rendering
+
+class ScenarioRenderer:
+    '''
+    Headless renderer of the VUT and challenger boxes of a log, frame by frame.
+
+    One figure is reused for every frame: the axes are drawn once and saved as the background, then each frame
+    only restores the background and redraws the moving artists (blitting). The boxes of every frame are computed
+    up front with so.OrientedBox.
+
+    Plotting options: 1: boxes and front bumpers, 2: + rear bumpers and sides, 3: + heading vectors and side rays.
+    '''
+    def __init__(self, data_df, vut_dimensions = config.vut_dimensions, challenger_dimensions = config.challenger_dimensions,
+                 plot_option = config.render_plot_option, figure_size = config.render_figure_size, dpi = config.render_dpi):
+        if Figure is None:
+            raise ImportError('matplotlib is needed to render scenarios')
+
+        vut_trajectory = so.Trajectory.from_columns(data_df, 'VUT')
+
+        self.data_df = data_df
+        self.vut = vut_trajectory.box(vut_dimensions)
+        self.challenger = so.Trajectory.from_columns(data_df, 'challenger').box(challenger_dimensions)
+        self.timestamp = vut_trajectory.timestamp
+        self.plot_option = plot_option
+
+        self.figure = Figure(figsize=figure_size, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+
+        # The whole log stays in view, the same limits as the legacy draw_scenario
+        x = np.concatenate([self.vut.center[:, 0], self.challenger.center[:, 0]])
+        y = np.concatenate([self.vut.center[:, 1], self.challenger.center[:, 1]])
+        self.axes.set_xlim(np.nanmin(x) - 20, np.nanmax(x) + 20)
+        self.axes.set_ylim(np.nanmin(y) - 20, np.nanmax(y) + 20)
+        self.axes.set_aspect('equal', adjustable='box')
+        self.axes.set_xlabel('x (m)')
+        self.axes.set_ylabel('y (m)')
+
+        # [artist, box, segments of the box to draw], the segments are looked up per frame
+        self.lines = []
+        for box, color in [[self.vut, 'tab:blue'], [self.challenger, 'tab:orange']]:
+            self.lines.append([self._line(color, 1.5), box, 'outline'])
+            self.lines.append([self._line(color, 0, marker='.'), box, 'front'])
+
+            if plot_option > 1:
+                self.lines.append([self._line('tab:green', 1), box, 'rear_bumper'])
+                self.lines.append([self._line('tab:purple', 1), box, 'left_side'])
+                self.lines.append([self._line('tab:brown', 1), box, 'right_side'])
+
+            if plot_option > 2:
+                self.lines.append([self._line(color, 0.5, linestyle='--'), box, 'heading_vector'])
+                self.lines.append([self._line('tab:gray', 0.5, linestyle=':'), box, 'left_side_line'])
+                self.lines.append([self._line('tab:gray', 0.5, linestyle=':'), box, 'right_side_line'])
+
+        self.label = self.axes.text(0.02, 0.98, '', transform=self.axes.transAxes, va='top', family='monospace', animated=True)
+
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def _line(self, color, width, **kwargs):
+        line, = self.axes.plot([], [], color=color, linewidth=width, animated=True, **kwargs)
+        return line
+
+    def _label_text(self, index):
+        text = 't = {:.2f} s'.format(self.timestamp[index])
+
+        for col in ['SEI', 'SEV', 'DA Score']:
+            if col in self.data_df.columns:
+                text += '   {} {:g}'.format(col, self.data_df[col].iloc[index])
+
+        return text
+
+    def render_frame(self, index):
+        '''
+        Draws frame index and returns it as an RGBA array of shape (height, width, 4).
+        '''
+        self.canvas.restore_region(self.background)
+
+        for line, box, part in self.lines:
+            if part == 'outline':
+                points = box.corners[[0, 1, 2, 3, 0], index]
+            elif part == 'front':
+                points = box.front[index][None]
+            else:
+                start, end = getattr(box, part)
+                points = np.stack([start[index], end[index]])
+
+            line.set_data(points[:, 0], points[:, 1])
+            self.axes.draw_artist(line)
+
+        self.label.set_text(self._label_text(index))
+        self.axes.draw_artist(self.label)
+
+        self.canvas.blit(self.figure.bbox)
+
+        return np.asarray(self.canvas.buffer_rgba()).copy()
+
+    def frames(self, every = 1):
+        # Every every-th frame of the log, as [index, image]
+        for index in range(0, len(self.timestamp), every):
+            yield [index, self.render_frame(index)]
+
+def _frame_rate(timestamp, every):
+    # Plays the log back in real time, 10 frames per second when the timestamps do not tell
+    steps = np.diff(np.asarray(timestamp, dtype=np.float64))
+    steps = steps[steps > 0]
+
+    if len(steps) == 0:
+        return 10
+
+    return max(1.0 / (np.median(steps) * every), 1)
+
+def _write_mp4(frames, output_name, fps):
+    import subprocess
+
+    process = None
+
+    for _, image in frames:
+        if process is None:
+            height, width = image.shape[:2]
+            process = subprocess.Popen([matplotlib.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+                                        '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '{}x{}'.format(width, height), '-r', str(fps), '-i', '-',
+                                        # yuv420p needs even dimensions
+                                        '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', output_name],
+                                       stdin=subprocess.PIPE)
+
+        process.stdin.write(image.tobytes())
+
+    if process is not None:
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError('ffmpeg could not write {}'.format(output_name))
+
+def _write_gif(frames, output_name, fps):
+    from PIL import Image
+
+    # Palette images keep one byte per pixel, GIFs are written in one go
+    images = [Image.fromarray(image[:, :, :3]).quantize(colors=64, method=Image.Quantize.FASTOCTREE) for _, image in frames]
+
+    if len(images) > 0:
+        images[0].save(output_name, save_all=True, append_images=images[1:], duration=int(1000 / fps), loop=0)
+
+def _write_images(frames, output_name):
+    import matplotlib.image
+
+    os.makedirs(output_name, exist_ok=True)
+
+    for index, image in frames:
+        matplotlib.image.imsave(os.path.join(output_name, 'frame_{:06d}.png'.format(index)), image)
+
+def render_scenario(data_df, output_name, every = config.render_every, fps = None, **renderer_options):
+    '''
+    Renders every every-th frame of a log to output_name: an .mp4 (needs ffmpeg), a .gif, or otherwise a folder
+    of PNG images named by frame. fps defaults to real time playback. Returns output_name.
+    '''
+    renderer = ScenarioRenderer(data_df, **renderer_options)
+    frames = renderer.frames(every)
+
+    if fps is None:
+        fps = _frame_rate(renderer.timestamp, every)
+
+    extension = os.path.splitext(output_name)[1].lower()
+
+    if extension == '.mp4':
+        _write_mp4(frames, output_name, fps)
+    elif extension == '.gif':
+        _write_gif(frames, output_name, fps)
+    else:
+        _write_images(frames, output_name)
+
+    return output_name
+
+# End scenario rendering